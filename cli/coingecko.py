@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the parts of the CoinGecko API we use, prices are
+synthetic but deterministic so runs can be compared with each other.
+
+Example:
+    python3 cli/coingecko.py --port 8001 --rate 50
+    COINGECKO_API=http://localhost:8001/api/v3 gunicorn ... main:app
+
+Every request is counted and `GET /stats` returns the counts, `--rate` makes
+it answer with 429s once more than that many requests were made within a
+minute, like the public API does.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+import threading
+import argparse
+import hashlib
+import json
+import math
+import time
+import re
+
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+STABLES = ['usd', 'dai', 'tether', 'frax', 'magic-internet-money']
+
+stats: Counter = Counter()
+seen: deque = deque()
+lock = threading.Lock()
+rate: Optional[int] = None
+
+
+def price(_id: str, ts: float) -> float:
+    days = (ts - EPOCH.timestamp()) / 86400
+
+    if any(x in _id for x in STABLES):
+        return round(1 + 0.002 * math.sin(days), 6)
+
+    seed = int(hashlib.md5(_id.encode()).hexdigest()[:8], 16)
+    base = 10**(seed % 700 / 100 - 3)
+    return round(base * (1 + 0.25 * math.sin(days / 7 + seed)), 8)
+
+
+def simple_price(query: Dict[str, str]) -> Any:
+    now = time.time()
+    return {
+        _id: {x: price(_id, now)
+              for x in query['vs_currencies'].split(',')}
+        for _id in query['ids'].split(',') if _id
+    }
+
+
+def market_chart_range(_id: str, query: Dict[str, str]) -> Any:
+    start, end = int(query['from']), int(query['to'])
+    # Same granularity as the real thing.
+    if end - start > 90 * 86400:
+        step = 86400
+    elif end - start > 86400:
+        step = 3600
+    else:
+        step = 300
+
+    ts = start - start % step + step if start % step else start
+    prices = []
+    while ts <= end:
+        prices.append([ts * 1000, price(_id, ts)])
+        ts += step
+
+    return {'prices': prices, 'market_caps': [], 'total_volumes': []}
+
+
+def history(_id: str, query: Dict[str, str]) -> Any:
+    dt = datetime.strptime(query['date'],
+                           '%d-%m-%Y').replace(tzinfo=timezone.utc)
+    return {
+        'id': _id,
+        'market_data': {
+            'current_price': {
+                'usd': price(_id, dt.timestamp())
+            }
+        }
+    }
+
+
+ROUTES = [
+    (re.compile(r'^/api/v3/simple/price$'), simple_price),
+    (re.compile(r'^/api/v3/coins/([^/]+)/market_chart/range$'),
+     market_chart_range),
+    (re.compile(r'^/api/v3/coins/([^/]+)/history$'), history),
+]
+
+
+class Handler(BaseHTTPRequestHandler):
+    def _send(self, status: int, data: Any) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _limited(self) -> bool:
+        if rate is None:
+            return False
+
+        now = time.time()
+        with lock:
+            while seen and seen[0] < now - 60:
+                seen.popleft()
+
+            if len(seen) >= rate:
+                return True
+
+            seen.append(now)
+            return False
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._send(200, dict(stats))
+
+        for pattern, func in ROUTES:
+            if (match := pattern.match(url.path)) is None:
+                continue
+
+            stats[func.__name__] += 1
+            if self._limited():
+                stats['rate_limited'] += 1
+                return self._send(429, {'error': 'rate limited'})
+
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                return self._send(200, func(*match.groups(), query))
+            except (KeyError, ValueError) as e:
+                return self._send(400, {'error': repr(e)})
+
+        self._send(404, {'error': 'not found'})
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--rate',
+                        type=int,
+                        default=None,
+                        help='requests per minute before answering with 429')
+    args = parser.parse_args()
+    rate = args.rate
+
+    print(f'serving on http://{args.host}:{args.port}/api/v3')
+    ThreadingHTTPServer((args.host, args.port), Handler).serve_forever()
@@ -33,11 +33,16 @@ from flask.wrappers import Response
 import simplejson as json
 from flask import Flask
 
-from syn.cron import update_prices, update_getlogs, update_getlogs_pool, \
-    update_prices_missing
+from syn.cron import update_prices, update_prices_missing, warm_cache, \
+    backfill_usd
 from syn.utils.data import cache, SCHEDULER_CONFIG, schedular, \
-    MESSAGE_QUEUE_REDIS
+    MESSAGE_QUEUE_REDIS, POPULATE_CACHE
 from syn.utils.helpers import worker_assert_lock
+from syn.utils.cache import listen_invalidations
+from syn.utils.offload import watch_hub
+from syn.utils.coingecko import migrate_price_keys
+from syn.utils.price import CoingeckoIDS
+from syn.indexer import ROLES, Indexer
 
 import os
 
@@ -50,10 +55,15 @@ def _first_run() -> None:
 
     print(f'worker({os.getpid()}), acquired the lock')
 
-    update_getlogs_pool()
-    update_getlogs()
+    # Prices used to be stored as a key per (id, date, currency).
+    migrate_price_keys([x.value for x in CoingeckoIDS])
+
     update_prices()
     update_prices_missing()
+    # Aggregates indexed before usd values were stored along with them.
+    backfill_usd()
+    # Make sure nobody hits a cold view after a deploy.
+    warm_cache(force=POPULATE_CACHE)
 
     # We want schedular to start AFTER.
     schedular.start()
@@ -62,10 +72,12 @@ def _first_run() -> None:
     lock.release()
 
 
-gevent.spawn(_first_run)
-
-
-def init() -> Flask:
+def init(mode: str = 'web') -> Flask:
+    """
+    Create the app, `web` serves requests while `indexer` (see
+    :func:`run_indexer`) only needs it to warm the cache.
+    """
+    assert mode in ['web', 'indexer'], f'unknown mode: {mode}'
     app = Flask(__name__)
     app.json_encoder = json.JSONEncoder  # type: ignore
     app.json_decoder = json.JSONDecoder  # type: ignore
@@ -103,6 +115,16 @@ def init() -> Flask:
     schedular.init_app(app)
     cache.init_app(app)
 
+    # Drop in process copies when other workers (or nodes) change the data.
+    gevent.spawn(listen_invalidations)
+    # Tracks how long requests (or anything else) hold up the hub.
+    gevent.spawn(watch_hub)
+
+    if mode == 'web':
+        # Live bridge events, see `syn.routes.api.v1.explorer.ws`.
+        from .routes.api.v1.explorer.ws import init_app
+        init_app(app)
+
     @app.after_request
     def after_request(response: Response) -> Response:
         header = response.headers
@@ -123,3 +145,15 @@ def init() -> Flask:
     )
 
     return app
+
+
+def run_indexer() -> None:
+    """
+    Run the indexer, price jobs and scheduler without serving requests,
+    see `python -m syn`. Web workers never do any of these, with `--preload`
+    gunicorn's master would run them too.
+    """
+    init('indexer')
+    gevent.spawn(_first_run)
+    gevent.joinall([gevent.spawn(Indexer(role=x).run) for x in ROLES],
+                   raise_error=True)
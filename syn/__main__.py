@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+`python -m syn` runs the indexer, price jobs and scheduler, the web workers
+(`main:app`) only serve requests.
+"""
+
+from syn import run_indexer
+
+if __name__ == '__main__':
+    run_indexer()
@@ -9,25 +9,27 @@
 
 from contextlib import contextmanager
 from datetime import date, datetime
-from typing import Generator
+from typing import Dict, Generator, List
+from collections import defaultdict
 from functools import wraps
 from decimal import Decimal
 import traceback
 import time
 import os
 
-import simplejson as json
 from web3 import Web3
-import requests
 
 from syn.utils.data import (LOGS_REDIS_URL, schedular, MESSAGE_QUEUE_REDIS,
-                            REDIS, COINGECKO_HISTORIC_URL, SYN_DATA)
-from syn.utils.helpers import dispatch_get_logs, worker_assert_lock, date2block
-from syn.utils.analytics.pool import pool_callback
-from syn.utils.cache import _serialize_args_to_str
-from syn.utils.wrappa.rpc import bridge_callback
+                            SYN_DATA)
+from syn.utils.helpers import worker_assert_lock, date2block
+from syn.utils.analytics.partition import PRICES_HISTORIC
+from syn.utils.analytics.usd import backfill, reprice
+from syn.utils.cache import bump_version
 from syn.utils.contract import get_balance_of
 from syn.utils.price import CoingeckoIDS, get_historic_price
+from syn.utils.warm import warm
+from syn.indexer import redo_dead_letter
+from syn.utils import coingecko, stream
 
 
 def acquire_lock(name: str):
@@ -53,10 +55,15 @@ def acquire_lock(name: str):
     return _decorator
 
 
+def trigger_warm_cache() -> None:
+    # Warm whatever a run changed right away, instead of at the next interval.
+    if schedular.running:
+        schedular.modify_job('warm_cache', next_run_time=datetime.now())
+
+
 def get_price_cg(_id: str, date: str) -> Decimal:
-    time.sleep(1)
-    r = requests.get(COINGECKO_HISTORIC_URL.format(_id, date))
-    return r.json(use_decimal=True)['market_data']['current_price']['usd']
+    _date = datetime.strptime(date, '%d-%m-%Y').date()
+    return coingecko.get_historic_price(_id, _date)
 
 
 def get_price_xjewel(_date: date) -> Decimal:
@@ -70,7 +77,7 @@ def get_price_xjewel(_date: date) -> Decimal:
         "0x77f2656d04E158f915bC22f07B779D94c1DC47Ff",  # xJEWEL
     ]
 
-    # Different logic if date is today as we cannot assume `update_getlogs`
+    # Different logic if date is today as we cannot assume the indexer
     # has ran before this function and thus cannot assume `date2block`
     # will return a valid result.
     if _date == date.today():
@@ -91,17 +98,24 @@ def get_price_xjewel(_date: date) -> Decimal:
     return jewel_price * t0bal / t1bal
 
 
-def get_price(_id: str, date: date) -> Decimal:
-    CUSTOM_PRICE_FUNCS = {
-        #  'custom-xjewel': get_price_xjewel,
-    }
+CUSTOM_PRICE_FUNCS = {
+    #  'custom-xjewel': get_price_xjewel,
+}
 
+
+def get_price(_id: str, date: date) -> Decimal:
     if _id in CUSTOM_PRICE_FUNCS:
         return CUSTOM_PRICE_FUNCS[_id](date)
 
     return get_price_cg(_id, date.strftime('%d-%m-%Y'))
 
 
+def reprice_bridge(prices: Dict[str, Dict[date, Decimal]]) -> None:
+    # Only the bridge aggregates of the filled (chain, token, date)s.
+    for chain in reprice({k: list(v) for k, v in prices.items()}):
+        bump_version(f'bridge:{chain}')
+
+
 @schedular.task("cron", id="update_prices", hour=0, minute=10, max_instances=1)
 @acquire_lock('update_prices')
 def update_prices():
@@ -112,22 +126,41 @@ def update_prices():
     date = _now.strftime('%Y-%m-%d')
     date_cg = _now.date()
 
-    for x in CoingeckoIDS:
-        _key = _serialize_args_to_str(x, date)
-        keys = [_key, f'{_key}:usd']
+    ids = [x.value for x in CoingeckoIDS]
+    stored = coingecko.load_prices({x: [date_cg] for x in ids})
+    todo = [x for x in ids if date_cg not in stored[x]]
+
+    prices = {}
+    try:
+        prices = {
+            k: {
+                date_cg: v
+            }
+            for k, v in coingecko.get_current_prices(
+                [x for x in todo if x not in CUSTOM_PRICE_FUNCS]).items()
+        }
+    except Exception:
+        traceback.print_exc()
+
+    for x in todo:
+        if x in CUSTOM_PRICE_FUNCS:
+            try:
+                prices[x] = {date_cg: get_price(x, date_cg)}
+            except Exception:
+                traceback.print_exc()
 
-        for key in keys:
-            if REDIS.get(key) is None:
-                try:
-                    REDIS.setnx(key, json.dumps(get_price(x.value, date_cg)))
-                except Exception as e:
-                    MESSAGE_QUEUE_REDIS.sadd('prices:missing', key)
+    missing = [f'{x}:{date}' for x in todo if x not in prices]
+    if missing:
+        MESSAGE_QUEUE_REDIS.sadd('prices:missing', *missing)
+        print(f'no price for: {missing}')
 
-                    if not type(e) == KeyError:
-                        traceback.print_exc()
-                        print(key)
-            else:
-                print(f'{key} has a value??')
+    filled = bool(coingecko.store_prices(prices))
+
+    if filled:
+        # Price whatever got indexed today before the price was known.
+        reprice_bridge(prices)
+        bump_version('prices')
+        trigger_warm_cache()
 
     print(f'(0) Cron job done. Elapsed: {time.time() - start:.2f}s')
 
@@ -141,61 +174,103 @@ def update_prices_missing():
     start = time.time()
     print(f'(1) [{start}] Cron job start.')
 
-    keys = MESSAGE_QUEUE_REDIS.smembers('prices:missing')
+    # {cgid: {date: [member, ...]}}, members from before prices were
+    # stored per id may have a `:usd` suffix.
+    members: Dict[str, Dict[date, List[str]]] = defaultdict(
+        lambda: defaultdict(list))
 
-    for key in keys:
-        # TODO(blaze): remove now or later?
-        MESSAGE_QUEUE_REDIS.srem('prices:missing', 1, key)
+    for x in MESSAGE_QUEUE_REDIS.smembers('prices:missing'):
+        _id, _date = x.split(':')[:2]
+        members[_id][datetime.fromisoformat(_date).date()].append(x)
 
-        # Check if price is actually missing
-        if (_ := REDIS.get(key)) is None or _ == '0':
-            if (key.endswith(':usd')):
-                if (data := REDIS.get(key.replace(':usd', ''))) is not None:
-                    REDIS.setnx(key, data)
-                    continue
-            else:
-                if (data := REDIS.get(f'{key}:usd')) is not None:
-                    REDIS.setnx(key, data)
-                    continue
+    stored = coingecko.load_prices(members)
+    done: List[str] = []
+    prices: Dict[str, Dict[date, Decimal]] = defaultdict(dict)
 
-            x = key.split(':')
-            _id, date = x[0], x[1]
-            date = datetime.fromisoformat(date).date()
+    for _id, dates in members.items():
+        # Check if price is actually missing.
+        todo = {x for x in dates if stored[_id].get(x, '0') == '0'}
+        done.extend(y for x in dates if x not in todo for y in dates[x])
 
-            try:
-                REDIS.setnx(key, json.dumps(get_price(_id, date)))
-            except Exception as e:
-                MESSAGE_QUEUE_REDIS.sadd('prices:missing', key)
+        if _id in CUSTOM_PRICE_FUNCS:
+            ranges = [(x, x) for x in todo]
+        else:
+            ranges = coingecko.date_ranges(todo)
 
-                if not type(e) == KeyError:
-                    traceback.print_exc()
-                    print(key)
+        for start, end in ranges:
+            try:
+                if _id in CUSTOM_PRICE_FUNCS:
+                    ret = {start: get_price(_id, start)}
+                else:
+                    # A single request for a run of missing days.
+                    ret = coingecko.get_price_range(_id, start, end)
+            except Exception:
+                traceback.print_exc()
+                print(_id, start, end)
+                continue
+
+            prices[_id].update({k: v for k, v in ret.items() if k in todo})
+
+    filled = bool(coingecko.store_prices(prices))
+    done.extend(y for _id, values in prices.items() for x in values
+                for y in members[_id][x])
+
+    if done:
+        MESSAGE_QUEUE_REDIS.srem('prices:missing', *done)
+
+    if filled:
+        reprice_bridge(prices)
+        # Historic prices changed, sealed analytics partitions are outdated.
+        bump_version(PRICES_HISTORIC)
+        trigger_warm_cache()
 
     print(f'(1) Cron job done. Elapsed: {time.time() - start:.2f}s')
 
 
-@schedular.task("interval", id="update_getlogs", hours=1, max_instances=1)
-@acquire_lock('update_getlogs')
-def update_getlogs():
+@schedular.task("interval", id="warm_cache", minutes=5, max_instances=1)
+@acquire_lock('warm_cache')
+def warm_cache(force: bool = False):
     start = time.time()
-    print(f'(2) [{start}] Cron job start.')
+    print(f'(4) [{start}] Cron job start.')
 
-    dispatch_get_logs(bridge_callback)
+    if schedular.app is None:
+        print('(4) Cron job skipped, app not initialized yet.')
+        return
 
-    print(f'(2) Cron job done. Elapsed: {time.time() - start:.2f}s')
+    with schedular.app.app_context():
+        count = warm(schedular.app, force)
 
+    print(f'(4) Cron job done, warmed {count} views. '
+          f'Elapsed: {time.time() - start:.2f}s')
 
-@schedular.task("interval", id="update_getlogs_pool", hours=1, max_instances=1)
-@acquire_lock('update_getlogs_pool')
-def update_getlogs_pool():
-    from syn.utils.analytics.pool import TOPICS
 
+@schedular.task("interval", id="backfill_usd", hours=24, max_instances=1)
+@acquire_lock('backfill_usd')
+def backfill_usd():
     start = time.time()
-    print(f'(3) [{start}] Cron job start.')
+    print(f'(5) [{start}] Cron job start.')
+
+    for chain in SYN_DATA:
+        if (count := backfill(chain)):
+            print(f'(5) priced {count} {chain} bridge aggregates')
+            bump_version(f'bridge:{chain}')
+
+    print(f'(5) Cron job done. Elapsed: {time.time() - start:.2f}s')
+
+
+@schedular.task("interval",
+                id="retry_dead_letters",
+                minutes=1,
+                max_instances=1)
+@acquire_lock('retry_dead_letters')
+def retry_dead_letters():
+    start = time.time()
+    print(f'(6) [{start}] Cron job start.')
+
+    for chain in SYN_DATA:
+        done, failed = stream.retry_dead_letters(chain, redo_dead_letter)
 
-    dispatch_get_logs(pool_callback,
-                      topics=list(TOPICS),
-                      key_namespace='pool',
-                      address_key=-1)
+        if done or failed:
+            print(f'(6) {chain} dead letters: {done} done, {failed} failed')
 
-    print(f'(3) Cron job done. Elapsed: {time.time() - start:.2f}s')
+    print(f'(6) Cron job done. Elapsed: {time.time() - start:.2f}s')
@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import (Any, Callable, Dict, Iterator, List, Literal, NamedTuple,
+                    Optional, Set, Tuple, Union)
+from contextlib import contextmanager
+from datetime import date
+from uuid import uuid4
+import itertools
+import traceback
+import socket
+import random
+import heapq
+import math
+import time
+import os
+
+from web3.types import LogReceipt
+from gevent.event import Event
+import simplejson as json
+from web3 import Web3
+import gevent
+
+from syn.utils.data import SYN_DATA, LOGS_REDIS_URL, MESSAGE_QUEUE_REDIS
+from syn.utils.helpers import get_log_targets, get_max_blocks, retry
+from syn.utils.wrappa.rpc import (TOPICS as BRIDGE_TOPICS, apply_bridge,
+                                  bridge_callback, decode_bridge, get_logs,
+                                  restore_log, scanned_key)
+from syn.utils.analytics.pool import (TOPICS as POOL_TOPICS, apply_pool,
+                                      decode_pool, pool_callback)
+from syn.utils.analytics.partition import set_watermark
+from syn.utils.analytics.sums import build_sums
+from syn.utils.explorer.poll import Feed, POLL_INTERVAL as FEED_POLL
+from syn.utils.cache import bump_version
+from syn.utils import stream
+
+#: Seconds between polls of the chain's head, `INDEXER_POLL_{CHAIN}` (e.g.
+#: `INDEXER_POLL_ETHEREUM=30`) overrides it per chain.
+POLL_INTERVAL = float(os.getenv('INDEXER_POLL', 15))
+#: Amount of passes which may run at once, the ones furthest behind go first.
+CONCURRENCY = int(os.getenv('INDEXER_CONCURRENCY', 4))
+# Upper bound of how long a crashed worker waits before being restarted.
+MAX_BACKOFF = 300
+# Passes which are this many blocks behind log their progress.
+VERBOSE_LAG = 10000
+#: Hash of `{chain}:{sink}` -> (json) state of its worker.
+STATE_KEY = 'indexer:state'
+#: Set of `{chain}:{sink}` workers which should be restarted.
+RESTART_KEY = 'indexer:restart'
+#: Only index these (comma seperated) chains without taking leases, for
+#: deployments where each process is pinned to its chains.
+PINNED_CHAINS = [x for x in os.getenv('CHAINS', '').split(',') if x]
+#: Seconds a chain's lease is valid for without a heartbeat.
+LEASE_TTL = int(os.getenv('INDEXER_LEASE_TTL', 30))
+#: What this process does, `index` publishes decoded logs into the streams
+#: (see `syn.utils.stream`), `aggregate` builds the rollups from them and
+#: `feed` publishes live bridge events for the explorer (see
+#: `syn.utils.explorer.poll`). Each can be scaled on its own by running
+#: processes with just that role.
+ROLES = [
+    x for x in os.getenv('INDEXER_ROLES', 'index,aggregate,feed').split(',')
+]
+
+#: Extend (or delete) the lease in KEYS[1] only if ARGV[1] still holds it.
+#: ARGV: owner, ttl in ms (0 to delete)
+_RENEW_LEASE = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+elseif ARGV[2] == '0' then
+    return redis.call('DEL', KEYS[1])
+end
+return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+"""
+
+_renew_lease = MESSAGE_QUEUE_REDIS.register_script(_RENEW_LEASE)
+
+
+class Sink(NamedTuple):
+    callback: Callable[[str, str, LogReceipt, bool], None]
+    topics: List[str]
+    namespace: str
+    address_key: Union[str, Literal[-1]]
+    # Decodes a log into its event, which `callback` publishes.
+    decode: Callable[[str, str, LogReceipt], Optional[Dict[str, Any]]]
+
+
+SINKS = {
+    'bridge':
+    Sink(bridge_callback, list(BRIDGE_TOPICS), 'logs', 'bridge',
+         decode_bridge),
+    'pool':
+    Sink(pool_callback, list(POOL_TOPICS), 'pool', -1, decode_pool),
+}
+
+
+def poll_interval(chain: str) -> float:
+    return float(os.getenv(f'INDEXER_POLL_{chain.upper()}', POLL_INTERVAL))
+
+
+class Slots:
+    """
+    Semaphore which hands out free slots to the waiter with the highest
+    priority first, rather than the one waiting the longest.
+    """
+    def __init__(self, size: int) -> None:
+        self.free = size
+        self._waiters: List[Tuple[int, int, Event]] = []
+        self._counter = itertools.count()
+
+    def _release(self) -> None:
+        if self._waiters:
+            # Hand our slot over directly.
+            heapq.heappop(self._waiters)[2].set()
+        else:
+            self.free += 1
+
+    @contextmanager
+    def acquire(self, priority: int) -> Iterator[None]:
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+        else:
+            entry = (-priority, next(self._counter), Event())
+            heapq.heappush(self._waiters, entry)
+
+            try:
+                entry[2].wait()
+            except BaseException:
+                # Killed while waiting, don't leak the slot or the entry.
+                if entry[2].is_set():
+                    self._release()
+                else:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+
+                raise
+
+        try:
+            yield None
+        finally:
+            self._release()
+
+
+def apply_rollups(chain: str, event: Dict[str, Any]) -> Optional[str]:
+    """
+    Apply an event to the `{chain}:bridge:*` and `{chain}:pool:*` rollups.
+
+    Returns:
+        Optional[str]: the dataset (see `bump_version`) which got changed,
+        if any.
+    """
+    # Events which were applied before (e.g. redelivered ones) are no-ops.
+    if event['kind'] == 'bridge':
+        return 'bridge' if apply_bridge(chain, event) else None
+    elif event['kind'] == 'pool':
+        return 'pool' if apply_pool(chain, event) else None
+    elif event['kind'] == 'watermark':
+        # Everything published before it has been applied by now.
+        set_watermark(chain, event['namespace'], event['address'],
+                      date.fromisoformat(event['date']))
+        return None
+
+    raise RuntimeError(f'sanity check? got {event["kind"]}')
+
+
+#: Consumer group -> how it applies an event, a new group gets every event
+#: since the start of the stream (see `syn.utils.stream.create_group`).
+AGGREGATES: Dict[str, Callable[[str, Dict[str, Any]], Optional[str]]] = {
+    stream.ROLLUPS: apply_rollups,
+}
+
+
+def redo_dead_letter(chain: str, entry: Dict[str, Any]) -> None:
+    """
+    Retry a dead letter (see `syn.utils.stream.dead_letter`), raises if it
+    fails again.
+    """
+    if entry['stage'] == 'decode':
+        sink, = [
+            x for x in SINKS.values() if x.namespace == entry['namespace']
+        ]
+        log = restore_log(entry['log'])
+
+        # The indexer's cursor moved on already, aggregators apply it out of
+        # order which is fine as applying is idempotent.
+        stream.publish(chain, sink.decode(chain, entry['address'], log))
+    elif (x := AGGREGATES[entry['group']](chain, entry['event'])):
+        bump_version(f'{x}:{chain}')
+
+
+class Worker:
+    """
+    Tails the head of `chain` for a single sink, each pass indexes every
+    block since the last one.
+    """
+    def __init__(self, chain: str, sink: str, slots: Slots) -> None:
+        self.chain = chain
+        self.sink = sink
+        self.slots = slots
+        self.greenlet: Optional[gevent.Greenlet] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        # Finish the current pass then stop, see `Indexer._drain`.
+        self.draining = False
+        self.state: Dict[str, Any] = {
+            'status': 'starting',
+            'head': None,
+            'scanned': None,
+            'lag': None,
+            'events': 0,
+            'restarts': 0,
+            'error': None,
+            'owner': None,
+        }
+
+    @property
+    def name(self) -> str:
+        return f'{self.chain}:{self.sink}'
+
+    def set_state(self, **kwargs: Any) -> None:
+        self.state.update(kwargs, updated=time.time())
+        MESSAGE_QUEUE_REDIS.hset(STATE_KEY, self.name, json.dumps(self.state))
+
+    def _scanned(self, targets: List[Tuple[str, Optional[int]]]) -> int:
+        namespace = SINKS[self.sink].namespace
+        ret = LOGS_REDIS_URL.mget(
+            [scanned_key(self.chain, namespace, x) for x, _ in targets] + [
+                f'{self.chain}:{namespace}:{x}:MAX_BLOCK_STORED'
+                for x, _ in targets
+            ])
+
+        # The worker is as far as its slowest address, addresses which have
+        # not been scanned since the cursor exists are at their last log.
+        return min(
+            max(int(x or 0), int(y or 0), start or 0)
+            for x, y, (_, start) in zip(ret, ret[len(targets):], targets))
+
+    def run_once(self) -> int:
+        """
+        Index every block from where we left off till the current head.
+
+        Returns:
+            int: amount of logs found.
+        """
+        sink = SINKS[self.sink]
+        w3: Web3 = SYN_DATA[self.chain]['w3']
+        targets = get_log_targets(self.chain, sink.address_key)
+
+        head = retry(lambda: w3.eth.block_number)
+        lag = head - self._scanned(targets)
+        self.set_state(status='waiting', head=head, lag=lag)
+
+        kwargs = {}
+        if (max_blocks := get_max_blocks(self.chain)) is not None:
+            kwargs['max_blocks'] = max_blocks
+
+        events = 0
+        with self.slots.acquire(lag):
+            self.set_state(status='indexing')
+
+            for address, start_block in targets:
+                events += get_logs(self.chain,
+                                   sink.callback,
+                                   address,
+                                   start_block=start_block,
+                                   till_block=head,
+                                   topics=sink.topics,
+                                   key_namespace=sink.namespace,
+                                   verbose=lag > VERBOSE_LAG,
+                                   **kwargs)
+
+        scanned = self._scanned(targets)
+        self.set_state(status='idle',
+                       scanned=scanned,
+                       lag=head - scanned,
+                       events=self.state['events'] + events)
+        return events
+
+    def run(self) -> None:
+        while not self.draining:
+            self.run_once()
+            self.failures = 0
+            gevent.sleep(poll_interval(self.chain))
+
+    def start(self) -> None:
+        self.greenlet = gevent.spawn(self.run)
+
+    def stop(self) -> None:
+        if self.greenlet is not None:
+            self.greenlet.kill()
+
+        self.set_state(status='stopped')
+
+
+class FeedWorker(Worker):
+    """
+    Publishes `chain`'s bridge events as they happen, it's a live feed so
+    it doesn't wait for a slot behind workers catching up.
+    """
+    def __init__(self, chain: str, slots: Slots) -> None:
+        super().__init__(chain, 'feed', slots)
+        self.feed: Optional[Feed] = None
+
+    def run_once(self) -> int:
+        assert self.feed is not None
+        events = self.feed.poll()
+
+        self.set_state(status='idle',
+                       head=self.feed.head,
+                       scanned=self.feed.head,
+                       lag=0,
+                       events=self.state['events'] + events)
+        return events
+
+    def run(self) -> None:
+        self.feed = Feed(self.chain)
+
+        while not self.draining:
+            self.run_once()
+            self.failures = 0
+            gevent.sleep(FEED_POLL)
+
+
+class Aggregator(Worker):
+    """
+    Applies `chain`'s events to the `group` aggregate in stream order, only
+    acknowledging them once a whole batch got applied.
+    """
+    def __init__(self, chain: str, group: str, slots: Slots) -> None:
+        super().__init__(chain, group, slots)
+        self.consumer = f'{socket.gethostname()}:{os.getpid()}'
+        self.pending = True
+
+    def run_once(self) -> int:
+        # Start with whatever was delivered but never acknowledged.
+        entries = stream.read(self.chain,
+                              self.sink,
+                              self.consumer,
+                              pending=self.pending,
+                              block=int(poll_interval(self.chain) * 1000))
+
+        if self.pending and not entries:
+            self.pending = False
+            return 0
+
+        datasets: Set[str] = set()
+        for _, event in entries:
+            if event is None:
+                continue
+
+            try:
+                if (x := AGGREGATES[self.sink](self.chain, event)):
+                    datasets.add(x)
+            except Exception:
+                # Don't let one event hold up every one after it.
+                print(f'aggregator {self.name} dead lettering', event)
+                stream.dead_letter(
+                    self.chain, {
+                        'stage': 'apply',
+                        'group': self.sink,
+                        'event': event,
+                        'error': traceback.format_exc(),
+                    })
+
+        stream.ack(self.chain, self.sink, [x for x, _ in entries])
+
+        for x in datasets:
+            # Invalidate anything cached which was derived from this data.
+            bump_version(f'{x}:{self.chain}')
+
+        if entries:
+            self.set_state(status='idle',
+                           scanned=entries[-1][0],
+                           events=self.state['events'] + len(entries))
+
+        return len(entries)
+
+    def run(self) -> None:
+        stream.create_group(self.chain, self.sink)
+        # Whoever consumed the chain before us left these unacknowledged.
+        stream.claim(self.chain, self.sink, self.consumer)
+
+        if self.sink == stream.ROLLUPS and build_sums(self.chain):
+            # Aggregates from before the sums were kept at apply time.
+            print(f'aggregator {self.name} built sums')
+        self.pending = True
+        self.set_state(status='idle')
+
+        while not self.draining:
+            self.run_once()
+            self.failures = 0
+
+
+def lease_key(chain: str, role: str = 'index') -> str:
+    return f'indexer:lease:{role}:{chain}'
+
+
+def members_key(role: str = 'index') -> str:
+    # Sorted set of processes with `role`, scored by their last heartbeat.
+    return f'indexer:members:{role}'
+
+
+class Leases:
+    """
+    Per chain leases which every indexer process (on any node) competes for,
+    each process aims to hold an equal share of the chains. Leases expire
+    unless renewed by :meth:`heartbeat`, so chains of a process which died
+    get picked up by the others.
+    """
+    def __init__(self,
+                 chains: List[str],
+                 role: str = 'index',
+                 ttl: int = LEASE_TTL) -> None:
+        self.id = ':'.join(
+            [socket.gethostname(),
+             str(os.getpid()),
+             uuid4().hex[:8]])
+        self.chains = chains
+        self.role = role
+        self.ttl = ttl
+        self.held: Set[str] = set()
+
+    def _renew(self, chain: str, ttl: int) -> bool:
+        return bool(
+            _renew_lease(keys=[lease_key(chain, self.role)],
+                         args=[self.id, ttl * 1000]))
+
+    def heartbeat(self) -> Tuple[Set[str], Set[str], Set[str]]:
+        """
+        Renew held leases and take free ones till we hold our share.
+
+        Returns:
+            Tuple[Set[str], Set[str], Set[str]]: chains which got acquired,
+            which got lost (expired) and which we hold more than our share
+            of and should be released.
+        """
+        now = time.time()
+        key = members_key(self.role)
+        pipe = MESSAGE_QUEUE_REDIS.pipeline()
+        pipe.zadd(key, {self.id: now})
+        pipe.zremrangebyscore(key, '-inf', now - self.ttl)
+        pipe.zcard(key)
+        members = pipe.execute()[-1]
+
+        lost = {x for x in self.held if not self._renew(x, self.ttl)}
+        self.held -= lost
+
+        share = math.ceil(len(self.chains) / max(1, members))
+        acquired: Set[str] = set()
+        free = [x for x in self.chains if x not in self.held]
+
+        for chain in random.sample(free, len(free)):
+            if len(self.held) >= share:
+                break
+
+            if MESSAGE_QUEUE_REDIS.set(lease_key(chain, self.role),
+                                       self.id,
+                                       nx=True,
+                                       px=self.ttl * 1000):
+                self.held.add(chain)
+                acquired.add(chain)
+
+        return acquired, lost, set(sorted(self.held)[share:])
+
+    def release(self, chain: str) -> None:
+        self._renew(chain, 0)
+        self.held.discard(chain)
+
+    def leave(self) -> None:
+        for chain in list(self.held):
+            self.release(chain)
+
+        MESSAGE_QUEUE_REDIS.zrem(members_key(self.role), self.id)
+
+
+class Indexer:
+    """
+    Supervises a :class:`Worker` per (chain, sink), or with the `aggregate`
+    role an :class:`Aggregator` per (chain, group) and with the `feed` role
+    a :class:`FeedWorker` per chain. Workers which crash get
+    restarted with an exponential backoff without affecting the others.
+
+    Chains are split between every running indexer of the same role with
+    :class:`Leases`, unless `chains` (or `CHAINS=`) pins this one to a fixed
+    set of chains.
+    """
+    def __init__(self,
+                 chains: Optional[List[str]] = None,
+                 sinks: Optional[List[str]] = None,
+                 concurrency: int = CONCURRENCY,
+                 role: str = 'index') -> None:
+        assert role in ['index', 'aggregate', 'feed'], f'unknown role: {role}'
+        self.pinned = chains or PINNED_CHAINS or None
+        self.role = role
+        self.sinks = sinks or {
+            'index': list(SINKS),
+            'aggregate': list(AGGREGATES),
+            'feed': ['feed'],
+        }[role]
+        self.concurrency = concurrency
+        self.workers: Dict[str, Worker] = {}
+        # Created once running, as we may be forked after being created.
+        self.leases: Optional[Leases] = None
+        self.slots: Optional[Slots] = None
+        self._draining: Set[str] = set()
+
+    def _add(self, chain: str) -> None:
+        assert self.slots is not None
+        owner = self.leases.id if self.leases is not None else 'pinned'
+
+        for sink in self.sinks:
+            if self.role == 'aggregate':
+                worker: Worker = Aggregator(chain, sink, self.slots)
+            elif self.role == 'feed':
+                if 'bridge' not in SYN_DATA[chain]:
+                    continue
+
+                worker = FeedWorker(chain, self.slots)
+            elif get_log_targets(chain, SINKS[sink].address_key):
+                worker = Worker(chain, sink, self.slots)
+            else:
+                continue
+
+            self.workers[worker.name] = worker
+            worker.set_state(status='starting', owner=owner)
+            worker.start()
+
+    def _remove(self, chain: str) -> None:
+        for name, worker in list(self.workers.items()):
+            if worker.chain == chain:
+                worker.stop()
+                del self.workers[name]
+
+        self._draining.discard(chain)
+
+    def _drain(self, chain: str) -> None:
+        # Let running passes finish, the lease is released once they did.
+        self._draining.add(chain)
+
+        for worker in self.workers.values():
+            if worker.chain == chain:
+                worker.draining = True
+
+    def _check(self, worker: Worker) -> None:
+        greenlet = worker.greenlet
+
+        if greenlet is None or not greenlet.dead or worker.draining:
+            return
+
+        if greenlet.exception is not None and worker.retry_at == 0:
+            # Just crashed, back off before trying again.
+            worker.failures += 1
+            worker.retry_at = time.time() + min(MAX_BACKOFF,
+                                                2**worker.failures)
+            error = ''.join(
+                traceback.format_exception(type(greenlet.exception),
+                                           greenlet.exception,
+                                           greenlet.exception.__traceback__))
+            print(f'indexer {worker.name} crashed: {error}')
+            worker.set_state(status='failed', error=error)
+        elif time.time() >= worker.retry_at:
+            self.restart(worker.name)
+
+    def _rebalance(self) -> None:
+        assert self.leases is not None
+        acquired, lost, excess = self.leases.heartbeat()
+
+        for chain in lost:
+            # Someone else may be indexing it already, stop right away.
+            print(f'indexer lost the lease of {chain}')
+            self._remove(chain)
+
+        for chain in acquired:
+            print(f'indexer acquired the lease of {chain}')
+            self._add(chain)
+
+        for chain in excess - self._draining:
+            print(f'indexer handing off {chain}')
+            self._drain(chain)
+
+        for chain in list(self._draining):
+            if all(x.greenlet is None or x.greenlet.dead
+                   for x in self.workers.values() if x.chain == chain):
+                self._remove(chain)
+                self.leases.release(chain)
+
+    def restart(self, name: str) -> None:
+        worker = self.workers[name]
+        worker.stop()
+        worker.retry_at = 0
+        worker.set_state(status='starting',
+                         restarts=worker.state['restarts'] + 1)
+        worker.start()
+
+    def run(self) -> None:
+        self.slots = Slots(self.concurrency)
+
+        if self.pinned is not None:
+            for chain in self.pinned:
+                self._add(chain)
+        else:
+            self.leases = Leases(list(SYN_DATA), self.role)
+
+        heartbeat = 0.0
+
+        try:
+            while True:
+                if self.leases is not None \
+                        and time.time() - heartbeat >= LEASE_TTL / 3:
+                    heartbeat = time.time()
+                    self._rebalance()
+
+                # Restarts requested by `request_restart`, from any process.
+                for name in MESSAGE_QUEUE_REDIS.spop(RESTART_KEY, 64) or []:
+                    if name in self.workers:
+                        self.restart(name)
+                    else:
+                        # Not ours, leave it for whoever runs it.
+                        MESSAGE_QUEUE_REDIS.sadd(RESTART_KEY, name)
+
+                for worker in list(self.workers.values()):
+                    self._check(worker)
+
+                gevent.sleep(1)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        for chain in {x.chain for x in self.workers.values()}:
+            self._remove(chain)
+
+        if self.leases is not None:
+            self.leases.leave()
+
+
+def request_restart(chain: str, sink: str) -> bool:
+    """
+    Have whichever process runs `chain`'s `sink` worker restart it right
+    away, e.g. rather than waiting out the backoff of one which crashed.
+
+    Returns:
+        bool: False if there is no such worker.
+    """
+    name = f'{chain}:{sink}'
+
+    # Every worker which ever ran has its state stored.
+    if not MESSAGE_QUEUE_REDIS.hexists(STATE_KEY, name):
+        return False
+
+    MESSAGE_QUEUE_REDIS.sadd(RESTART_KEY, name)
+    return True
+
+
+def get_state() -> Dict[str, Any]:
+    """
+    State of every worker keyed by `{chain}:{sink}` (or `{chain}:{group}`),
+    the owner of every chain's leases, every live indexer process and how
+    far every group got through each chain's stream, along with the amount
+    of dead letters of each chain.
+    """
+    chains = list(SYN_DATA)
+    roles = ['index', 'aggregate', 'feed']
+
+    return {
+        'workers': {
+            k: json.loads(v)
+            for k, v in MESSAGE_QUEUE_REDIS.hgetall(STATE_KEY).items()
+        },
+        'leases': {
+            role: dict(
+                zip(chains,
+                    MESSAGE_QUEUE_REDIS.mget(
+                        [lease_key(x, role) for x in chains])))
+            for role in roles
+        },
+        'members': {
+            role: MESSAGE_QUEUE_REDIS.zrange(members_key(role), 0, -1)
+            for role in roles
+        },
+        'streams': {x: stream.get_groups(x)
+                    for x in chains},
+        'dead_letters':
+        dict(
+            zip(chains, [
+                LOGS_REDIS_URL.xlen(stream.dead_key(x)) for x in chains
+            ])),
+    }
@@ -7,25 +7,464 @@
           https://www.boost.org/LICENSE_1_0.txt)
 """
 
-from typing import Callable, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from time import time
+from uuid import uuid4
 import traceback
 import functools
 import hashlib
 import inspect
 import logging
+import os
 
 from flask_caching import Cache, wants_args
-from flask import request, url_for
+from flask import (Flask, Response, copy_current_request_context, request,
+                   url_for)
+import simplejson as json
+from redis import Redis
+import gevent
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from syn.utils.shm import get_shared_cache
 
 logger = logging.getLogger('flask_caching')
-# {
-#    cache_key: expiry
-# }
-_cache: Dict[str, float] = {}
+
+# How long (in seconds) a worker may hold a refresh lease before another one
+# can take over, this should be longer than the slowest view takes.
+LEASE_TIMEOUT = 5 * 60
+# How often (in seconds) we check if another worker finished its refresh.
+LEASE_POLL = 0.25
+#: Set of paths which have refresh stats, see :func:`get_refresh_stats`.
+STATS_KEY = 'cache:refresh'
+# Responses smaller than this (in bytes) are not worth compressing.
+MIN_COMPRESS = 1024
+# Fields of a cached view besides its bodies, which are stored per encoding.
+_META = ['etag', 'status', 'type', 'expires', 'headers']
+# Headers a cached view's response gets from the view itself, rather than the
+# ones it was stored with.
+_OWN_HEADERS = {
+    'content-type', 'content-length', 'content-encoding', 'etag', 'vary',
+    'set-cookie'
+}
+# Total size (in bytes) cached views may take up before the least recently
+# (`lru`) or least frequently (`lfu`) used ones are evicted.
+VIEWS_BUDGET = int(os.getenv('VIEWS_BUDGET', 256 * 1024 * 1024))
+VIEWS_POLICY = os.getenv('VIEWS_POLICY', 'lru')
+assert VIEWS_POLICY in ['lru', 'lfu'], f'invalid policy: {VIEWS_POLICY!r}'
+# How long a view's pointer to its latest version is kept without updates.
+LATEST_TIMEOUT = 7 * 24 * 60 * 60
+#: Seconds between writing which views were served from the node local copy
+#: to the index, each process collects them till then.
+VIEWS_TOUCH_INTERVAL = float(os.getenv('VIEWS_TOUCH_INTERVAL', 5))
+
+#: Drop view KEYS[1] and its accounting, KEYS[2:5] are the index, total
+#: bytes, per route bytes and per route count.
+_FORGET_VIEW = """
+local function forget(name)
+    local meta = redis.call('HMGET', name, 'size', 'route')
+    redis.call('DEL', name)
+    redis.call('ZREM', KEYS[2], name)
+
+    if meta[1] then
+        redis.call('DECRBY', KEYS[3], meta[1])
+        redis.call('HINCRBY', KEYS[4], meta[2], -tonumber(meta[1]))
+        redis.call('HINCRBY', KEYS[5], meta[2], -1)
+    end
+end
+"""
+
+#: Store view KEYS[1] (fields in ARGV[6:]) of `size` bytes, then evict views
+#: with the lowest score in the index till the total is within `budget`.
+_STORE_VIEW = _FORGET_VIEW + """
+local policy, now, budget = ARGV[1], ARGV[2], tonumber(ARGV[3])
+local route, size = ARGV[4], ARGV[5]
+local score = tonumber(redis.call('ZSCORE', KEYS[2], KEYS[1]) or '0')
+forget(KEYS[1])
+
+redis.call('HSET', KEYS[1], 'size', size, 'route', route, unpack(ARGV, 6))
+redis.call('HINCRBY', KEYS[4], route, size)
+redis.call('HINCRBY', KEYS[5], route, 1)
+local total = redis.call('INCRBY', KEYS[3], size)
+
+-- lfu keeps the view's hits, lru its last use.
+if policy == 'lfu' then
+    redis.call('ZADD', KEYS[2], score + 1, KEYS[1])
+else
+    redis.call('ZADD', KEYS[2], now, KEYS[1])
+end
+
+local evicted = 0
+while total > budget do
+    -- Never the view we just stored, under lfu it's usually the lowest.
+    local lowest = redis.call('ZRANGE', KEYS[2], 0, 1)
+    local victim = lowest[1]
+    if victim == KEYS[1] then
+        victim = lowest[2]
+    end
+
+    if not victim then
+        break
+    end
+
+    forget(victim)
+    total = tonumber(redis.call('GET', KEYS[3]))
+    evicted = evicted + 1
+end
+
+if evicted > 0 then
+    redis.call('HINCRBY', KEYS[6], 'evictions', evicted)
+end
+
+return evicted
+"""
+
+_DELETE_VIEW = _FORGET_VIEW + """
+forget(KEYS[1])
+"""
+
+
+def _not_modified(etag: str) -> Response:
+    rv = Response(status=304)
+    rv.set_etag(etag)
+    return rv
+
+
+def _encodings() -> List[str]:
+    """Encodings the client accepts, most preferred first."""
+    accept = request.accept_encodings
+    res = [
+        x for x in ['br', 'gzip']
+        if accept[x] and (x != 'br' or brotli is not None)
+    ]
+
+    return sorted(res, key=lambda x: -accept[x]) + ['identity']
+
+
+def _lease(key: str) -> Optional[str]:
+    """
+    Try to get the (cluster wide) lease to refresh `key`, returns the lease's
+    token if we got it.
+    """
+    from syn.utils.data import MESSAGE_QUEUE_REDIS
+
+    token = uuid4().hex
+    if MESSAGE_QUEUE_REDIS.set(f'cache:lease:{key}',
+                               token,
+                               nx=True,
+                               ex=LEASE_TIMEOUT):
+        return token
+
+    return None
+
+
+def _release(key: str, token: str) -> None:
+    from syn.utils.data import MESSAGE_QUEUE_REDIS
+
+    # The lease may have expired and been taken by someone else meanwhile.
+    if MESSAGE_QUEUE_REDIS.get(f'cache:lease:{key}') == token:
+        MESSAGE_QUEUE_REDIS.delete(f'cache:lease:{key}')
+
+
+def _wait(key: str) -> None:
+    from syn.utils.data import MESSAGE_QUEUE_REDIS
+
+    deadline = time() + LEASE_TIMEOUT
+    while MESSAGE_QUEUE_REDIS.exists(f'cache:lease:{key}'):
+        if time() > deadline:
+            break
+
+        gevent.sleep(LEASE_POLL)
+
+
+def _record_refresh(path: str, elapsed: float, ok: bool) -> None:
+    from syn.utils.data import MESSAGE_QUEUE_REDIS
+
+    key = f'{STATS_KEY}:{path}'
+    pipe = MESSAGE_QUEUE_REDIS.pipeline(transaction=False)
+    pipe.sadd(STATS_KEY, path)
+    pipe.hincrby(key, 'refreshes' if ok else 'errors', 1)
+    pipe.hincrbyfloat(key, 'seconds', elapsed)
+    pipe.hset(key, mapping={'last': elapsed, 'last_at': time(), 'ok': int(ok)})
+    pipe.execute()
+
+
+def get_refresh_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Get how often and how long refreshing each view took, slowest first.
+
+    >>> get_refresh_stats()
+    {'/api/v1/analytics/volume/total/in': {'refreshes': 12, 'errors': 0,
+     'seconds': 421.3, 'average': 35.1, 'last': 33.8, ...}, ...}
+    """
+    from syn.utils.data import MESSAGE_QUEUE_REDIS
+
+    res: Dict[str, Dict[str, float]] = {}
+
+    for path in MESSAGE_QUEUE_REDIS.smembers(STATS_KEY):
+        ret = MESSAGE_QUEUE_REDIS.hgetall(f'{STATS_KEY}:{path}')
+        stats = {k: float(v) for k, v in ret.items()}
+        stats.setdefault('refreshes', 0)
+        stats.setdefault('errors', 0)
+
+        total = stats['refreshes'] + stats['errors']
+        stats['average'] = stats.get('seconds', 0) / total if total else 0
+        res[path] = stats
+
+    return dict(
+        sorted(res.items(), key=lambda x: x[1]['average'], reverse=True))
 
 
 class PatchedCache(Cache):
+    def init_app(self,
+                 app: Flask,
+                 config: Optional[Dict[str, Any]] = None) -> None:
+        super().init_app(app, config)
+        config = {**app.config, **(self.config or {}), **(config or {})}
+
+        # Views are stored by us rather than through the backend (and its
+        # private client), so the backend has to be redis.
+        if config.get('CACHE_TYPE') not in ['redis', 'RedisCache']:
+            raise RuntimeError('cached views need CACHE_TYPE=RedisCache, got '
+                               f'{config.get("CACHE_TYPE")!r}')
+
+        if config.get('CACHE_REDIS_URL'):
+            self._view_client = Redis.from_url(config['CACHE_REDIS_URL'])
+        else:
+            self._view_client = Redis(
+                host=config.get('CACHE_REDIS_HOST', 'localhost'),
+                port=config.get('CACHE_REDIS_PORT', 6379),
+                db=config.get('CACHE_REDIS_DB', 0),
+                password=config.get('CACHE_REDIS_PASSWORD'))
+
+        self._view_prefix = config.get('CACHE_KEY_PREFIX', 'flask_cache_')
+
+    def _view_key(self, key: str) -> str:
+        return self._view_prefix + 'views:' + key
+
+    def _views_keys(self) -> List[str]:
+        prefix = self._view_prefix + 'views-'
+        return [
+            prefix + x for x in ['index', 'bytes', 'routes', 'count', 'stats']
+        ]
+
+    def _views_script(self, name: str, script: str) -> Callable:
+        # Registered lazily as the client only exists after `init_app`.
+        if not hasattr(self, '_scripts'):
+            self._scripts: Dict[str, Callable] = {}
+
+        if name not in self._scripts:
+            self._scripts[name] = self._view_client.register_script(script)
+
+        return self._scripts[name]
+
+    def _delete_view(self, key: str) -> None:
+        get_shared_cache().delete(key)
+        self._views_script('delete', _DELETE_VIEW)(
+            keys=[self._view_key(key)] + self._views_keys())
+
+    @staticmethod
+    def _share_view(entry: Dict[str, Any]) -> None:
+        # Keep as many encodings as fit, the others are read from redis.
+        for drop in [[], ['identity'], ['identity', 'br']]:
+            value = {k: v for k, v in entry.items() if k not in drop}
+            if get_shared_cache().set(entry['key'], value):
+                return
+
+    def get_views_stats(self) -> Dict[str, Any]:
+        """
+        Get how much of the budget cached views take up, per route too.
+
+        >>> cache.get_views_stats()
+        {'budget': 268435456, 'bytes': 10485760, 'evictions': 0,
+         'routes': {'/api/v1/utils/price/<chain:chain>/<token>':
+                    {'bytes': 40960, 'count': 80}, ...}, ...}
+        """
+        _, total, routes, count, stats = self._views_keys()
+
+        pipe = self._view_client.pipeline(transaction=False)
+        pipe.get(total)
+        pipe.hgetall(routes)
+        pipe.hgetall(count)
+        pipe.hget(stats, 'evictions')
+        total, routes, count, evictions = pipe.execute()
+
+        return {
+            'budget': VIEWS_BUDGET,
+            'policy': VIEWS_POLICY,
+            'bytes': int(total or 0),
+            'evictions': int(evictions or 0),
+            'routes': {
+                k.decode(): {
+                    'bytes': int(v),
+                    'count': int(count.get(k, 0))
+                }
+                for k, v in sorted(routes.items(),
+                                   key=lambda x: -int(x[1])) if int(v)
+            },
+        }
+
+    def _touch_view(self, client: Any, name: str) -> None:
+        index = self._views_keys()[0]
+
+        # Only touch views which still exist.
+        if VIEWS_POLICY == 'lfu':
+            client.zadd(index, {name: 1}, xx=True, incr=True)
+        else:
+            client.zadd(index, {name: time()}, xx=True)
+
+    def _queue_touch(self, name: str) -> None:
+        # Written by `_flush_touches`, rather than a round trip per hit.
+        if not hasattr(self, '_touches'):
+            self._touches: Dict[str, float] = {}
+            # Started on the first hit, after we were forked.
+            gevent.spawn(self._flush_touches)
+
+        if VIEWS_POLICY == 'lfu':
+            self._touches[name] = self._touches.get(name, 0) + 1
+        else:
+            self._touches[name] = time()
+
+    def _flush_touches(self) -> None:
+        index = self._views_keys()[0]
+
+        while True:
+            gevent.sleep(VIEWS_TOUCH_INTERVAL)
+            touches, self._touches = self._touches, {}
+
+            if not touches:
+                continue
+
+            try:
+                # Only touch views which still exist.
+                pipe = self._view_client.pipeline(transaction=False)
+
+                if VIEWS_POLICY == 'lfu':
+                    for name, hits in touches.items():
+                        pipe.zadd(index, {name: hits}, xx=True, incr=True)
+                else:
+                    pipe.zadd(index, touches, xx=True)
+
+                pipe.execute()
+            except Exception:
+                # Only the order views get evicted in suffers.
+                traceback.print_exc()
+
+    def _read_view(self, key: str) -> Optional[Dict[str, Any]]:
+        fields = list(_META)
+        # Nothing but the etag is needed to answer with a 304.
+        if not request.if_none_match:
+            fields.append(_encodings()[0])
+
+        name = self._view_key(key)
+
+        # Node local copy first, which is only trusted while it's fresh as
+        # another node may have refreshed the view meanwhile.
+        if (entry := get_shared_cache().get(key)) is not None and (
+                entry['expires'] == 0 or entry['expires'] > time()):
+            # Still counts as a use, or the most served views get evicted
+            # first. Nothing depends on it so it's written in batches.
+            self._queue_touch(name)
+            return entry
+
+        pipe = self._view_client.pipeline(transaction=False)
+        pipe.hmget(name, fields)
+        self._touch_view(pipe, name)
+
+        ret, _ = pipe.execute()
+        if ret[0] is None:
+            return None
+
+        entry = {
+            'key': key,
+            'etag': ret[0].decode(),
+            'status': int(ret[1]),
+            'type': ret[2].decode(),
+            'expires': float(ret[3]),
+            # Views stored before headers were kept have none.
+            'headers': json.loads(ret[4]) if ret[4] is not None else [],
+        }
+
+        if len(ret) > len(_META) and ret[-1] is not None:
+            entry[fields[-1]] = ret[-1]
+            self._share_view(entry)
+
+        return entry
+
+    def _write_view(self, key: str, rv: Response,
+                    expires: float) -> Dict[str, Any]:
+        """
+        Store the final bytes of `rv`, along with compressed variants of it,
+        so hits never need to serialize or compress again.
+        """
+        body = rv.get_data()
+        entry = {
+            'key': key,
+            'etag': hashlib.md5(body).hexdigest(),
+            'status': rv.status_code,
+            'type': rv.content_type,
+            'expires': expires,
+            'headers': [[k, v] for k, v in rv.headers.items()
+                        if k.lower() not in _OWN_HEADERS],
+            'identity': body,
+        }
+
+        if len(body) >= MIN_COMPRESS:
+            entry['gzip'] = gzip.compress(body)
+            if brotli is not None:
+                entry['br'] = brotli.compress(body)
+
+        fields: List[Any] = []
+        for k, v in entry.items():
+            if k == 'headers':
+                fields.extend([k, json.dumps(v).encode()])
+            elif k != 'key':
+                fields.extend([k, v])
+
+        size = sum(len(x) for x in fields if isinstance(x, bytes))
+        route = request.url_rule.rule if request.url_rule else request.path
+
+        self._views_script('store', _STORE_VIEW)(
+            keys=[self._view_key(key)] + self._views_keys(),
+            args=[VIEWS_POLICY,
+                  time(), VIEWS_BUDGET, route, size, *fields])
+        self._share_view(entry)
+
+        return entry
+
+    def _view_response(self, entry: Dict[str, Any]) -> Optional[Response]:
+        """
+        Respond with a cached view in the best encoding the client accepts,
+        returns None if the view got deleted meanwhile.
+        """
+        if entry['status'] == 200 and entry['etag'] in request.if_none_match:
+            return _not_modified(entry['etag'])
+
+        for encoding in _encodings():
+            if (body := entry.get(encoding)) is None:
+                body = self._view_client.hget(self._view_key(entry['key']),
+                                              encoding)
+
+            if body is not None:
+                break
+        else:
+            return None
+
+        rv = Response(body, status=entry['status'], content_type=entry['type'])
+        rv.headers.extend(entry.get('headers', []))
+        rv.vary.add('Accept-Encoding')
+
+        if encoding != 'identity':
+            rv.content_encoding = encoding
+        if entry['status'] == 200:
+            rv.set_etag(entry['etag'])
+
+        return rv
+
     def cached(
         self: Cache,
         timeout: int = 60 * 60,  # 1 hour default.
@@ -38,8 +477,70 @@ class PatchedCache(Cache):
         cache_none: bool = False,
         make_cache_key: Optional[Callable] = None,
         source_check: Optional[bool] = None,
+        depends_on: Optional[List[str]] = None,
     ) -> Callable:
+        """
+        Same as :meth:`Cache.cached` except stale data is served while the
+        view gets refreshed and if updating the cache fails.
+
+        Once `timeout` passes the stale response is still returned right
+        away, while a single worker (guarded by a redis lease) refreshes it
+        in the background. Requests for views which have never been cached
+        wait on the worker holding the lease instead of computing it too.
+
+        Views are stored as their final bytes (plus gzip and brotli variants
+        of larger ones), hits are served in the encoding the client prefers
+        with an `ETag` of the content, `If-None-Match` gets a 304.
+
+        If `depends_on` is given (e.g. `['bridge:{chain}', 'prices']`, which
+        get formatted with the view's arguments) the versions of those
+        datasets become part of the cache key, the view is then served from
+        cache till any of them get bumped, `timeout` is ignored.
+        See :func:`syn.utils.cache.bump_version`.
+        """
         def decorator(f):
+            def _refresh(cache_key: str, base_key: str,
+                         args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+                start = time()
+                try:
+                    rv = f(*args, **kwargs)
+                except Exception:
+                    traceback.print_exc()
+                    _record_refresh(request.path, time() - start, False)
+                    # Do NOT update the cache, serve the old data even if stale.
+                    return None
+
+                _record_refresh(request.path, time() - start, True)
+
+                if rv is None or (response_filter is not None
+                                  and not response_filter(rv)):
+                    return rv
+
+                # Errors (e.g. a 400 for bad arguments) aren't worth keeping.
+                rv = self.app.make_response(rv)
+                if rv.status_code != 200:
+                    return rv
+
+                # Do not timeout/delete items in the cache, when they expire
+                # they are served stale till the refresh finishes.
+                entry = self._write_view(
+                    cache_key, rv,
+                    time() + timeout if depends_on is None else 0)
+
+                if depends_on is not None:
+                    # Only keep the latest version around.
+                    pipe = self._view_client.pipeline()
+                    pipe.getset(self._view_key(f'{base_key}:latest'),
+                                cache_key)
+                    pipe.expire(self._view_key(f'{base_key}:latest'),
+                                LATEST_TIMEOUT)
+                    latest, _ = pipe.execute()
+
+                    if latest is not None and latest.decode() != cache_key:
+                        self._delete_view(latest.decode())
+
+                return self._view_response(entry)
+
             @functools.wraps(f)
             def decorated_function(*args, **kwargs):
                 #: Bypass the cache entirely.
@@ -51,6 +552,8 @@ class PatchedCache(Cache):
                 if source_check is None:
                     source_check = self.source_check
 
+                stale: Optional[Dict[str, Any]] = None
+
                 try:
                     if make_cache_key is not None and callable(make_cache_key):
                         cache_key = make_cache_key(*args, **kwargs)
@@ -59,6 +562,15 @@ class PatchedCache(Cache):
                                                     kwargs,
                                                     use_request=True)
 
+                    base_key = cache_key
+                    if depends_on is not None:
+                        from syn.utils.cache import get_versions
+
+                        versions = get_versions(
+                            *[x.format(**kwargs) for x in depends_on])
+                        cache_key += ':' + hash_method(
+                            str(versions).encode()).hexdigest()
+
                     nonlocal forced_update
                     if forced_update is None:
                         from syn.utils.data import _forced_update
@@ -67,26 +579,21 @@ class PatchedCache(Cache):
                     if (callable(forced_update)
                             and (forced_update(*args, **kwargs) if wants_args(
                                 forced_update) else forced_update()) is True):
-                        rv = None
+                        entry = None
                         found = False
                     else:
-                        rv = self.cache.get(cache_key)
-                        found = True
-
-                        # If the value returned by cache.get() is None, it
-                        # might be because the key is not found in the cache
-                        # or because the cached value is actually None
-                        if rv is None:
-                            # If we're sure we don't need to cache None values
-                            # (cache_none=False), don't bother checking for
-                            # key existence, as it can lead to false positives
-                            # if a concurrent call already cached the
-                            # key between steps. This would cause us to
-                            # return None when we shouldn't
-                            if not cache_none:
-                                found = False
-                            else:
-                                found = self.cache.has(cache_key)
+                        entry = self._read_view(cache_key)
+                        found = entry is not None
+
+                        if depends_on is not None and not found:
+                            # Serve the previous version while refreshing.
+                            if (latest := self._view_client.get(
+                                    self._view_key(
+                                        f'{base_key}:latest'))) is not None:
+                                stale = self._read_view(latest.decode())
+                        elif depends_on is None and found and (
+                                entry['expires'] < time()):
+                            stale, found = entry, False
                 except Exception:
                     if self.app.debug:
                         raise
@@ -94,39 +601,42 @@ class PatchedCache(Cache):
                         "Exception possibly due to cache backend.")
                     return f(*args, **kwargs)
 
-                if not found:
-                    try:
-                        rv = f(*args, **kwargs)
-                    except Exception:
-                        traceback.print_exc()
-                        # Do NOT update the cache, serve the old data even if stale.
-                        rv = None
-
-                    if response_filter is None or response_filter(rv):
-                        if rv is None:
-                            # Hopefully this actually returns something.
-                            return self.cache.get(cache_key)
-
-                if (rv is not None and
-                    (cache_key in _cache and _cache[cache_key] < time())
-                        or cache_key not in _cache):
-                    ret = self.cache.set(
-                        cache_key,
-                        rv,
-                        # Do not timeout/delete items in the cache.
-                        timeout=None,
-                    )
-
-                    if ret:
-                        expiry = time() + timeout
-                        _cache[cache_key] = expiry
-                    else:
-                        logger.critical(
-                            f'Got {ret!r} expected True when setting ',
-                            f'cache for key {cache_key} and value {rv}',
-                        )
+                if found:
+                    if (rv := self._view_response(entry)) is not None:
+                        return rv
+                elif stale is not None:
+                    # Return stale data right away, a single worker across
+                    # the cluster refreshes it in the background.
+                    if (token := _lease(cache_key)) is not None:
+
+                        @copy_current_request_context
+                        def _background() -> None:
+                            try:
+                                _refresh(cache_key, base_key, args, kwargs)
+                            finally:
+                                _release(cache_key, token)
 
-                return rv
+                        gevent.spawn(_background)
+
+                    if (rv := self._view_response(stale)) is not None:
+                        return rv
+
+                # Nothing to serve, if another worker is computing this
+                # already wait for its result instead of doing it again.
+                if (token := _lease(cache_key)) is None:
+                    _wait(cache_key)
+
+                    if (entry := self._read_view(cache_key)) is not None and (
+                            rv := self._view_response(entry)) is not None:
+                        return rv
+
+                    token = _lease(cache_key)
+
+                try:
+                    return _refresh(cache_key, base_key, args, kwargs)
+                finally:
+                    if token is not None:
+                        _release(cache_key, token)
 
             def default_make_cache_key(*args, **kwargs):
                 # Convert non-keyword arguments (which is the way
@@ -207,6 +717,7 @@ class PatchedCache(Cache):
 
             decorated_function.uncached = f
             decorated_function.cache_timeout = timeout
+            decorated_function.depends_on = depends_on
             decorated_function.make_cache_key = default_make_cache_key
 
             return decorated_function
@@ -7,13 +7,15 @@
 		  https://www.boost.org/LICENSE_1_0.txt)
 """
 
+from datetime import date
+
 from web3.exceptions import BadFunctionCallOutput
 from flask import Blueprint, jsonify, request
 from web3 import Web3
 
 from syn.utils.analytics.fees import get_admin_fees, get_chain_bridge_fees, \
     get_pending_admin_fees, get_chain_validator_gas_fees, \
-    get_chain_airdrop_amounts
+    get_chain_airdrop_amounts, get_chain_bridge_fees_total
 from syn.utils.analytics.treasury import get_treasury_erc20_balances
 from syn.utils.data import cache, symbol_to_address
 from syn.utils import verify
@@ -79,7 +81,7 @@ def pending_adminfees_chain(chain: str):
                defaults={'token': None},
                methods=['GET'])
 @fees_bp.route('/validator/<chain:chain>/<token>', methods=['GET'])
-@cache.cached(timeout=TIMEOUT)
+@cache.cached(depends_on=['bridge:{chain}', 'prices'])
 def chain_validator_gas_fees(chain: str, token: str):
     if token is not None and token not in symbol_to_address[chain]:
         return (jsonify({
@@ -98,7 +100,7 @@ def chain_validator_gas_fees(chain: str, token: str):
                },
                methods=['GET'])
 @fees_bp.route('/bridge/<chain:chain>/<token>', methods=['GET'])
-@cache.cached(timeout=TIMEOUT)
+@cache.cached(depends_on=['bridge:{chain}', 'prices'])
 def chain_bridge_fees(chain: str, token: str):
     if token not in symbol_to_address[chain]:
         return (jsonify({
@@ -110,6 +112,31 @@ def chain_bridge_fees(chain: str, token: str):
         get_chain_bridge_fees(chain, symbol_to_address[chain][token]))
 
 
+@fees_bp.route('/bridge/<chain:chain>/<token>/total', methods=['GET'])
+@cache.cached(query_string=True, depends_on=['bridge:{chain}'])
+def chain_bridge_fees_total(chain: str, token: str):
+    if token not in symbol_to_address[chain]:
+        return (jsonify({
+            'error': 'invalid token',
+            'valids': list(symbol_to_address[chain]),
+        }), 400)
+
+    # Not `type=`, werkzeug would swallow the error and use the default.
+    from_date, to_date = request.args.get('from'), request.args.get('to')
+
+    try:
+        if from_date is not None:
+            from_date = date.fromisoformat(from_date)
+        if to_date is not None:
+            to_date = date.fromisoformat(to_date)
+    except ValueError:
+        return (jsonify({'error': 'invalid date'}), 400)
+
+    return jsonify(
+        get_chain_bridge_fees_total(chain, symbol_to_address[chain][token],
+                                    from_date, to_date))
+
+
 @fees_bp.route('/airdrop/',
                defaults={
                    'chain': '',
@@ -120,7 +147,7 @@ def chain_bridge_fees(chain: str, token: str):
                defaults={'token': None},
                methods=['GET'])
 @fees_bp.route('/airdrop/<chain:chain>/<token>', methods=['GET'])
-@cache.cached(timeout=TIMEOUT)
+@cache.cached(depends_on=['bridge:{chain}', 'prices'])
 def airdrop_chain_fees(chain: str, token: str):
     if token is not None and token not in symbol_to_address[chain]:
         return (jsonify({
@@ -105,7 +105,7 @@ def price_virtual():
                 defaults={'pool': ''},
                 methods=['GET'])
 @pools_bp.route('/volume/<chain:chain>/<pool>', methods=['GET'])
-@cache.cached(timeout=TIMEOUT)
+@cache.cached(depends_on=['pool:{chain}', 'prices'])
 def volume_pool(chain: str, pool: Pools):
     if pool not in get_args(Pools):
         return (jsonify({
@@ -117,7 +117,7 @@ def volume_pool(chain: str, pool: Pools):
 
 
 @pools_bp.route('/volume/total', methods=['GET'])
-@cache.cached()
+@cache.cached(depends_on=['pool', 'prices'])
 def swap_volume_total():
     return jsonify(get_swap_volume_total())
 
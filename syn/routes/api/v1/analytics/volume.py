@@ -23,7 +23,7 @@ volume_bp = Blueprint('volume_bp', __name__)
 
 
 @volume_bp.route('/<chain:chain>/filter/<token>/<direction>', methods=['GET'])
-@cache.cached(timeout=60 * 5)
+@cache.cached(depends_on=['bridge:{chain}', 'prices'])
 def chain_filter_token_direction(chain: str, token: str, direction: str):
     if direction.upper() not in ['IN', 'OUT']:
         return (jsonify({
@@ -48,7 +48,7 @@ def chain_filter_token_direction(chain: str, token: str, direction: str):
                  defaults={'direction': ''},
                  methods=['GET'])
 @volume_bp.route('/<chain:chain>/<direction>', methods=['GET'])
-@cache.cached()
+@cache.cached(depends_on=['bridge:{chain}', 'prices'])
 def chain_volume(chain: str, direction: str):
     if direction.upper() not in ['IN', 'OUT']:
         return (jsonify({
@@ -65,14 +65,14 @@ def chain_volume_total_redirect():
 
 
 @volume_bp.route('/total/in', methods=['GET'])
-@cache.cached(query_string=True)
+@cache.cached(query_string=True, depends_on=['bridge', 'prices'])
 def chain_volume_total():
     data = get_chain_volume_total(direction='IN')
     return jsonify(filter_volume_data(data, request.args))
 
 
 @volume_bp.route('/total/out', methods=['GET'])
-@cache.cached(query_string=True)
+@cache.cached(query_string=True, depends_on=['bridge', 'prices'])
 def chain_volume_total_out():
     data = get_chain_volume_total(direction='OUT')
     return jsonify(filter_volume_data(data, request.args))
@@ -85,18 +85,18 @@ def chain_tx_count_total_redirect():
 
 @volume_bp.route('/total/tx_count', methods=['GET'])
 @volume_bp.route('/total/tx_count/in', methods=['GET'])
-@cache.cached()
+@cache.cached(depends_on=['bridge'])
 def chain_tx_count_total():
     return jsonify(get_chain_tx_count_total(direction='IN'))
 
 
 @volume_bp.route('/total/tx_count/out', methods=['GET'])
-@cache.cached()
+@cache.cached(depends_on=['bridge'])
 def chain_tx_count_total_out():
     return jsonify(get_chain_tx_count_total(direction='OUT'))
 
 
 @volume_bp.route('/total/detailed/out', methods=['GET'])
-@cache.cached()
+@cache.cached(depends_on=['bridge', 'prices'])
 def chain_volume_total_detailed():
     return jsonify(get_chain_outflows_total())
@@ -13,11 +13,9 @@ from syn.utils.charts.bridge import chart_chain_bridge_volume
 from syn.utils.data import cache
 
 charts_bridge_bp = Blueprint('charts_bridge_bp', __name__)
-# 15m
-TIMEOUT = 15 * 60
 
 
 @charts_bridge_bp.route('/<chain:chain>', methods=['GET'])
-@cache.cached(timeout=TIMEOUT)
+@cache.cached(depends_on=['bridge:{chain}', 'prices'])
 def chain_direction_chart(chain: str):
     return jsonify(chart_chain_bridge_volume(chain))
@@ -24,13 +24,13 @@ circ_bp = Blueprint('circ_bp', __name__)
 pool = Pool()
 
 
-@timed_cache(60)
+@timed_cache(60, refresh_ahead=0.8)
 def get_chain_circ_cupply(chain: str) -> Decimal:
     return handle_decimals(
         call_abi(SYN_DATA[chain], 'contract', 'totalSupply'), SYN_DECIMALS)
 
 
-@timed_cache(60 * 30)
+@timed_cache(60 * 30, refresh_ahead=0.8)
 def get_all_chains_circ_supply() -> Decimal:
     jobs: List[Greenlet] = []
     total: Decimal = Decimal(0)
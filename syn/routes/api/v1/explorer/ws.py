@@ -1,109 +1,145 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-		  Copyright Blaze 2021.
+          Copyright Blaze 2021.
  Distributed under the Boost Software License, Version 1.0.
-	(See accompanying file LICENSE_1_0.txt or copy at
-		  https://www.boost.org/LICENSE_1_0.txt)
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+Live `bridge` and `confirm` events over Socket.IO. The feed (see
+`syn.utils.explorer.poll`) matches transfers and publishes them once, every
+worker relays them to its own clients. Socket.IO itself shares emits between
+workers (and nodes) through Redis.
 """
 
-from collections import defaultdict
-from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+from collections import defaultdict, deque
+import traceback
+import time
+import os
 
-from flask import current_app as app
 from flask_socketio import SocketIO
+from gevent.event import Event
+from flask import request
+import simplejson as json
+import gevent
+
+from syn.utils.data import MESSAGE_QUEUE_REDIS, MESSAGE_QUEUE_REDIS_URL
+from syn.utils.explorer.poll import CHANNEL
+
+#: Messages queued per client, a client which falls further behind loses the
+#: oldest ones rather than growing the worker's memory.
+CLIENT_QUEUE = int(os.getenv('WS_CLIENT_QUEUE', 100))
+# Packets a client may have waiting to be written before we hold off.
+CLIENT_BACKLOG = 16
+#: Channel the Socket.IO servers of every worker share emits through.
+SOCKETIO_CHANNEL = 'explorer:socketio'
+
+socketio = SocketIO()
+
+_stats: Dict[str, float] = defaultdict(float)
+_relay: Optional[gevent.Greenlet] = None
+
+
+def _backlog(sid: str) -> int:
+    # Packets engineio queued for `sid` which were not written to it yet.
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        return socketio.server.eio.sockets[eio_sid].queue.qsize()
+    except (AttributeError, KeyError):
+        return 0
+
+
+class Client:
+    """
+    Sends messages to a single client no faster than it reads them.
+    """
+    def __init__(self, sid: str) -> None:
+        self.sid = sid
+        self.queue: Deque[Tuple[str, Any]] = deque(maxlen=CLIENT_QUEUE)
+        self.ready = Event()
+        self.dropped = 0
+        self.greenlet = gevent.spawn(self._send)
+
+    def put(self, message: Tuple[str, Any]) -> None:
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+            _stats['dropped'] += 1
+
+        self.queue.append(message)
+        self.ready.set()
+
+    def _send(self) -> None:
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+
+            while self.queue:
+                while _backlog(self.sid) > CLIENT_BACKLOG:
+                    gevent.sleep(0.1)
+
+                event, data = self.queue.popleft()
+                # Only this worker has the client, skip the message queue.
+                socketio.emit(event, data, to=self.sid, ignore_queue=True)
+                _stats['sent'] += 1
+
+
+clients: Dict[str, Client] = {}
+
+
+def relay() -> None:
+    """
+    Hand everything the feed publishes to every client of this worker, it
+    runs forever.
+    """
+    while True:
+        try:
+            pubsub = MESSAGE_QUEUE_REDIS.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
 
-from syn.utils.explorer.poll import AttributeDict, Direction, start as _start
-from syn.utils.explorer.data import CHAINS, TOKENS_IN_POOL
-from syn.utils.helpers import convert_amount
+            for message in pubsub.listen():
+                data = json.loads(message['data'])
+                _stats['received'] += 1
 
-socketio: SocketIO = app.socketio  # type: ignore
+                for client in list(clients.values()):
+                    client.put((data['event'], data['data']))
+        except Exception:
+            traceback.print_exc()
+            time.sleep(1)
 
-pending_addresses = defaultdict(dict)
 
+@socketio.on('connect')
+def _connect() -> None:
+    global _relay
 
-# TODO: this whole thing should be deprecated.
-def _callback(event: AttributeDict, _chain: str, data: AttributeDict,
-              method: str, direction: Direction, logs: AttributeDict) -> None:
-    raise PendingDeprecationWarning
+    # Started on the first client, after we were forked.
+    if _relay is None:
+        _relay = gevent.spawn(relay)
 
-    chain = 'eth' if _chain == 'ethereum' else _chain
+    clients[request.sid] = Client(request.sid)  # type: ignore
 
-    if direction == Direction.OUT:
-        to_chain = CHAINS[data['chainId']]
 
-        try:
-            if method not in ['TokenRedeem', 'TokenRedeemAndRemove']:
-                from_token = logs[0].address
-                to_token = TOKENS_IN_POOL[to_chain]['nusd'][
-                    data['tokenIndexTo']]
-            elif method == 'TokenRedeem':
-                to_token = from_token = data['token']
-            else:
-                from_token = data['token']
-                to_token = TOKENS_IN_POOL[to_chain]['nusd'][
-                    data['swapTokenIndex']]
-
-            _time = datetime.now().timestamp()
-
-            json = {
-                'address': data['to'],
-                'to_chain': CHAINS[data['chainId']],
-                'from_chain': chain,
-                'amount': data['amount'] / 10**18,  # Fee is in nUSD/nETH
-                'time': _time,
-                'txhash': event['transactionHash'].hex(),
-                'from_token': from_token,
-                'to_token': to_token,
-            }
-
-            pending_addresses[data['to']] = {
-                'chain': chain,
-                'time': _time,
-                'from_token': from_token,
-            }
-
-            socketio.emit('bridge', json, broadcast=True)
-
-        except:
-            print(chain, event, data, method)
-            raise
-    elif direction == Direction.IN:
-        if data['to'] in pending_addresses:
-            try:
-                _data = pending_addresses[data['to']]
-
-                if method not in [
-                        'TokenWithdraw', 'TokenMint', 'TokenWithdrawAndRemove'
-                ]:
-                    to_token = TOKENS_IN_POOL[_chain][data['tokenIndexTo']]
-                elif method == 'TokenWithdrawAndRemove':
-                    to_token = TOKENS_IN_POOL[_chain][data['swapTokenIndex']]
-                else:
-                    to_token = data['token']
-
-                json = {
-                    'address': data['to'],
-                    'time_taken': datetime.now().timestamp() - _data['time'],
-                    'from_chain': _data['chain'],
-                    'to_chain': chain,
-                    'fee': data['fee'] / 10**18,  # Fee is in nUSD/nETH
-                    'to_token': to_token,
-                    'from_token': _data['from_token'],
-                    'amount': convert_amount(chain, to_token, data['amount']),
-                    'txhash': event['transactionHash'].hex(),
-                }
-
-                if 'swapSuccess' in data:
-                    json.update({'success': data['swapSuccess']})
-
-                socketio.emit('confirm', json, broadcast=True)
-                del pending_addresses[data['to']]
-
-            except:
-                print(chain, event, data, method)
-                raise
-
-
-def start() -> None:
-    socketio.start_background_task(_start, _callback)
+@socketio.on('disconnect')
+def _disconnect() -> None:
+    if (client := clients.pop(request.sid, None)) is not None:  # type: ignore
+        client.greenlet.kill()
+
+
+def init_app(app: Any) -> None:
+    socketio.init_app(app,
+                      message_queue=MESSAGE_QUEUE_REDIS_URL,
+                      channel=SOCKETIO_CHANNEL,
+                      async_mode='gevent',
+                      cors_allowed_origins='*')
+
+
+def get_ws_stats() -> Dict[str, Any]:
+    """
+    Clients of this worker and how many messages they were sent or lost for
+    being too slow.
+    """
+    return {
+        'clients': len(clients),
+        'queued': sum(len(x.queue) for x in clients.values()),
+        **_stats,
+    }
@@ -18,13 +18,19 @@ from syn.utils.price import (ADDRESS_TO_CGID, get_price_for_address,
 from syn.utils.data import (LOGS_REDIS_URL, SYN_DATA, cache, TOKENS_INFO,
                             symbol_to_address)
 from syn.utils.helpers import get_all_keys, date2block
+from syn.patches.cache import get_refresh_stats
+from syn.utils.cache import get_cache_stats
+from syn.utils.wrappa.governor import get_rpc_stats
+from syn.utils.offload import get_offload_stats
+from syn.routes.api.v1.explorer.ws import get_ws_stats
 from syn.utils.explorer.data import CHAINS
+from syn.indexer import get_state, request_restart
 
 utils_bp = Blueprint('utils_bp', __name__)
 
 
 # Something a bit more internal, but useful for tracking sync status because
-# we launch `update_getlogs` as a daemon now.
+# we launch the indexer as a daemon now.
 @utils_bp.route('/syncing', methods=['GET'])
 def syncing():
     ret = get_all_keys('*MAX_BLOCK_STORED',
@@ -41,6 +47,51 @@ def syncing():
     return jsonify(res)
 
 
+# Also internal, what every indexer worker is up to, see `syn.indexer`.
+@utils_bp.route('/indexer', methods=['GET'])
+def indexer_state():
+    return jsonify(get_state())
+
+
+# Also internal, restart one of the indexer's workers wherever it runs.
+@utils_bp.route('/indexer/<chain:chain>/<sink>/restart', methods=['POST'])
+def indexer_restart(chain: str, sink: str):
+    if not request_restart(chain, sink):
+        return (jsonify({'error': 'no such indexer worker'}), 404)
+
+    return jsonify({'restarting': f'{chain}:{sink}'})
+
+
+# Also internal, how this worker's rpc breakers and queues are doing.
+@utils_bp.route('/rpc', methods=['GET'])
+def rpc_stats():
+    return jsonify(get_rpc_stats())
+
+
+# Also internal, how long this worker's hub was blocked for and how the
+# aggregations offloaded to worker processes are doing.
+@utils_bp.route('/offload', methods=['GET'])
+def offload_stats():
+    return jsonify(get_offload_stats())
+
+
+# Also internal, how this worker's Socket.IO clients are keeping up.
+@utils_bp.route('/ws', methods=['GET'])
+def ws_stats():
+    return jsonify(get_ws_stats())
+
+
+# Also internal, how long refreshing each cached view takes and how the in
+# process caches are doing.
+@utils_bp.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'refresh': get_refresh_stats(),
+        'views': cache.get_views_stats(),
+        **get_cache_stats(),
+    })
+
+
 @utils_bp.route('/date2block/<chain:chain>/<date:date>', methods=['GET'])
 @cache.cached()
 def chain_date_to_block(chain: str, date: datetime):
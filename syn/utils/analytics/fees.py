@@ -9,16 +9,19 @@
 
 from typing import Any, Dict, Optional, Union, List
 from collections import defaultdict
+from datetime import date
 from decimal import Decimal
 
-from syn.utils.data import SYN_DATA, TOKEN_DECIMALS, LOGS_REDIS_URL
-from syn.utils.helpers import add_to_dict, raise_if, get_all_keys, \
-    handle_decimals
+from syn.utils.helpers import add_to_dict, raise_if, handle_decimals
+from syn.utils.data import SYN_DATA, TOKEN_DECIMALS
 from syn.utils.contract import get_all_tokens_in_pool, call_abi
-from syn.utils.price import CoingeckoIDS, get_historic_price, \
-    get_historic_price_for_address
+from syn.utils.price import CHAIN_TO_CGID
 from syn.utils.analytics.volume import create_totals
+from syn.utils.analytics.loader import BridgeLoader, get_loader
+from syn.utils.analytics.partition import partitioned
+from syn.utils.analytics.usd import usd_value
 from syn.utils.cache import timed_cache
+from syn.utils.analytics.sums import get_sums
 
 from gevent.greenlet import Greenlet
 from gevent.pool import Pool
@@ -26,28 +29,6 @@ import gevent
 
 pool = Pool()
 
-# Map the chain to their native token (what gas is paid in).
-_chain_to_cgid = {
-    'ethereum': CoingeckoIDS.ETH,
-    'avalanche': CoingeckoIDS.AVAX,
-    'bsc': CoingeckoIDS.BNB,
-    'polygon': CoingeckoIDS.MATIC,
-    'arbitrum': CoingeckoIDS.ETH,
-    'fantom': CoingeckoIDS.FTM,
-    'harmony': CoingeckoIDS.ONE,
-    'boba': CoingeckoIDS.ETH,
-    'moonriver': CoingeckoIDS.MOVR,
-    'optimism': CoingeckoIDS.ETH,
-    'aurora': CoingeckoIDS.ETH,
-    'moonbeam': CoingeckoIDS.GLMR,
-    'cronos': CoingeckoIDS.CRO,
-    'metis': CoingeckoIDS.METIS,
-    'dfk': CoingeckoIDS.JEWEL,
-    'klaytn': CoingeckoIDS.KLAY,
-    'canto': CoingeckoIDS.CANTO,
-}
-
-
 @timed_cache(60, maxsize=50)
 def get_admin_fee(chain: str,
                   index: int,
@@ -137,50 +118,50 @@ def get_chain_validator_gas_fees(
         chain: str,
         token: Optional[str] = None
 ) -> Dict[str, Dict[str, Union[str, Decimal]]]:
-    if token is None:
-        key = f'{chain}:bridge:*:IN'
-    else:
-        key = f'{chain}:bridge:*:{token.lower()}:IN'
+    if token is not None:
+        token = token.lower()
 
     # We aggregate validator gas fees on `IN` txs.
-    ret = get_all_keys(key,
-                       client=LOGS_REDIS_URL,
-                       index=[2, 4],
-                       serialize=True)
-
+    ret = get_loader().entries(chain, 'IN', token)
     res: Dict[str, Dict[str, Union[str, Decimal]]] = defaultdict(dict)
 
-    for k, v in ret.items():
-        date, _ = k.split(':')
-        price = get_historic_price(_chain_to_cgid[chain], date)
+    for entry in ret:
+        date, v = entry.date, entry.data
         x = v['validator']
 
         add_to_dict(res[date], 'gas_price', x['gas_price'])
         add_to_dict(res[date], 'transaction_fee', x['gas_paid'])
-        add_to_dict(res[date], 'price_usd', x['gas_paid'] * price)
+        add_to_dict(res[date], 'price_usd', usd_value(v, 'gas_paid'))
         add_to_dict(res[date], 'tx_count', v['txCount'])
 
     return res
 
 
-def get_chain_bridge_fees(chain: str, address: str):
+def _get_chain_bridge_fees(chain: str, address: str, loader: BridgeLoader,
+                           month: Optional[str]) -> Dict[str, Any]:
     # We aggregate bridge fees on `IN` txs
-    ret = get_all_keys(f'{chain}:bridge:*:{address}:IN',
-                       client=LOGS_REDIS_URL,
-                       index=2,
-                       serialize=True)
-
+    ret = loader.entries(chain, 'IN', address, month)
     res = defaultdict(dict)
 
-    for k, v in ret.items():
-        price = get_historic_price_for_address(chain, address, k)
+    for entry in ret:
+        k, v = entry.date, entry.data
 
         res[k] = {
             'fees': v['fees'],
-            'price_usd': v['fees'] * price,
+            'price_usd': usd_value(v, 'fees'),
             'tx_count': v['txCount'],
         }
 
+    return res
+
+
+def get_chain_bridge_fees(chain: str, address: str):
+    loader = get_loader()
+    res = partitioned(
+        f'fees:bridge:{chain}:{address}', chain, 'logs',
+        lambda month: _get_chain_bridge_fees(chain, address, loader, month),
+        lambda months: loader.prefetch(chain, months))
+
     total, total_usd, total_usd_current = create_totals(res,
                                                         chain,
                                                         address,
@@ -199,32 +180,39 @@ def get_chain_bridge_fees(chain: str, address: str):
     }
 
 
+def get_chain_bridge_fees_total(
+        chain: str,
+        address: str,
+        from_date: Optional[date] = None,
+        to_date: Optional[date] = None) -> Dict[str, Union[Decimal, int]]:
+    # Summed by redis while indexing, only the daily sums are sent back.
+    ret = get_sums([chain], 'IN', address, from_date, to_date)[chain]
+
+    return {
+        'fees': sum((x['fees'] for x in ret.values()), Decimal(0)),
+        'tx_count': int(sum(x['txCount'] for x in ret.values())),
+    }
+
+
 def get_chain_airdrop_amounts(chain: str,
                               token: Optional[str] = None) -> Dict[str, Any]:
-    if token is None:
-        key = f'{chain}:bridge:*:IN'
-    else:
-        key = f'{chain}:bridge:*:{token.lower()}:IN'
-
-    # We aggregate validator gas fees on `IN` txs.
-    ret = get_all_keys(key,
-                       client=LOGS_REDIS_URL,
-                       index=[2, 4],
-                       serialize=True)
+    if token is not None:
+        token = token.lower()
 
+    # We aggregate airdrops on `IN` txs.
+    ret = get_loader().entries(chain, 'IN', token)
     res: Dict[str, Dict[str, Union[str, Decimal]]] = defaultdict(dict)
 
-    for k, v in ret.items():
-        date, _ = k.split(':')
-        price = get_historic_price(_chain_to_cgid[chain], date)
+    for entry in ret:
+        date, v = entry.date, entry.data
 
         add_to_dict(res[date], 'airdrop', v['airdrops'])
-        add_to_dict(res[date], 'price_usd', v['airdrops'] * price)
+        add_to_dict(res[date], 'price_usd', usd_value(v, 'airdrops'))
         add_to_dict(res[date], 'tx_count', v['txCount'])
 
     total, total_usd, total_usd_current = create_totals(res,
                                                         chain,
-                                                        _chain_to_cgid[chain],
+                                                        CHAIN_TO_CGID[chain],
                                                         is_out=False,
                                                         key='airdrop')
 
@@ -237,5 +225,5 @@ def get_chain_airdrop_amounts(chain: str,
             },
         },
         'data': res,
-        'gas_token': _chain_to_cgid[chain]._name_,
+        'gas_token': CHAIN_TO_CGID[chain]._name_,
     }
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import (Any, DefaultDict, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Tuple)
+from collections import defaultdict
+
+from flask import g, has_request_context
+from gevent.lock import Semaphore
+import simplejson as json
+from redis import Redis
+
+from syn.utils.data import LOGS_REDIS_URL
+
+# Amount of keys we fetch per `MGET`.
+BATCH_SIZE = 1000
+
+
+class BridgeEntry(NamedTuple):
+    date: str
+    token: str
+    direction: str
+    # Only set for `OUT` txs.
+    to_chain: Optional[str]
+    data: Dict[str, Any]
+
+
+_Grouped = DefaultDict[str, DefaultDict[str, List[BridgeEntry]]]
+
+
+class BridgeLoader:
+    """
+    Fetch a chain's bridge aggregates (`{chain}:bridge:*`) once and hand out
+    slices of it grouped by direction and token, instead of having every
+    per token aggregator pattern scan the same keyspace again.
+
+    Use :func:`get_loader` to get the loader bound to the current request.
+    """
+
+    def __init__(self, client: Redis = LOGS_REDIS_URL) -> None:
+        self.client = client
+        # {(chain, month): {direction: {token: [BridgeEntry, ...]}}}
+        self._data: Dict[Tuple[str, Optional[str]], _Grouped] = {}
+        self._locks: Dict[Tuple[str, Optional[str]],
+                          Semaphore] = defaultdict(Semaphore)
+
+    def _fetch(self, pattern: str) -> List[BridgeEntry]:
+        res: List[BridgeEntry] = []
+        keys = list(self.client.scan_iter(match=pattern, count=BATCH_SIZE))
+
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+
+            for key, value in zip(batch, self.client.mget(batch)):
+                if value is None:
+                    # Deleted in between the scan and the get.
+                    continue
+
+                # {chain}:bridge:{date}:{token}:{direction}[:{to_chain}]
+                parts = key.split(':')
+                res.append(
+                    BridgeEntry(date=parts[2],
+                                token=parts[3],
+                                direction=parts[4],
+                                to_chain=parts[5] if len(parts) > 5 else None,
+                                data=json.loads(value, use_decimal=True)))
+
+        return res
+
+    def _load(self, chain: str, month: Optional[str] = None) -> _Grouped:
+        # Multiple greenlets may ask for the same data at once, only let the
+        # first one hit redis.
+        with self._locks[(chain, month)]:
+            if (chain, month) not in self._data:
+                data: _Grouped = defaultdict(lambda: defaultdict(list))
+
+                if month is not None and (chain, None) in self._data:
+                    # Whole chain has been fetched already, just slice it.
+                    entries: Iterable[BridgeEntry] = [
+                        x for x in self._entries(self._data[(chain, None)])
+                        if x.date.startswith(month)
+                    ]
+                elif month is not None:
+                    entries = self._fetch(f'{chain}:bridge:{month}-*')
+                else:
+                    entries = self._fetch(f'{chain}:bridge:*')
+
+                for entry in entries:
+                    data[entry.direction][entry.token].append(entry)
+
+                self._data[(chain, month)] = data
+
+        return self._data[(chain, month)]
+
+    def prefetch(self, chain: str, months: List[str]) -> None:
+        """
+        Fetch the whole chain with a single scan when several of its `months`
+        are about to be asked for, each month's scan would walk the whole
+        keyspace again.
+        """
+        if len(months) > 1:
+            self._load(chain)
+
+    @staticmethod
+    def _entries(data: _Grouped) -> Iterator[BridgeEntry]:
+        for tokens in data.values():
+            for entries in tokens.values():
+                yield from entries
+
+    def tokens(self,
+               chain: str,
+               direction: str,
+               month: Optional[str] = None) -> List[str]:
+        return list(self._load(chain, month)[direction])
+
+    def entries(self,
+                chain: str,
+                direction: str,
+                token: Optional[str] = None,
+                month: Optional[str] = None) -> List[BridgeEntry]:
+        """
+        Get bridge aggregates for `chain` and `direction`, optionally only
+        for `token` and/or a single `YYYY-MM` month.
+
+        If only a month is requested and the whole chain has not been
+        loaded yet, just that month's keys are fetched.
+        """
+        assert direction in ['IN', 'OUT'], f'invalid direction: {direction!r}'
+        data = self._load(chain, month)[direction]
+
+        if token is None:
+            return [x for entries in data.values() for x in entries]
+
+        return data.get(token, [])
+
+
+def get_loader() -> BridgeLoader:
+    """
+    Get the :class:`BridgeLoader` bound to the current request, or a fresh
+    one when called outside of a request (e.g. by cron jobs).
+
+    NOTE: greenlets spawned inside of a request do not share the request
+    context, so pass the loader explicitly to them.
+    """
+    if not has_request_context():
+        return BridgeLoader()
+
+    if 'bridge_loader' not in g:
+        g.bridge_loader = BridgeLoader()
+
+    return g.bridge_loader
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+from datetime import date, datetime
+
+import simplejson as json
+
+from syn.utils.data import REDIS, LOGS_REDIS_URL
+from syn.utils.cache import get_versions
+
+# The first month we have any bridge/pool data for.
+PARTITION_EPOCH = date(2021, 8, 1)
+# Bumped whenever a historic price gets filled in, as sealed partitions
+# include usd values which would then be outdated.
+PRICES_HISTORIC = 'prices:historic'
+
+Compute = Callable[[Optional[str]], Dict[str, Any]]
+
+
+def month_range(start: date = PARTITION_EPOCH,
+                end: Optional[date] = None) -> List[str]:
+    """
+    Every month from `start` till `end` (inclusive) formatted as `YYYY-MM`.
+
+    >>> month_range(date(2021, 11, 1), date(2022, 2, 1))
+    ['2021-11', '2021-12', '2022-01', '2022-02']
+    """
+    end = end or datetime.utcnow().date()
+    res: List[str] = []
+    year, month = start.year, start.month
+
+    while (year, month) <= (end.year, end.month):
+        res.append(f'{year:04}-{month:02}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return res
+
+
+def set_watermark(chain: str, namespace: str, address: str,
+                  _date: date) -> None:
+    """
+    Mark every day before `_date` as fully indexed for `address`, called by
+    :func:`syn.utils.wrappa.rpc.get_logs` after a pass.
+    """
+    LOGS_REDIS_URL.hset(f'{chain}:{namespace}:WATERMARK', address, str(_date))
+
+
+def get_watermark(chain: str, namespace: str) -> Optional[date]:
+    """
+    Get the date before which every day of `chain` is fully indexed, this is
+    the minimum of all the addresses indexed under `namespace`.
+    """
+    ret = LOGS_REDIS_URL.hvals(f'{chain}:{namespace}:WATERMARK')
+    if not ret:
+        return None
+
+    return min(date.fromisoformat(x) for x in ret)
+
+
+def merge(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge partition `src` into `dst`. Partitions never share dates, so this
+    only walks down until it reaches the date keys.
+    """
+    for k, v in src.items():
+        if k in dst and isinstance(dst[k], dict) and isinstance(v, dict):
+            merge(dst[k], v)
+        else:
+            dst[k] = v
+
+    return dst
+
+
+def partitioned(name: str,
+                chain: str,
+                namespace: str,
+                compute: Compute,
+                prefetch: Optional[Callable[[List[str]], None]] = None
+                ) -> Dict[str, Any]:
+    """
+    Compute a date keyed result per month, months which are entirely before
+    the indexer's watermark will never change again so they are sealed and
+    stored indefinitely. Only the open month(s) get recomputed.
+
+    Args:
+        name (str): unique name for the result, including its arguments.
+        chain (str): chain the result is for.
+        namespace (str): the indexer namespace (`logs` or `pool`) the
+            result is derived from.
+        compute (Compute): called with a `YYYY-MM` month and should return
+            the result for only that month.
+        prefetch (Optional[Callable[[List[str]], None]]): called with every
+            month about to be computed before the first one is, e.g. to
+            fetch them all at once.
+
+    Returns:
+        Dict[str, Any]: all partitions merged together.
+    """
+    watermark = get_watermark(chain, namespace)
+    if watermark is None:
+        # Nothing has been fully indexed yet, nothing can be sealed.
+        return compute(None)
+
+    months = month_range()
+    sealed = [x for x in months if x < watermark.strftime('%Y-%m')]
+
+    # Sealed partitions are stored along with the prices version they were
+    # computed with, a new version means they have to be recomputed.
+    epoch, = get_versions(PRICES_HISTORIC)
+    keys = [f'partitions:{name}:{x}' for x in sealed]
+    ret = dict(zip(sealed, REDIS.mget(keys) if keys else []))
+    data: Dict[str, Any] = {}
+
+    for month in sealed:
+        if (cached := ret[month]) is not None:
+            cached = json.loads(cached, use_decimal=True)
+            if cached['epoch'] == epoch:
+                data[month] = cached['data']
+
+    missing = [x for x in months if x not in data]
+    if prefetch is not None and missing:
+        prefetch(missing)
+
+    res: Dict[str, Any] = {}
+
+    for month in months:
+        if month not in data:
+            data[month] = compute(month)
+
+            if month in sealed:
+                REDIS.set(f'partitions:{name}:{month}',
+                          json.dumps({
+                              'epoch': epoch,
+                              'data': data[month]
+                          }))
+
+        merge(res, data[month])
+
+    return res
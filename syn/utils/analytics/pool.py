@@ -11,19 +11,20 @@ from typing import Any, Dict, Literal, Optional, Union, cast, get_args, List
 from collections import defaultdict
 from datetime import datetime
 from decimal import Decimal
-import logging
-import copy
 
 from web3.types import LogReceipt
-import simplejson as json
 from web3 import Web3
 import gevent
 
-from syn.utils.helpers import (add_to_dict, convert, get_all_keys,
-                               handle_decimals, raise_if)
+from syn.utils.helpers import (convert, get_all_keys, handle_decimals,
+                               raise_if)
 from syn.utils.data import SYN_DATA, POOL_ABI, TOKEN_DECIMALS, LOGS_REDIS_URL
 from syn.utils.price import CoingeckoIDS, get_historic_price
 from syn.utils.contract import get_pool_data
+from syn.utils.analytics.partition import partitioned
+from syn.utils.offload import offload
+from syn.utils.stream import apply_once, publish
+from syn.utils import compute
 
 Pools = Literal['nusd', 'neth']
 
@@ -191,7 +192,9 @@ POOLS: Dict[str, Dict[str, Dict[str, Union[str, int]]]] = {
 FEE_DENOMINATOR = 10**10
 FEE_DECIMALS = 10
 
-_chain_fee: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(dict)
+# {chain: {pool: {fee: {date: fee}}}}, every pool's `new{fee}fees` history.
+_fee_history: Dict[str, Dict[str, Dict[str, Dict[str, int]]]] = \
+    defaultdict(dict)
 
 
 def _address_to_pool(chain: str, address: str) -> Literal['nusd', 'neth']:
@@ -206,8 +209,10 @@ def _address_to_pool(chain: str, address: str) -> Literal['nusd', 'neth']:
     raise RuntimeError(f"{address} not found in {chain}'s pools")
 
 
-def pool_callback(chain: str, address: str, log: LogReceipt,
-                  first_run: bool) -> None:
+def decode_pool(chain: str, address: str, log: LogReceipt) -> Dict[str, Any]:
+    """
+    Fetch everything a pool log's aggregate needs from the rpc.
+    """
     w3: Web3 = SYN_DATA[chain]['w3']
     contract = w3.eth.contract(w3.toChecksumAddress(address), abi=POOL_ABI)
 
@@ -216,68 +221,45 @@ def pool_callback(chain: str, address: str, log: LogReceipt,
         raise RuntimeError(f'sanity check? got invalid topic: {topic}')
 
     event = TOPICS[topic]
-    data = contract.events[event]().processLog(log)
+    data = contract.events[event]().processLog(log)['args']
     pool = _address_to_pool(chain, address)
 
     block_n = log['blockNumber']
     timestamp = w3.eth.get_block(block_n)['timestamp']  # type: ignore
     date = datetime.utcfromtimestamp(timestamp).date()
-
-    if pool not in _chain_fee[chain]:
-        _chain_fee[chain][pool] = {
-            'admin': cast(int, POOLS[chain][pool]['admin']),
-            'swap': cast(int, POOLS[chain][pool]['swap']),
-        }
-
-    key_admin = f'{chain}:pool:{pool}:newadminfees'
-    key_swap = f'{chain}:pool:{pool}:newswapfees'
-
-    if first_run:
-        # Check previously set `newAdminFee` and `newSwapFee`.
-        _admin_fees = LOGS_REDIS_URL.hgetall(key_admin)
-        _swap_fees = LOGS_REDIS_URL.hgetall(key_swap)
-
-        key = lambda x: datetime.fromisoformat(x)
-
-        if _admin_fees:
-            _chain_fee[chain][pool]['admin'] = int(_admin_fees[max(
-                _admin_fees.keys(), key=key)])
-
-        if _swap_fees:
-            _chain_fee[chain][pool]['swap'] = int(_swap_fees[max(
-                _swap_fees.keys(), key=key)])
-
-    TOPICS_REVERSE = {v: k for k, v in TOPICS.items()}
-    admin_fee = _chain_fee[chain][pool]['admin']
-    swap_fee = _chain_fee[chain][pool]['swap']
     pool_data = get_pool_data(chain, address)
-    data = data['args']
 
-    newfee: Optional[Union[Literal['swap'], Literal['admin']]] = None
+    res: Dict[str, Any] = {
+        'kind': 'pool',
+        'address': address,
+        'block': block_n,
+        'tx_hash': convert(log['transactionHash']),
+        'log_index': log['logIndex'],
+        'date': str(date),
+        'pool': pool,
+        'event': event,
+    }
 
     # Wen match-case syntax?
-    if topic in [
-            TOPICS_REVERSE['RemoveLiquidityOne'], TOPICS_REVERSE['TokenSwap']
-    ]:
-        decimals = TOKEN_DECIMALS[chain][pool_data[data['boughtId']].lower()]
-        total_fees = Decimal(
-            data['tokensBought']) * Decimal(swap_fee) / Decimal(
-                (FEE_DENOMINATOR - swap_fee) * 10**decimals)
-        admin_lps_fees = handle_decimals(total_fees * admin_fee, FEE_DECIMALS)
-        lp_fees = total_fees - admin_lps_fees
-        volume = handle_decimals(data['tokensBought'], decimals)
-    elif topic == TOPICS_REVERSE['NewSwapFee']:
-        LOGS_REDIS_URL.hset(key_swap, str(date), data['newSwapFee'])
-        _chain_fee[chain][pool]['swap'] = data['newSwapFee']
-        newfee = 'swap'
-    elif topic == TOPICS_REVERSE['NewAdminFee']:
-        LOGS_REDIS_URL.hset(key_admin, str(date), data['newAdminFee'])
-        _chain_fee[chain][pool]['admin'] = data['newAdminFee']
-        newfee = 'admin'
-    elif topic in [
-            TOPICS_REVERSE['AddLiquidity'],
-            TOPICS_REVERSE['RemoveLiquidityImbalance']
-    ]:
+    if event in ['RemoveLiquidityOne', 'TokenSwap']:
+        # Fees depend on the pool's fee at the time, which is only known
+        # while aggregating.
+        res.update({
+            'tokens_bought': data['tokensBought'],
+            'decimals':
+            TOKEN_DECIMALS[chain][pool_data[data['boughtId']].lower()],
+        })
+
+        if event == 'TokenSwap':
+            res.update({
+                'sold_id': data['soldId'],
+                'bought_id': data['boughtId'],
+            })
+    elif event == 'NewSwapFee':
+        res['fee'] = data['newSwapFee']
+    elif event == 'NewAdminFee':
+        res['fee'] = data['newAdminFee']
+    elif event in ['AddLiquidity', 'RemoveLiquidityImbalance']:
         fees = data['fees']
         amounts = data['tokenAmounts']
         # Pools are (WETH, NETH) & (STABLES) - all practically have the same peg.
@@ -289,30 +271,85 @@ def pool_callback(chain: str, address: str, log: LogReceipt,
             total_fees += handle_decimals(fees[i], decimals)
             volume += handle_decimals(amounts[i], decimals)
 
+        res.update({'total_fees': total_fees, 'volume': volume})
+    else:
+        # Ends up in the dead letters, see `syn.utils.stream.dead_letter`.
+        raise RuntimeError(f'unsupported pool event {event}: {chain} {data}')
+
+    return res
+
+
+def _get_history(chain: str, pool: str) -> Dict[str, Dict[str, int]]:
+    if pool not in _fee_history[chain]:
+        _fee_history[chain][pool] = {
+            fee: {
+                k: int(v)
+                for k, v in LOGS_REDIS_URL.hgetall(
+                    f'{chain}:pool:{pool}:new{fee}fees').items()
+            }
+            for fee in ['admin', 'swap']
+        }
+
+    return _fee_history[chain][pool]
+
+
+def _get_fees(chain: str, pool: str, date: str) -> Dict[str, int]:
+    """
+    Fees of `pool` as of `date`, the last ones set on or before it. Resolved
+    per event, as replays (and claimed entries) may go back in time.
+    """
+    res: Dict[str, int] = {}
+
+    for fee, history in _get_history(chain, pool).items():
+        dates = [x for x in history if x <= date]
+        res[fee] = history[max(dates)] if dates \
+            else cast(int, POOLS[chain][pool][fee])
+
+    return res
+
+
+def apply_pool(chain: str, event: Dict[str, Any]) -> bool:
+    """
+    Add a decoded pool event (see :func:`decode_pool`) to its daily
+    aggregate, fee changes apply to every event after them. Events which
+    were applied before are skipped.
+    """
+    pool, date, name = event['pool'], event['date'], event['event']
+    fees = _get_fees(chain, pool, date)
+    admin_fee, swap_fee = fees['admin'], fees['swap']
+
+    newfee: Optional[Union[Literal['swap'], Literal['admin']]] = None
+
+    if name in ['RemoveLiquidityOne', 'TokenSwap']:
+        total_fees = Decimal(event['tokens_bought']) * Decimal(
+            swap_fee) / Decimal(
+                (FEE_DENOMINATOR - swap_fee) * 10**event['decimals'])
         admin_lps_fees = handle_decimals(total_fees * admin_fee, FEE_DECIMALS)
         lp_fees = total_fees - admin_lps_fees
+        volume = handle_decimals(event['tokens_bought'], event['decimals'])
+    elif name in ['NewSwapFee', 'NewAdminFee']:
+        newfee = 'swap' if name == 'NewSwapFee' else 'admin'
+        LOGS_REDIS_URL.hset(f'{chain}:pool:{pool}:new{newfee}fees', date,
+                            event['fee'])
+        _get_history(chain, pool)[newfee][date] = event['fee']
+        fees[newfee] = event['fee']
     else:
-        print(topic, 'unsupported', data, chain, log)
-
-        # TODO: dont skip...
-        logging.critical(
-            f'{chain} is skipping block({block_n}) in pool callback')
-        LOGS_REDIS_URL.rpush(f'{chain}:pool:skipped', block_n)
-        return
-
-    if topic in [
-            TOPICS_REVERSE['AddLiquidity'],
-            TOPICS_REVERSE['RemoveLiquidityOne'],
-            TOPICS_REVERSE['RemoveLiquidityImbalance']
+        total_fees = event['total_fees']
+        volume = event['volume']
+        admin_lps_fees = handle_decimals(total_fees * admin_fee, FEE_DECIMALS)
+        lp_fees = total_fees - admin_lps_fees
+
+    if name in [
+            'AddLiquidity', 'RemoveLiquidityOne', 'RemoveLiquidityImbalance'
     ]:
         tx_type = ':add_remove'
-    elif topic == TOPICS_REVERSE['TokenSwap']:
+    elif name == 'TokenSwap':
         # We want to track "base swaps" - swaps between non-nexus tokens
         # Swaps on Ethereum are always "base"
         # Swaps on other chains are base if both tokens ID > 0,
         # as nexus token is always the first token in the pool (ID = 0)
         if chain == 'ethereum' or \
-                (data['soldId'] > 0 and data['boughtId'] > 0):
+                (event['sold_id'] > 0 and event['bought_id'] > 0):
             tx_type = ':swap_base'
         else:
             tx_type = ':swap_nexus'
@@ -322,7 +359,7 @@ def pool_callback(chain: str, address: str, log: LogReceipt,
     key = f'{chain}:pool:{date}:{pool}{tx_type}'
     if newfee is not None:
         key_fee = 'newfee_' + newfee
-        value = {key_fee: _chain_fee[chain][pool][newfee]}
+        value = {key_fee: fees[newfee]}
     else:
         # Vars WILL NOT be unbound, stupid linter.
         value = {
@@ -332,8 +369,11 @@ def pool_callback(chain: str, address: str, log: LogReceipt,
             'tx_count': 1,
         }
 
-    if (ret := LOGS_REDIS_URL.get(key)) is not None:
-        ret = json.loads(ret, use_decimal=True)
+    def _update(ret: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if ret is None:
+            # TODO: possibly check if we got an earlier block before the one
+            # set in :func:`bridge_callback`, but it adds computational cost.
+            return dict(value)
 
         if newfee is not None:
             # New fee was set.
@@ -349,26 +389,26 @@ def pool_callback(chain: str, address: str, log: LogReceipt,
             # Quite inconsistent with :func:`bridge_callback`.
             ret['tx_count'] += 1
 
-        LOGS_REDIS_URL.set(key, json.dumps(ret))
-    else:
-        # TODO: possibly check if we got an earlier block before the one set in
-        # :func:`bridge_callback`, but it adds computational cost.
-        LOGS_REDIS_URL.set(key, json.dumps(value))
+        return ret
 
-    LOGS_REDIS_URL.set(f'{chain}:pool:{address}:MAX_BLOCK_STORED',
-                       log['blockNumber'])
-    LOGS_REDIS_URL.set(f'{chain}:pool:{address}:TX_INDEX',
-                       log['transactionIndex'])
+    return apply_once(chain, event, date, key, _update)
 
 
-def get_swap_volume_for_pool(pool: Pools, chain: str) -> Dict[str, Any]:
-    assert pool in get_args(Pools), f'invalid pool: {pool!r}'
+def pool_callback(chain: str, address: str, log: LogReceipt,
+                  first_run: bool) -> None:
+    # Aggregating happens on the other side of the stream, see `syn.indexer`.
+    publish(chain, decode_pool(chain, address, log),
+            ('pool', address, log['blockNumber'], log['transactionIndex']))
 
+
+def _get_swap_volume_for_pool(pool: Pools, chain: str,
+                              month: Optional[str]) -> Dict[str, Any]:
     res = defaultdict(dict)
+    date = '*' if month is None else f'{month}-*'
 
     for tx_type in ['add_remove', 'swap_base', 'swap_nexus']:
         x = Dict[str, Dict[str, str]]
-        ret: x = get_all_keys(f'{chain}:pool:*:{pool}:{tx_type}',
+        ret: x = get_all_keys(f'{chain}:pool:{date}:{pool}:{tx_type}',
                               client=LOGS_REDIS_URL,
                               index=2,
                               serialize=True)
@@ -400,6 +440,14 @@ def get_swap_volume_for_pool(pool: Pools, chain: str) -> Dict[str, Any]:
     return res
 
 
+def get_swap_volume_for_pool(pool: Pools, chain: str) -> Dict[str, Any]:
+    assert pool in get_args(Pools), f'invalid pool: {pool!r}'
+
+    return partitioned(
+        f'pool:volume:{chain}:{pool}', chain, 'pool',
+        lambda month: _get_swap_volume_for_pool(pool, chain, month))
+
+
 def get_swap_volume_for_chain(chain: str) -> Dict[str, Decimal]:
     volumes: List[Dict[str, Any]] = []
     res = defaultdict(Decimal)
@@ -420,25 +468,14 @@ def get_swap_volume_for_chain(chain: str) -> Dict[str, Decimal]:
 
 def get_swap_volume_total() -> Dict[str, Any]:
     threads: Dict[str, gevent.Greenlet] = {}
-    res = defaultdict(dict)
 
     for chain in SYN_DATA:
         threads[chain] = gevent.spawn(get_swap_volume_for_chain, chain)
 
     gevent.joinall(threads.values())
 
-    for chain, thread in threads.items():
-        ret = raise_if(thread.get(), None)
-
-        for date, v in ret.items():
-            add_to_dict(res[date], chain, v)
-
-    totals: Dict[str, Decimal] = {}
-
-    # Calculate totals for each day.
-    for date, data in copy.deepcopy(res).items():
-        for chain, v in data.items():
-            add_to_dict(res[date], 'total', v)
-            add_to_dict(totals, chain, v)
-
+    res, totals = offload(
+        compute.daily_totals,
+        {chain: [dict(raise_if(x.get(), None))]
+         for chain, x in threads.items()})
     return {'data': res, 'totals': totals}
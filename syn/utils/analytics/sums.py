@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+Running sums of the bridge aggregates, kept up to date by redis as events get
+applied (see `syn.utils.wrappa.rpc.apply_bridge`). Summaries only read a
+hash per chain (or token) instead of every aggregate.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Union
+from datetime import date, timedelta
+from decimal import Decimal
+
+from redis.client import Pipeline
+import simplejson as json
+
+from syn.utils.analytics.loader import BATCH_SIZE
+from syn.utils.data import LOGS_REDIS_URL
+
+#: Fields of a bridge aggregate which are summed per day, `txCount` is
+#: summed exactly and the rest to about 17 significant digits.
+FIELDS = ('txCount', 'fees')
+# Set of chains whose sums were built from their existing aggregates, drop a
+# chain from it to have its sums rebuilt.
+BUILT_KEY = 'sums:built'
+
+Sums = Dict[str, Dict[str, Decimal]]
+
+
+def sums_key(chain: str, direction: str, token: Optional[str] = None) -> str:
+    # Hash of `{date}:{field}` -> sum, of `token` or of every token.
+    if token is None:
+        return f'{chain}:sums:{direction}'
+
+    return f'{chain}:sums:{direction}:{token}'
+
+
+def add_sums(pipe: Pipeline, chain: str, direction: str, token: str,
+             _date: str, value: Dict[str, Any]) -> None:
+    """
+    Queue adding the bridge event (or aggregate) `value` of `_date` to the
+    sums of `token` and of the whole chain.
+    """
+    for key in [sums_key(chain, direction, token), sums_key(chain, direction)]:
+        for field in FIELDS:
+            if field not in value:
+                continue
+            elif field == 'txCount':
+                pipe.hincrby(key, f'{_date}:{field}', int(value[field]))
+            else:
+                pipe.hincrbyfloat(key, f'{_date}:{field}', str(value[field]))
+
+
+def build_sums(chain: str) -> bool:
+    """
+    Build `chain`'s sums from its aggregates, unless they were already. Only
+    safe while nothing applies events to the chain, i.e. by the holder of
+    its aggregate lease before it starts consuming.
+
+    Returns:
+        bool: whether the sums got built.
+    """
+    if LOGS_REDIS_URL.sismember(BUILT_KEY, chain):
+        return False
+
+    keys = list(
+        LOGS_REDIS_URL.scan_iter(match=f'{chain}:bridge:*', count=BATCH_SIZE))
+    stale = list(
+        LOGS_REDIS_URL.scan_iter(match=f'{chain}:sums:*', count=BATCH_SIZE))
+    pipe = LOGS_REDIS_URL.pipeline()
+
+    if stale:
+        pipe.unlink(*stale)
+
+    for i in range(0, len(keys), BATCH_SIZE):
+        batch = keys[i:i + BATCH_SIZE]
+
+        for key, value in zip(batch, LOGS_REDIS_URL.mget(batch)):
+            if value is None:
+                continue
+
+            # {chain}:bridge:{date}:{token}:{direction}[:{to_chain}]
+            _, _, _date, token, direction = key.split(':')[:5]
+            add_sums(pipe, chain, direction, token, _date,
+                     json.loads(value, use_decimal=True))
+
+    pipe.sadd(BUILT_KEY, chain)
+    pipe.execute()
+    return True
+
+
+def _dates(from_date: date, to_date: date) -> List[str]:
+    return [
+        str(from_date + timedelta(days=x))
+        for x in range((to_date - from_date).days + 1)
+    ]
+
+
+def get_sums(chains: Iterable[str],
+             direction: str = 'IN',
+             token: Optional[str] = None,
+             from_date: Optional[Union[date, str]] = None,
+             to_date: Optional[Union[date, str]] = None,
+             fields: Iterable[str] = FIELDS) -> Dict[str, Sums]:
+    """
+    Daily sums of `fields` for every chain in `chains`, fetched in a single
+    round trip. A bounded range is read field by field, otherwise the
+    whole (one field per day) hash is.
+
+    >>> get_sums(['bsc'], token='0x23b8...', from_date='2022-01-27')
+    {'bsc': {'2022-01-27': {'txCount': Decimal('42'), 'fees': ...}, ...}}
+
+    Args:
+        direction (str): either `IN` or `OUT`.
+        token (Optional[str]): token address to sum, defaults to every
+            token.
+        from_date (Optional[Union[date, str]]): inclusive start date.
+        to_date (Optional[Union[date, str]]): inclusive end date.
+
+    Returns:
+        Dict[str, Sums]: `chain` -> `date` -> `field` -> sum
+    """
+    assert direction in ['IN', 'OUT'], f'invalid direction: {direction!r}'
+
+    chains, fields = list(chains), list(fields)
+    _from, _to = str(from_date or ''), str(to_date or '')
+    pipe = LOGS_REDIS_URL.pipeline()
+    names: List[str] = []
+
+    if _from and _to:
+        names = [f'{x}:{y}' for x in _dates(date.fromisoformat(_from),
+                                            date.fromisoformat(_to))
+                 for y in fields]
+
+    for chain in chains:
+        key = sums_key(chain, direction, token)
+
+        if names:
+            pipe.hmget(key, names)
+        else:
+            pipe.hgetall(key)
+
+    res: Dict[str, Sums] = {}
+
+    for chain, ret in zip(chains, pipe.execute()):
+        if names:
+            ret = dict(zip(names, ret))
+
+        sums = res[chain] = {}
+
+        for name, value in ret.items():
+            _date, field = name.split(':')
+
+            if value is None or field not in fields:
+                continue
+            # Dates are isoformat, so comparing strings is enough.
+            elif (_from and _date < _from) or (_to and _date > _to):
+                continue
+
+            sums.setdefault(_date, {x: Decimal(0) for x in fields})
+            sums[_date][field] = Decimal(value)
+
+    return res
@@ -13,9 +13,9 @@ from typing import Dict
 
 from web3.types import BlockIdentifier
 
-from syn.utils.price import get_price_coingecko, get_price_for_address
+from syn.utils.price import (CHAIN_TO_CGID, get_price_coingecko,
+                             get_price_for_address)
 from syn.utils.data import SYN_DATA, TOKEN_DECIMALS, TREASURY
-from syn.utils.analytics.fees import _chain_to_cgid
 from syn.utils.explorer.data import TOKENS_IN_POOL
 from syn.utils.contract import get_balance_of
 from syn.utils.helpers import handle_decimals
@@ -79,7 +79,7 @@ def get_treasury_erc20_balances_usd(
 
     for k, v in ret.items():
         if k == 'native':
-            price = get_price_coingecko(_chain_to_cgid[chain])
+            price = get_price_coingecko(CHAIN_TO_CGID[chain])
         else:
             price = get_price_for_address(chain, k.lower())
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+from datetime import date
+from decimal import Decimal
+
+import simplejson as json
+from redis.client import Pipeline
+
+from syn.utils.price import (ADDRESS_TO_CGID, CHAIN_TO_CGID, SYN_LISTED,
+                             CoingeckoIDS, lookup_historic_price,
+                             lookup_historic_price_for_address)
+from syn.utils.data import LOGS_REDIS_URL, SYN_DATA, TOKEN_DECIMALS
+from syn.utils.explorer.data import CHAINS
+
+# Fields of a bridge aggregate which are priced in the bridged token.
+TOKEN_FIELDS = {'amount': ('amount', ), 'fees': ('fees', )}
+# Fields of a bridge aggregate which are priced in the chain's gas token.
+GAS_FIELDS = {
+    'gas_paid': ('validator', 'gas_paid'),
+    'airdrops': ('airdrops', ),
+}
+# Amount of keys repriced per transaction.
+BATCH_SIZE = 1000
+
+
+def _field(data: Dict[str, Any], path: Iterable[str]) -> Optional[Decimal]:
+    for x in path:
+        if not isinstance(data, dict) or x not in data:
+            return None
+
+        data = data[x]
+
+    return Decimal(data)
+
+
+def _is_priced(data: Dict[str, Any]) -> bool:
+    usd = data.get('usd', {})
+
+    return all(name in usd
+               for fields in [TOKEN_FIELDS, GAS_FIELDS]
+               for name, path in fields.items()
+               if _field(data, path) is not None)
+
+
+def price_entry(chain: str, token: str, _date: str,
+                data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Store the usd value of a bridge aggregate's fields as `data['usd']`,
+    fields whose price on `_date` is not known yet are left out and get
+    filled in by :func:`reprice` once it is.
+    """
+    usd: Dict[str, Decimal] = {}
+
+    for fields, price in [
+        (TOKEN_FIELDS,
+         lookup_historic_price_for_address(chain, token, _date)),
+        (GAS_FIELDS, lookup_historic_price(CHAIN_TO_CGID[chain], _date)
+         if 'validator' in data else None),
+    ]:
+        if price is None:
+            continue
+
+        for name, path in fields.items():
+            if (value := _field(data, path)) is not None:
+                usd[name] = value * price
+
+    if usd:
+        data['usd'] = usd
+    else:
+        data.pop('usd', None)
+
+    return data
+
+
+def usd_value(data: Dict[str, Any], field: str) -> Decimal:
+    """
+    The stored usd value of `field` (see :data:`TOKEN_FIELDS` and
+    :data:`GAS_FIELDS`) of a bridge aggregate, zero while it is unpriced.
+    Readers never price, that's up to :func:`reprice` and :func:`backfill`.
+    """
+    return Decimal(data.get('usd', {}).get(field, 0))
+
+
+def _reprice_keys(keys: List[str], force: bool = True) -> int:
+    def _update(pipe: Pipeline) -> int:
+        updates: Dict[str, str] = {}
+
+        for key, value in zip(keys, pipe.mget(keys)):
+            if value is None:
+                continue
+
+            # {chain}:bridge:{date}:{token}:{direction}[:{to_chain}]
+            chain, _, _date, token = key.split(':')[:4]
+            data = json.loads(value, use_decimal=True)
+            before = data.get('usd')
+
+            if not force and _is_priced(data):
+                continue
+
+            if price_entry(chain, token, _date, data).get('usd') != before:
+                updates[key] = json.dumps(data)
+
+        pipe.multi()
+        if updates:
+            pipe.mset(updates)
+
+        return len(updates)
+
+    # The indexer may update these keys at the same time, retry if so.
+    return LOGS_REDIS_URL.transaction(_update, *keys,
+                                      value_from_callable=True)
+
+
+def _affected_tokens(chain: str, cgid: str, _date: str) -> Set[str]:
+    tokens: Set[str] = set()
+
+    if chain in CHAIN_TO_CGID and CHAIN_TO_CGID[chain].value == cgid:
+        # Gas and airdrops are priced in it, for every token.
+        tokens.update(TOKEN_DECIMALS[chain])
+
+    for address, x in ADDRESS_TO_CGID.get(chain, {}).items():
+        if x.value == cgid:
+            tokens.add(address)
+        elif x == CoingeckoIDS.SYN and cgid == CoingeckoIDS.NRV.value \
+                and _date < SYN_LISTED:
+            tokens.add(address)
+
+    return tokens
+
+
+def reprice(prices: Dict[str, Iterable[date]]) -> Set[str]:
+    """
+    Recompute the usd values of only the bridge aggregates affected by
+    filled (or corrected) prices, given as `{cgid: [date, ...]}`.
+
+    Returns:
+        Set[str]: chains which had any aggregate updated.
+    """
+    res: Set[str] = set()
+
+    for cgid, dates in prices.items():
+        for _date in map(str, dates):
+            for chain in SYN_DATA:
+                keys: List[str] = []
+
+                for token in _affected_tokens(chain, cgid, _date):
+                    prefix = f'{chain}:bridge:{_date}:{token}'
+                    keys.append(f'{prefix}:IN')
+                    keys.extend(f'{prefix}:OUT:{x}' for x in CHAINS)
+
+                if keys and _reprice_keys(keys):
+                    res.add(chain)
+
+    return res
+
+
+def backfill(chain: str) -> int:
+    """
+    Price every bridge aggregate of `chain` which is missing (some of) its
+    usd values, e.g. ones indexed before they were stored or whose price
+    was not known yet.
+
+    Returns:
+        int: amount of aggregates updated.
+    """
+    keys = list(
+        LOGS_REDIS_URL.scan_iter(match=f'{chain}:bridge:*', count=BATCH_SIZE))
+    res = 0
+
+    for i in range(0, len(keys), BATCH_SIZE):
+        res += _reprice_keys(keys[i:i + BATCH_SIZE], force=False)
+
+    return res
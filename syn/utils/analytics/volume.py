@@ -7,19 +7,25 @@
 		  https://www.boost.org/LICENSE_1_0.txt)
 """
 
-from typing import Any, DefaultDict, Dict, Tuple, Union
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple, Union
 from collections import defaultdict
 from decimal import Decimal
 
 from gevent.greenlet import Greenlet
 import gevent
 
-from syn.utils.price import (CoingeckoIDS, get_historic_price_for_address,
-                             get_price_for_address, get_price_coingecko)
-from syn.utils.helpers import (add_to_dict, get_all_keys, raise_if,
-                               calculate_volume_totals, recursive_defaultdict,
+from syn.utils.price import (CoingeckoIDS, get_price_for_address,
+                             get_price_coingecko)
+from syn.utils.helpers import (add_to_dict, calculate_volume_totals,
+                               raise_if, recursive_defaultdict,
                                update_global_data)
+from syn.utils.analytics.loader import BATCH_SIZE, BridgeLoader, get_loader
+from syn.utils.analytics.partition import partitioned
+from syn.utils.analytics.usd import usd_value
 from syn.utils.data import LOGS_REDIS_URL, SYN_DATA, symbol_to_address
+from syn.utils.offload import offload
+from syn.utils.analytics.sums import get_sums
+from syn.utils import compute
 
 
 def create_totals(
@@ -76,46 +82,38 @@ def create_totals(
 def get_chain_volume_total(direction: str) -> Dict[str, Any]:
     assert direction in ['IN', 'OUT']
 
-    res = recursive_defaultdict()
     jobs: Dict[str, Greenlet] = {}
+    loader = get_loader()
 
     for chain in SYN_DATA.keys():
-        jobs[chain] = gevent.spawn(get_chain_volume, chain, direction)
+        jobs[chain] = gevent.spawn(get_chain_volume, chain, direction, loader)
 
     gevent.joinall(jobs.values())
+    values: Dict[str, List[Dict[str, Decimal]]] = {}
 
     for chain, job in jobs.items():
-        assert chain not in res
         ret = raise_if(job.get(), None)['data']
+        values[chain] = [{
+            date: _data['price_usd']
+            for date, _data in data['data'].items()
+        } for data in ret.values()]
 
-        for data in ret.values():
-            for date, _data in data['data'].items():
-                add_to_dict(res[date], chain, _data['price_usd'])
-
-    return {'data': res, 'totals': calculate_volume_totals(res)}
+    res, totals = offload(compute.daily_totals, values)
+    return {'data': res, 'totals': totals}
 
 
 def get_chain_outflows_total() -> Dict[str, Any]:
-    totals = recursive_defaultdict()
-    res = recursive_defaultdict()
-
-    ret = get_all_keys(f'*bridge:*:OUT:*',
-                       serialize=True,
-                       client=LOGS_REDIS_URL,
-                       index=False)
+    keys = list(
+        LOGS_REDIS_URL.scan_iter(match='*:bridge:*:OUT:*', count=BATCH_SIZE))
+    rows: List[Tuple[str, str]] = []
 
-    for k, v in ret.items():
-        from_chain, _, date, address, _, to_chain = k.split(':')
-
-        price = get_historic_price_for_address(from_chain, address, date)
-        volume_usd = Decimal(v['amount']) * price
-
-        add_to_dict(res[from_chain][date][to_chain], 'tx_count', v['txCount'])
-        add_to_dict(res[from_chain][date][to_chain], 'volume_usd', volume_usd)
-
-        add_to_dict(totals[from_chain][to_chain], 'tx_count', v['txCount'])
-        add_to_dict(totals[from_chain][to_chain], 'volume_usd', volume_usd)
+    for i in range(0, len(keys), BATCH_SIZE):
+        batch = keys[i:i + BATCH_SIZE]
+        rows.extend((k, v) for k, v in zip(batch, LOGS_REDIS_URL.mget(batch))
+                    if v is not None)
 
+    # Parsing and summing every aggregate is what takes long, not redis.
+    res, totals = offload(compute.outflows, rows)
     return {'data': res, 'totals': totals}
 
 
@@ -124,51 +122,53 @@ def get_chain_tx_count_total(direction: str) -> Dict[str, Dict[str, Decimal]]:
 
     res = recursive_defaultdict()
 
-    if direction == 'OUT':
-        direction = 'OUT:*'
+    # Summed by redis while indexing, we only need the daily tx counts.
+    ret = get_sums(SYN_DATA, direction, fields=['txCount'])
 
-    ret = get_all_keys(f'*:bridge:*:{direction}',
-                       serialize=True,
-                       client=LOGS_REDIS_URL,
-                       index=False)
+    for chain, sums in ret.items():
+        for date, v in sums.items():
+            add_to_dict(res[chain], date, int(v['txCount']))
 
-    for k, v in ret.items():
-        if direction == 'IN':
-            chain, _, date, _, _ = k.split(':')
-        else:
-            chain, _, date, _, _, _ = k.split(':')
+    return {'data': res, 'totals': calculate_volume_totals(res)}
 
-        add_to_dict(res[chain], date, v['txCount'])
 
-    return {'data': res, 'totals': calculate_volume_totals(res)}
+def _get_chain_volume_data(chain: str, direction: str, loader: BridgeLoader,
+                           month: Optional[str]) -> Dict[str, Any]:
+    res = recursive_defaultdict()
 
+    # `OUT` txs have a key per destination chain, sum them up per day.
+    for entry in loader.entries(chain, direction, month=month):
+        address, date, v = entry.token, entry.date, entry.data
 
-def get_chain_volume_for_address(address: str,
-                                 chain: str,
-                                 direction: str = '*') -> Dict[str, Any]:
-    assert direction in ['IN', 'OUT:*']
+        add_to_dict(res[address][date], 'tx_count', v['txCount'])
+        add_to_dict(res[address][date], 'volume', Decimal(v['amount']))
+        add_to_dict(res[address][date], 'price_usd', usd_value(v, 'amount'))
 
-    res = recursive_defaultdict()
+    return res
 
-    ret: Dict[str, Dict[str, str]] = get_all_keys(
-        f'{chain}:bridge:*:{address}:{direction}',
-        client=LOGS_REDIS_URL,
-        index=2 if direction == 'IN' else False,
-        serialize=True,
-    )
 
-    for k, v in ret.items():
-        if direction == 'IN':
-            date = k
-        else:
-            date = k.split(':')[2]
+def get_chain_volume_data(
+        chain: str,
+        direction: str,
+        loader: Optional[BridgeLoader] = None) -> Dict[str, Any]:
+    """
+    Get the daily volume of every token bridged on `chain`, past months are
+    sealed once indexed, see :func:`partitioned`.
+
+    Returns:
+        Dict[str, Any]: `token` -> `date` -> `{tx_count, volume, price_usd}`
+    """
+    assert direction in ['IN', 'OUT']
+    loader = loader or get_loader()
 
-        price = get_historic_price_for_address(chain, address, date)
+    return partitioned(
+        f'volume:{chain}:{direction}', chain, 'logs',
+        lambda month: _get_chain_volume_data(chain, direction, loader, month),
+        lambda months: loader.prefetch(chain, months))
 
-        add_to_dict(res[date], 'tx_count', v['txCount'])
-        add_to_dict(res[date], 'volume', Decimal(v['amount']))
-        add_to_dict(res[date], 'price_usd', Decimal(v['amount']) * price)
 
+def _get_chain_volume_for_address(address: str, chain: str,
+                                  res: Dict[str, Any]) -> Dict[str, Any]:
     total, total_usd, total_usd_current = create_totals(
         res,
         chain,
@@ -189,24 +189,31 @@ def get_chain_volume_for_address(address: str,
     }
 
 
-def get_chain_volume(chain: str, direction: str = '*') -> Dict[str, Any]:
-    assert direction in ['IN', 'OUT']
+def get_chain_volume_for_address(
+        address: str,
+        chain: str,
+        direction: str = '*',
+        loader: Optional[BridgeLoader] = None) -> Dict[str, Any]:
+    assert direction in ['IN', 'OUT:*']
+
+    ret = get_chain_volume_data(chain, direction.split(':')[0], loader)
+    return _get_chain_volume_for_address(address, chain,
+                                         ret.get(address, {}))
 
-    if direction == 'OUT':
-        direction = 'OUT:*'
 
-    # Get all tokens for the chain which we have stored.
-    ret = get_all_keys(f'{chain}:bridge:*:{direction}',
-                       serialize=True,
-                       client=LOGS_REDIS_URL,
-                       index=3)
-    tokens = ret.keys()
+def get_chain_volume(chain: str,
+                     direction: str = '*',
+                     loader: Optional[BridgeLoader] = None) -> Dict[str, Any]:
+    assert direction in ['IN', 'OUT']
 
+    # Aggregate the whole chain at once, each token's totals then only
+    # get their slice of it.
+    ret = get_chain_volume_data(chain, direction, loader)
     jobs: Dict[str, Greenlet] = {}
 
-    for token in tokens:
-        jobs[token] = gevent.spawn(get_chain_volume_for_address, token, chain,
-                                   direction)
+    for token, data in ret.items():
+        jobs[token] = gevent.spawn(_get_chain_volume_for_address, token,
+                                   chain, data)
 
     addresses = list(symbol_to_address[chain].values())
     symbols = list(symbol_to_address[chain].keys())
@@ -7,40 +7,331 @@
           https://www.boost.org/LICENSE_1_0.txt)
 """
 
-from typing import Callable, Optional, Union
-from functools import lru_cache, wraps
+from typing import (Any, Callable, Counter, DefaultDict, Dict, Hashable,
+                    List, NamedTuple, Optional, Set, Tuple, Union)
+from collections import Counter as _Counter, OrderedDict, defaultdict
+from functools import wraps
 from datetime import timedelta
+import traceback
+import random
 import time
+import sys
 
-from flask_caching.backends import SimpleCache
+from gevent.event import AsyncResult
+import gevent
 import simplejson as json
 
-from .data import REDIS
+from .data import REDIS, MESSAGE_QUEUE_REDIS
 
-_redis_cache = SimpleCache()
 
+def _sizeof(obj: Any) -> int:
+    """Approximate (deep) size of `obj` in bytes."""
+    size = sys.getsizeof(obj)
 
-# Gotta love SO: https://stackoverflow.com/a/63674816
-def timed_cache(max_age, maxsize=5, typed=False):
+    if isinstance(obj, dict):
+        size += sum(_sizeof(k) + _sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_sizeof(x) for x in obj)
+
+    return size
+
+
+class _Entry(NamedTuple):
+    value: Any
+    version: Tuple[int, ...]
+    expires: float
+    size: int
+
+
+class LRUCache:
+    """
+    In process LRU cache bounded by both the amount of entries and their
+    (approximate) total size in bytes.
+    """
+    def __init__(self,
+                 maxsize: int = 100_000,
+                 maxbytes: int = 64 * 1024 * 1024) -> None:
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.evictions = 0
+        self._data: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[_Entry]:
+        if (entry := self._data.get(key)) is None:
+            return None
+
+        if entry.expires < time.time():
+            self.delete(key)
+            return None
+
+        self._data.move_to_end(key)
+        return entry
+
+    def set(self, key: Hashable, value: Any, version: Tuple[int, ...],
+            timeout: float) -> None:
+        size = _sizeof(key) + _sizeof(value)
+        self.delete(key)
+
+        if size > self.maxbytes:
+            return
+
+        self._data[key] = _Entry(value, version, time.time() + timeout, size)
+        self.bytes += size
+
+        while len(self._data) > self.maxsize or self.bytes > self.maxbytes:
+            _, entry = self._data.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        if (entry := self._data.pop(key, None)) is not None:
+            self.bytes -= entry.size
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._data),
+            'maxsize': self.maxsize,
+            'bytes': self.bytes,
+            'maxbytes': self.maxbytes,
+            'evictions': self.evictions,
+        }
+
+
+_redis_cache = LRUCache()
+#: Counters per `module.qualname`, e.g. `hits`, `misses`, see
+#: :func:`get_cache_stats`.
+_stats: DefaultDict[str, Counter[str]] = defaultdict(_Counter)
+
+#: Hash of dataset -> version, e.g. `bridge:bsc`, `pool:bsc`, `prices`.
+VERSIONS_KEY = 'versions'
+# How often (in seconds) we refresh our local copy of the versions, bumps are
+# also pushed over :data:`INVALIDATE_CHANNEL` so this is just a fallback.
+VERSIONS_POLL = 30
+_versions: Dict[str, int] = {}
+_versions_fetched: float = 0
+
+#: Pub/sub channel every worker listens on to drop its in process copies.
+INVALIDATE_CHANNEL = 'invalidate'
+_Handler = Callable[[Dict[str, Any]], None]
+_handlers: DefaultDict[str, List[_Handler]] = defaultdict(list)
+# [(datasets, clear), ...] of every `timed_cache` with `depends_on`.
+_timed: List[Tuple[Set[str], Callable[[], None]]] = []
+
+
+def on_invalidate(kind: str) -> Callable[[_Handler], _Handler]:
+    """
+    Register a handler for `kind` messages, see :func:`publish_invalidation`.
+    """
+    def _decorator(fn: _Handler) -> _Handler:
+        _handlers[kind].append(fn)
+        return fn
+
+    return _decorator
+
+
+def publish_invalidation(kind: str, **data: Any) -> None:
+    """
+    Tell every worker, on every node, to run its `kind` handlers with `data`.
+    """
+    MESSAGE_QUEUE_REDIS.publish(INVALIDATE_CHANNEL,
+                                json.dumps({
+                                    'kind': kind,
+                                    **data
+                                }))
+
+
+def listen_invalidations() -> None:
+    """
+    Apply invalidations published by other processes, meant to be spawned
+    once per worker as it runs forever.
+    """
+    while True:
+        try:
+            pubsub = MESSAGE_QUEUE_REDIS.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            # Anything could have changed while we were not subscribed.
+            _invalidate_versions({})
+
+            for message in pubsub.listen():
+                data = json.loads(message['data'])
+
+                for handler in _handlers[data['kind']]:
+                    try:
+                        handler(data)
+                    except Exception:
+                        traceback.print_exc()
+        except Exception:
+            traceback.print_exc()
+            time.sleep(1)
+
+
+def bump_version(*datasets: str) -> None:
+    """
+    Signal that the data behind `datasets` changed, anything cached which
+    depends on it will be recomputed on its next use.
+
+    A dataset's family is bumped too, so `bridge:bsc` also bumps `bridge`
+    which views spanning every chain can depend on.
+    """
+    global _versions_fetched
+
+    families = set(x.split(':')[0] for x in datasets if ':' in x)
+
+    pipe = MESSAGE_QUEUE_REDIS.pipeline(transaction=False)
+    for dataset in set(datasets) | families:
+        pipe.hincrby(VERSIONS_KEY, dataset, 1)
+
+    pipe.execute()
+    # Make sure our own next read sees the bump.
+    _versions_fetched = 0
+
+    publish_invalidation('versions', datasets=sorted(set(datasets) | families))
+
+
+@on_invalidate('versions')
+def _invalidate_versions(data: Dict[str, Any]) -> None:
+    global _versions_fetched
+
+    # Refetched on the next `get_versions`, which drops internal copies
+    # depending on them.
+    _versions_fetched = 0
+
+    # No datasets means anything could have changed.
+    datasets = set(data.get('datasets', []))
+    for depends_on, clear in _timed:
+        if not datasets or depends_on & datasets:
+            clear()
+
+
+def get_versions(*datasets: str) -> Tuple[int, ...]:
+    """
+    Get the current versions of `datasets`, which are refreshed at most
+    every :data:`VERSIONS_POLL` seconds.
+    """
+    global _versions, _versions_fetched
+
+    if time.time() - _versions_fetched > VERSIONS_POLL:
+        _versions = {
+            k: int(v)
+            for k, v in MESSAGE_QUEUE_REDIS.hgetall(VERSIONS_KEY).items()
+        }
+        _versions_fetched = time.time()
+
+    return tuple(_versions.get(x, 0) for x in datasets)
+
+
+def _make_key(args: Tuple[Any, ...], kwargs: Dict[str, Any],
+              typed: bool) -> Hashable:
+    key = args + tuple(sorted(kwargs.items()))
+    if typed:
+        key += tuple(type(x) for x in args)
+        key += tuple(type(v) for _, v in sorted(kwargs.items()))
+
+    return key
+
+
+def timed_cache(max_age: float,
+                maxsize: int = 128,
+                typed: bool = False,
+                jitter: float = 0.1,
+                refresh_ahead: Optional[float] = None,
+                depends_on: Tuple[str, ...] = ()):
     """
-    Least-recently-used cache decorator with time-based cache invalidation.
+    Least-recently-used cache decorator where every entry expires on its
+    own, `max_age` seconds (give or take `jitter`) after it was cached. The
+    jitter keeps entries (and workers) from all expiring at the same time.
 
     Args:
         max_age: Time to live for cached results (in seconds).
-        maxsize: Maximum cache size (see `functools.lru_cache`).
+        maxsize: Maximum cache size.
         typed: Cache on distinct input types (see `functools.lru_cache`).
+        jitter: Fraction of `max_age` an entry's lifetime is randomized by.
+        refresh_ahead: Fraction of an entry's lifetime after which its next
+            use refreshes it in a background greenlet, while the cached
+            value keeps being returned.
+        depends_on: Datasets which clear the whole cache when bumped, see
+            :func:`bump_version`.
     """
     def _decorator(fn):
-        @lru_cache(maxsize=maxsize, typed=typed)
-        def _new(*args, __time_salt, **kwargs):
-            return fn(*args, **kwargs)
+        cache = LRUCache(maxsize=maxsize)
+        if depends_on:
+            _timed.append((set(depends_on), cache.clear))
+        stats = _stats[f'{fn.__module__}.{fn.__qualname__}']
+        # {key: result}, calls which are currently being computed.
+        inflight: Dict[Hashable, AsyncResult] = {}
+        refreshing: Set[Hashable] = set()
+
+        def _call(_key: Hashable, *args, **kwargs):
+            start = time.time()
+
+            try:
+                res = fn(*args, **kwargs)
+            finally:
+                stats['seconds'] += time.time() - start
+
+            ttl = max_age * random.uniform(1 - jitter, 1 + jitter)
+            refresh_at = float('inf')
+            if refresh_ahead is not None:
+                refresh_at = time.time() + ttl * refresh_ahead
+
+            cache.set(_key, (res, refresh_at), (), ttl)
+            return res
+
+        def _refresh(_key: Hashable, *args, **kwargs) -> None:
+            try:
+                _call(_key, *args, **kwargs)
+            except Exception:
+                # The current value is still served till it expires.
+                traceback.print_exc()
+                stats['errors'] += 1
+            finally:
+                refreshing.discard(_key)
 
         @wraps(fn)
         def _wrapped(*args, **kwargs):
-            return _new(*args,
-                        **kwargs,
-                        __time_salt=round(time.time() / max_age))
+            _key = _make_key(args, kwargs, typed)
+
+            if (entry := cache.get(_key)) is not None:
+                stats['hits'] += 1
+                res, refresh_at = entry.value
+
+                if refresh_at < time.time() and _key not in refreshing:
+                    stats['refreshes'] += 1
+                    refreshing.add(_key)
+                    gevent.spawn(_refresh, _key, *args, **kwargs)
+
+                return res
+
+            # Someone else is already computing this, wait for them.
+            if (pending := inflight.get(_key)) is not None:
+                stats['coalesced'] += 1
+                return pending.get()
+
+            stats['misses'] += 1
+            inflight[_key] = pending = AsyncResult()
 
+            try:
+                res = _call(_key, *args, **kwargs)
+            except Exception as e:
+                stats['errors'] += 1
+                pending.set_exception(e)
+                raise
+            finally:
+                del inflight[_key]
+
+            pending.set(res)
+            return res
+
+        _wrapped.cache_info = lambda: dict(stats)  # type: ignore
+        _wrapped.cache_clear = cache.clear  # type: ignore
         return _wrapped
 
     return _decorator
@@ -66,59 +357,141 @@ def _serialize_args_to_str(*args, **kwargs) -> str:
     return ':'.join(res) + flatten_dict(kwargs)
 
 
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Get the in process cache's occupancy and every cached function's
+    counters.
+
+    >>> get_cache_stats()
+    {'l1': {'entries': 5123, 'bytes': 1830144, 'evictions': 0, ...},
+     'functions': {'syn.utils.price.get_historic_price': {'hits': 9823, ...}}}
+    """
+    return {
+        'l1': _redis_cache.info(),
+        'functions': {k: dict(v) for k, v in _stats.items()},
+    }
+
+
 def redis_cache(key: Optional[Callable[..., str]] = None,
                 expires_at: Optional[Union[int, timedelta]] = None,
                 filter: Callable[..., bool] = lambda *args, **kwargs: True,
-                is_class: bool = False):
+                is_class: bool = False,
+                depends_on: Tuple[str, ...] = ('prices', ),
+                l1_timeout: int = 24 * 60 * 60,
+                negative_timeout: int = 60,
+                field: Optional[Callable[..., str]] = None):
     """
     Fetch `key` from `REDIS` else run the function and store the response
     as `key` for later (cache) usage.
 
+    If `field` is given, `key` names a hash and responses are stored as its
+    `field` instead, e.g. a time series with a field per date.
+
+    Responses are also kept in a bounded in process LRU, concurrent calls
+    for the same `key` share a single lookup.
+
     Args:
         expires_at (Optional[int], optional): time `key` should expire. Defaults to None.
+        depends_on (Tuple[str, ...]): datasets the internal (in process) copy
+            is invalidated by, see :func:`bump_version`.
+        l1_timeout (int): upper bound of how long the internal copy is
+            kept, in case a version bump gets lost.
+        negative_timeout (int): how long responses rejected by `filter`
+            (e.g. a price which is still missing) are kept internally.
+        field (Optional[Callable[..., str]]): called with the function's
+            arguments, returns the field of the `key` hash to use.
     """
     def _decorator(fn):
-        @wraps(fn)
-        def _wrapped(*args, **kwargs):
-            if key is None:
-                _key = _serialize_args_to_str(*args,
-                                              **kwargs,
-                                              is_class=is_class)
-            else:
-                _key = key(*args, **kwargs, is_class=is_class)
-
-            # Check internal cache.
-            if (data := _redis_cache.get(_key)) is not None:
-                return data
+        stats = _stats[f'{fn.__module__}.{fn.__qualname__}']
+        # {key: result}, calls which are currently being looked up.
+        inflight: Dict[str, AsyncResult] = {}
 
+        def _lookup(_key: str, _field: Optional[str],
+                    version: Tuple[int, ...], *args, **kwargs):
+            name = _key
             # Check redis cache.
-            if (data := REDIS.get(_key)) is not None:
+            if _field is not None:
+                data = REDIS.hget(name, _field)
+                # The internal cache is keyed by both.
+                _key = f'{name}:{_field}'
+            else:
+                data = REDIS.get(name)
+
+            if data is not None:
                 if isinstance(data, str):
                     try:
                         data = json.loads(data, use_decimal=True)
                     except json.JSONDecodeError:
                         pass
 
-                # 5m
-                _redis_cache.add(_key, data, timeout=60 * 5)
+                stats['redis_hits'] += 1
+                _redis_cache.set(_key, data, version, l1_timeout)
 
                 return data
 
             # Missed, update cache.
+            stats['misses'] += 1
             res = fn(*args, **kwargs)
 
             if filter(res):
                 if not isinstance(res, (str, bytes, float, int)):
-                    _redis_cache.add(_key, res, timeout=60 * 5)
                     _res = json.dumps(res)
                 else:
-                    _redis_cache.add(_key, res, timeout=60 * 5)
                     _res = res
 
-                REDIS.set(_key, _res, expires_at)
+                _redis_cache.set(_key, res, version, l1_timeout)
+                if _field is not None:
+                    REDIS.hset(name, _field, _res)
+                else:
+                    REDIS.set(name, _res, expires_at)
+            else:
+                # Don't redo the (slow) miss for every call, but do not keep
+                # it for long either as it may show up any moment.
+                stats['negative'] += 1
+                _redis_cache.set(_key, res, version, negative_timeout)
 
             return res
 
+        @wraps(fn)
+        def _wrapped(*args, **kwargs):
+            if key is None:
+                _key = _serialize_args_to_str(*args,
+                                              **kwargs,
+                                              is_class=is_class)
+            else:
+                _key = key(*args, **kwargs, is_class=is_class)
+
+            _field = None if field is None else field(*args, **kwargs)
+            l1_key = _key if _field is None else f'{_key}:{_field}'
+
+            # Internal cache entries are valid till `depends_on` changes.
+            version = get_versions(*depends_on)
+
+            # Check internal cache.
+            if (entry := _redis_cache.get(l1_key)) is not None:
+                if entry.version == version:
+                    stats['hits'] += 1
+                    return entry.value
+
+            # Someone else is already looking this up, wait for them.
+            if (pending := inflight.get(l1_key)) is not None:
+                stats['coalesced'] += 1
+                return pending.get()
+
+            inflight[l1_key] = pending = AsyncResult()
+
+            try:
+                res = _lookup(_key, _field, version, *args, **kwargs)
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                del inflight[l1_key]
+
+            pending.set(res)
+            return res
+
+        _wrapped.cache_info = lambda: dict(stats)  # type: ignore
         return _wrapped
 
-    return _decorator
\ No newline at end of file
+    return _decorator
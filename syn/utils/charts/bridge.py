@@ -12,9 +12,8 @@ from collections import defaultdict
 from datetime import datetime
 from decimal import Decimal
 
-from syn.utils.price import get_historic_price_for_address
-from syn.utils.helpers import get_all_keys
-from syn.utils.data import LOGS_REDIS_URL
+from syn.utils.analytics.loader import get_loader
+from syn.utils.analytics.usd import usd_value
 
 
 def chart_chain_bridge_volume(
@@ -24,18 +23,14 @@ def chart_chain_bridge_volume(
     # if direction not in ['IN', 'OUT']:
     #     raise TypeError(f'expected direction as IN or OUT got {direction!r}')
 
-    ret: Dict[str, Dict[str, str]] = get_all_keys(
-        f'{chain}:bridge:*:IN',
-        client=LOGS_REDIS_URL,
-        index=False,
-        serialize=True,
-    )
+    ret = get_loader().entries(chain, 'IN')
 
-    for k, v in ret.items():
-        _, _, date, address, _ = k.split(':')
+    for entry in ret:
+        date, address, v = entry.date, entry.token, entry.data
 
-        price = get_historic_price_for_address(chain, address, date)
         volume = Decimal(v['amount'])
+        # Priced while indexing, zero until then.
+        price = usd_value(v, 'amount') / volume if volume else Decimal(0)
 
         res[address].append({
             'date': datetime.fromisoformat(date).timestamp(),
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Any, Dict, Iterable, List, Tuple
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+import time
+import os
+
+import simplejson as json
+import requests
+
+from syn.utils.data import COINGECKO_API, MESSAGE_QUEUE_REDIS, REDIS
+
+#: Requests per second every process combined may send to CoinGecko, the
+#: public API allows 10-50 calls a minute depending on load.
+RATE = float(os.getenv('COINGECKO_RATE', 10 / 60))
+#: Requests that may be sent at once after being idle for a while.
+BURST = int(os.getenv('COINGECKO_BURST', 5))
+BUCKET_KEY = 'coingecko:bucket'
+# Ids per `simple/price` request, keeps the url at a sane length.
+IDS_PER_REQUEST = 50
+# Fields per `HSET` or keys per `MGET`.
+BATCH_SIZE = 1000
+#: Missing dates at most this many days apart are fetched with one request,
+#: as fetching the days in between is cheaper than another request.
+MAX_GAP = int(os.getenv('COINGECKO_MAX_GAP', 14))
+# How often a request is retried after being rate limited.
+RETRIES = 5
+
+#: Token bucket shared by every process, takes a token if there is one and
+#: returns 0 or returns how many seconds to wait until the next one.
+#: Uses the server's clock so workers on different hosts agree.
+#: KEYS: bucket; ARGV: rate, burst
+_TAKE_TOKEN = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1e6
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+_take_token = MESSAGE_QUEUE_REDIS.register_script(_TAKE_TOKEN)
+
+
+def acquire() -> None:
+    """
+    Block (the greenlet) until the shared rate limit allows another request.
+    """
+    while (wait := float(_take_token(keys=[BUCKET_KEY],
+                                     args=[RATE, BURST]))) > 0:
+        time.sleep(wait)
+
+
+def _get(path: str, **params: Any) -> Any:
+    for _ in range(RETRIES):
+        acquire()
+        r = requests.get(COINGECKO_API + path, params=params, timeout=30)
+
+        if r.status_code == 429:
+            # Someone else (or another app on this ip) used up the budget.
+            time.sleep(int(r.headers.get('Retry-After', 60)))
+            continue
+
+        r.raise_for_status()
+        return r.json(use_decimal=True)
+
+    raise requests.HTTPError(f'rate limited {RETRIES} times: {path}')
+
+
+def _timestamp(_date: date) -> int:
+    return int(
+        datetime(_date.year, _date.month, _date.day,
+                 tzinfo=timezone.utc).timestamp())
+
+
+def get_current_prices(ids: Iterable[str],
+                       currency: str = 'usd') -> Dict[str, Decimal]:
+    """
+    Current price of every id in `ids`, ids CoinGecko has no price for are
+    left out.
+    """
+    ids = list(ids)
+    res: Dict[str, Decimal] = {}
+
+    for i in range(0, len(ids), IDS_PER_REQUEST):
+        ret = _get('/simple/price',
+                   ids=','.join(ids[i:i + IDS_PER_REQUEST]),
+                   vs_currencies=currency)
+
+        for _id, prices in ret.items():
+            if prices.get(currency) is not None:
+                res[_id] = prices[currency]
+
+    return res
+
+
+def get_price_range(_id: str,
+                    start: date,
+                    end: date,
+                    currency: str = 'usd') -> Dict[date, Decimal]:
+    """
+    Price of `_id` for every day from `start` till `end` (inclusive) in a
+    single request, the first data point of a (UTC) day is its price.
+
+    NOTE: CoinGecko returns daily data points for ranges above 90 days and
+    hourly (or 5 minutely) ones below that.
+    """
+    ret = _get(f'/coins/{_id}/market_chart/range',
+               vs_currency=currency,
+               **{
+                   'from': _timestamp(start),
+                   'to': _timestamp(end + timedelta(days=1)) - 1,
+               })
+
+    res: Dict[date, Decimal] = {}
+    for ts, price in ret.get('prices', []):
+        _date = datetime.fromtimestamp(int(ts) / 1000, timezone.utc).date()
+
+        if start <= _date <= end and _date not in res:
+            res[_date] = price
+
+    return res
+
+
+def get_historic_price(_id: str,
+                       _date: date,
+                       currency: str = 'usd') -> Decimal:
+    ret = _get(f'/coins/{_id}/history',
+               date=_date.strftime('%d-%m-%Y'),
+               localization='false')
+    return ret['market_data']['current_price'][currency]
+
+
+def price_key(_id: str) -> str:
+    """
+    Hash holding every (usd) price of `_id` we know of, as `{date: price}`.
+    """
+    return f'prices:{_id}'
+
+
+def date_ranges(dates: Iterable[date],
+                max_gap: int = MAX_GAP) -> List[Tuple[date, date]]:
+    """
+    Group `dates` into inclusive `(start, end)` ranges, dates at most
+    `max_gap` days apart end up in the same range.
+
+    >>> date_ranges([date(2022, 1, 1), date(2022, 1, 2), date(2022, 3, 1)])
+    [(date(2022, 1, 1), date(2022, 1, 2)), (date(2022, 3, 1), ...)]
+    """
+    res: List[Tuple[date, date]] = []
+
+    for x in sorted(set(dates)):
+        if res and (x - res[-1][1]).days <= max_gap:
+            res[-1] = (res[-1][0], x)
+        else:
+            res.append((x, x))
+
+    return res
+
+
+def load_prices(
+        wanted: Dict[str, Iterable[date]]) -> Dict[str, Dict[date, str]]:
+    """
+    Fetch the stored prices of `{cgid: [date, ...]}` in a single round trip,
+    dates without a price are left out.
+    """
+    wanted = {k: list(v) for k, v in wanted.items()}
+    pipe = REDIS.pipeline(transaction=False)
+
+    for _id, dates in wanted.items():
+        pipe.hmget(price_key(_id), [str(x) for x in dates])
+
+    res: Dict[str, Dict[date, str]] = {}
+    for (_id, dates), ret in zip(wanted.items(), pipe.execute()):
+        res[_id] = {k: v for k, v in zip(dates, ret) if v is not None}
+
+    return res
+
+
+def store_prices(prices: Dict[str, Dict[date, Decimal]]) -> List[str]:
+    """
+    Write `{cgid: {date: price}}` into each id's hash, pipelined.
+
+    Returns:
+        List[str]: every `{cgid}:{date}` that got written.
+    """
+    pipe = REDIS.pipeline(transaction=False)
+    res: List[str] = []
+
+    for _id, values in prices.items():
+        if not values:
+            continue
+
+        items = [(str(k), json.dumps(v)) for k, v in values.items()]
+        for i in range(0, len(items), BATCH_SIZE):
+            pipe.hset(price_key(_id), mapping=dict(items[i:i + BATCH_SIZE]))
+
+        res.extend(f'{_id}:{k}' for k, _ in items)
+
+    pipe.execute()
+    return res
+
+
+def migrate_price_keys(ids: Iterable[str]) -> int:
+    """
+    Move prices stored as a key per (id, date, currency) into the id's hash,
+    prices which are already in the hash are kept.
+
+    Returns:
+        int: amount of keys moved.
+    """
+    ids = set(ids)
+    # `{id}:{date}` and `{id}:{date}:usd`, plain keys first so they win
+    # over `:usd` ones like they did when reading.
+    keys = sorted((x for x in REDIS.scan_iter(match='*:????-??-??*',
+                                              count=BATCH_SIZE)
+                   if x.split(':')[0] in ids and
+                   (x.count(':') == 1 or x.endswith(':usd'))),
+                  key=lambda x: x.endswith(':usd'))
+
+    for i in range(0, len(keys), BATCH_SIZE):
+        batch = keys[i:i + BATCH_SIZE]
+        values: Dict[Tuple[str, str], str] = {}
+
+        for key, value in zip(batch, REDIS.mget(batch)):
+            if value is not None and value != '0':
+                _id, field = key.split(':')[:2]
+                values.setdefault((_id, field), value)
+
+        pipe = REDIS.pipeline(transaction=False)
+        for (_id, field), value in values.items():
+            pipe.hsetnx(price_key(_id), field, value)
+        pipe.unlink(*batch)
+        pipe.execute()
+
+    return len(keys)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+CPU heavy aggregations which `syn.utils.offload` runs in worker processes,
+so they don't hold up the gevent hub.
+
+NOTE: this module must only import the stdlib and not have any side effects
+as worker processes run it as a script (`python compute.py`) without the
+rest of the package, arguments and results are pickled so keep them to
+builtins and `Decimal`s.
+"""
+
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from decimal import Decimal
+import traceback
+import struct
+import pickle
+import json
+import sys
+
+# Every message is prefixed with its length.
+FRAME = struct.Struct('<I')
+
+
+def _add(d: Dict[str, Any], key: str, value: Any) -> None:
+    d[key] = d[key] + value if key in d else value
+
+
+def outflows(
+        rows: List[Tuple[str, str]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Sum bridge `OUT` aggregates, given as `(key, json)`, per source chain,
+    day and destination chain. Aggregates without a stored usd value count
+    as zero until they got priced.
+
+    Returns:
+        Tuple: `{chain: {date: {to_chain: {tx_count, volume_usd}}}}` and
+        totals per `{chain: {to_chain: ...}}`.
+    """
+    res: Dict[str, Any] = {}
+    totals: Dict[str, Any] = {}
+
+    for key, value in rows:
+        # {chain}:bridge:{date}:{token}:OUT:{to_chain}
+        from_chain, _, date, _, _, to_chain = key.split(':')
+        data = json.loads(value, parse_float=Decimal)
+        usd = Decimal(data.get('usd', {}).get('amount', 0))
+
+        day = res.setdefault(from_chain, {}).setdefault(date, {}) \
+            .setdefault(to_chain, {})
+        total = totals.setdefault(from_chain, {}).setdefault(to_chain, {})
+
+        _add(day, 'tx_count', data['txCount'])
+        _add(total, 'tx_count', data['txCount'])
+        _add(day, 'volume_usd', usd)
+        _add(total, 'volume_usd', usd)
+
+    return res, totals
+
+
+def daily_totals(
+    values: Dict[str, List[Dict[str, Decimal]]]
+) -> Tuple[Dict[str, Dict[str, Decimal]], Dict[str, Decimal]]:
+    """
+    Sum `{chain: [{date: value}, ...]}` per day and chain.
+
+    Returns:
+        Tuple: `{date: {chain: value, 'total': value}}` and the total of
+        every chain.
+    """
+    res: Dict[str, Dict[str, Decimal]] = {}
+    totals: Dict[str, Decimal] = {}
+
+    for chain, data in values.items():
+        for x in data:
+            for date, value in x.items():
+                _add(res.setdefault(date, {}), chain, value)
+
+    for date, data in res.items():
+        for chain, value in list(data.items()):
+            _add(data, 'total', value)
+            _add(totals, chain, value)
+
+    return res, totals
+
+
+def read_frame(f: BinaryIO) -> Optional[Any]:
+    header = f.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None
+
+    size, = FRAME.unpack(header)
+    return pickle.loads(f.read(size))
+
+
+def write_frame(f: BinaryIO, value: Any) -> None:
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(FRAME.pack(len(data)) + data)
+    f.flush()
+
+
+def serve(stdin: BinaryIO, stdout: BinaryIO) -> None:
+    """
+    Answer `(func, args)` requests with `(True, result)` or `(False, error)`
+    until stdin is closed.
+    """
+    while (req := read_frame(stdin)) is not None:
+        func, args = req
+
+        try:
+            write_frame(stdout, (True, globals()[func](*args)))
+        except Exception:
+            write_frame(stdout, (False, traceback.format_exc()))
+
+
+if __name__ == '__main__':
+    # Don't let our siblings (e.g. `data.py`) shadow anything.
+    sys.path.pop(0)
+    serve(sys.stdin.buffer, sys.stdout.buffer)
@@ -44,7 +44,7 @@ def call_abi(data, key: str, func_name: str, *args, **kwargs) -> Any:
                                                    **kwargs).call(**call_args)
 
 
-@timed_cache(60)
+@timed_cache(60 * 60, depends_on=('tokens', ))
 def get_all_tokens_in_pool(chain: str,
                            max_index: Optional[int] = None,
                            func: str = 'pool_contract') -> List[str]:
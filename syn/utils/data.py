@@ -12,12 +12,12 @@ from collections import defaultdict
 import json
 import os
 
-from web3.middleware.filter import local_filter_middleware
 from apscheduler.schedulers.gevent import GeventScheduler
 from web3.middleware.geth_poa import geth_poa_middleware
 from apscheduler.jobstores.redis import RedisJobStore
 from dotenv import load_dotenv, find_dotenv
 from flask_apscheduler import APScheduler
+from flask import has_request_context, request
 from gevent.greenlet import Greenlet
 from web3.contract import Contract
 from gevent.pool import Pool
@@ -25,14 +25,18 @@ from web3 import Web3
 import gevent
 import redis
 
+from syn.utils.wrappa.governor import governor_middleware
 from syn.patches.cache import PatchedCache
 
 load_dotenv(find_dotenv('.env.sample'))
 # If `.env` exists, let it override the sample env file.
 load_dotenv(override=True)
 
-COINGECKO_HISTORIC_URL = "https://api.coingecko.com/api/v3/coins/{0}/history?date={1}&localization=false"
-COINGECKO_BASE_URL = "https://api.coingecko.com/api/v3/simple/price?ids={0}&vs_currencies={1}"
+# Point this at `cli/coingecko.py` to run against a local stand-in.
+COINGECKO_API = os.getenv('COINGECKO_API',
+                          'https://api.coingecko.com/api/v3').rstrip('/')
+COINGECKO_HISTORIC_URL = COINGECKO_API + "/coins/{0}/history?date={1}&localization=false"
+COINGECKO_BASE_URL = COINGECKO_API + "/simple/price?ids={0}&vs_currencies={1}"
 
 BRIDGE_CONFIG_ABI = """[{"inputs":[{"internalType":"string","name":"tokenAddress","type":"string"},{"internalType":"uint256","name":"chainID","type":"uint256"}],"name":"getTokenByAddress","outputs":[{"components":[{"internalType":"uint256","name":"chainId","type":"uint256"},{"internalType":"string","name":"tokenAddress","type":"string"},{"internalType":"uint8","name":"tokenDecimals","type":"uint8"},{"internalType":"uint256","name":"maxSwap","type":"uint256"},{"internalType":"uint256","name":"minSwap","type":"uint256"},{"internalType":"uint256","name":"swapFee","type":"uint256"},{"internalType":"uint256","name":"maxSwapFee","type":"uint256"},{"internalType":"uint256","name":"minSwapFee","type":"uint256"},{"internalType":"bool","name":"hasUnderlying","type":"bool"},{"internalType":"bool","name":"isUnderlying","type":"bool"}],"internalType":"struct BridgeConfigV3.Token","name":"token","type":"tuple"}],"stateMutability":"view","type":"function"}]"""
 MINICHEF_ABI = """[{"inputs":[],"name":"synapsePerSecond","outputs":[{"internalType":"uint256","name":"","type":"uint256"}],"stateMutability":"view","type":"function"}]"""
@@ -82,7 +86,7 @@ else:
     POPULATE_CACHE = False
 
 if POPULATE_CACHE:
-    print('`POPULATE_CACHE` set to true, disable this during deployment.')
+    print('`POPULATE_CACHE` set to true, every view is rewarmed on start.')
 
 NULL_ADDR = '0x0000000000000000000000000000000000000000'
 
@@ -103,8 +107,11 @@ SCHEDULER_CONFIG = {
 
 schedular = APScheduler(scheduler=GeventScheduler())
 
-CACHE_FORCED_UPDATE = POPULATE_CACHE
-_forced_update = lambda: CACHE_FORCED_UPDATE
+# Set in the WSGI environ of requests made by the cache warmer (see
+# :func:`syn.utils.warm.warm`), which always recompute the view.
+WARM_ENVIRON = 'syn.warm'
+_forced_update = lambda: has_request_context() and request.environ.get(
+    WARM_ENVIRON, False)
 
 SYN_DECIMALS = 18
 SYN_DATA = {
@@ -286,7 +293,10 @@ for key, value in SYN_DATA.items():
     if key != 'ethereum':
         w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
-    w3.middleware_onion.add(local_filter_middleware)
+    # Innermost, so it only sees requests which actually hit the rpc.
+    w3.middleware_onion.inject(governor_middleware(key),
+                               name='governor',
+                               layer=0)
     print(key)
     try:
         print(w3.eth.syncing)
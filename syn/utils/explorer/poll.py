@@ -7,83 +7,254 @@
           https://www.boost.org/LICENSE_1_0.txt)
 """
 
-from typing import List, Callable, Tuple, Iterable, Optional
+from typing import Any, Dict, List, Optional, Tuple
+import time
+import os
 
-from web3.datastructures import AttributeDict
-from web3.types import TxReceipt, EventData
-from web3.contract import Contract
-from web3.logs import DISCARD
+from web3.types import FilterParams, LogReceipt
+from hexbytes import HexBytes
 from gevent.pool import Pool
-from gevent import Greenlet
+import simplejson as json
 from web3 import Web3
-import gevent
 
-from syn.utils.explorer.data import EVENTS, TOPICS, Direction
-from syn.utils.data import BRIDGE_ABI, SYN_DATA
+from syn.utils.explorer.data import (CHAINS, TOKENS_IN_POOL, TOPIC_TO_EVENT,
+                                     TOPICS)
+from syn.utils.data import BRIDGE_ABI, MESSAGE_QUEUE_REDIS, SYN_DATA
+from syn.utils.helpers import convert, convert_amount, get_max_blocks
 
-CB = Callable[
-    [AttributeDict, str, AttributeDict, str, Direction, AttributeDict], None]
-pool = Pool()
+#: Channel the `bridge` (OUT) and `confirm` (IN) messages get published on as
+#: `{"event": ..., "data": ...}` json, any amount of processes can subscribe
+#: to it (see `syn.routes.api.v1.explorer.ws`).
+CHANNEL = 'explorer:bridge'
+#: Seconds between polls of a chain's head.
+POLL_INTERVAL = float(os.getenv('FEED_POLL', 2))
+#: Receipts fetched at once per chain.
+CONCURRENCY = int(os.getenv('FEED_CONCURRENCY', 8))
+# Seconds to wait for a receipt.
+RECEIPT_TIMEOUT = 10
+# It's a live feed, start over from the head when further behind than this.
+MAX_LAG = 1000
+# Hash of chain -> last block published.
+CURSOR_KEY = 'explorer:cursor'
+#: Seconds either side of a transfer waits for the other one, transfers
+#: taking longer are never confirmed.
+PENDING_TTL = int(os.getenv('FEED_PENDING_TTL', 6 * 60 * 60))
 
+Message = Tuple[str, Dict[str, Any]]
 
-def figure_out_method(
-    contract: Contract, receipt: TxReceipt
-) -> Optional[Tuple[Iterable[EventData], Direction, str]]:
-    for k, v in EVENTS.items():
-        ret = contract.events[k]().processReceipt(receipt, errors=DISCARD)
 
-        if ret:
-            return ret, v, k
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (bytes, HexBytes)):
+        return '0x' + bytes(value).hex()
+    elif isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_jsonable(x) for x in value]
 
+    return value
 
-def handle_event(event: AttributeDict, chain: str, contract: Contract,
-                 cb: CB) -> None:
-    try:
-        receipt = SYN_DATA[chain]['w3'].eth.waitForTransactionReceipt(
-            event['transactionHash'], timeout=10)
-    except:
-        print(chain, event)
-        raise
 
-    try:
-        data, direction, method = figure_out_method(contract,
-                                                    receipt)  # type: ignore
-    except:
-        print(chain, event)
-        raise
+class Feed:
+    """
+    Tails `chain`'s bridge events with `eth_getLogs` over the blocks since
+    the last poll, decodes them by their topic and publishes them along with
+    their receipt's details in the order they happened.
+    """
+    def __init__(self, chain: str) -> None:
+        self.chain = chain
+        self.w3: Web3 = SYN_DATA[chain]['w3']
+        self.address = Web3.toChecksumAddress(SYN_DATA[chain]['bridge'])
+        self.contract = self.w3.eth.contract(self.address, abi=BRIDGE_ABI)
+        self.pool = Pool(CONCURRENCY)
+        # The ABI may not have every event (e.g. `TokenRedeemV2`).
+        names = {x['name'] for x in BRIDGE_ABI if x['type'] == 'event'}
+        self.topics = [k for k, v in TOPIC_TO_EVENT.items() if v in names]
+        # Last block published.
+        self.head: Optional[int] = None
 
-    data = data[0]['args']  # type: ignore
-    cb(event, chain, data, method, direction, receipt.logs)
+    def decode(self, log: LogReceipt) -> Dict[str, Any]:
+        # No need to try every event, the topic tells which one it is.
+        topic = convert(log['topics'][0])
+        method = TOPIC_TO_EVENT[topic]
+        data = self.contract.events[method]().processLog(log)
+        receipt = self.w3.eth.wait_for_transaction_receipt(
+            log['transactionHash'], timeout=RECEIPT_TIMEOUT)
 
+        return {
+            'chain': self.chain,
+            'method': method,
+            'direction': str(TOPICS[topic]),
+            'args': _jsonable(dict(data['args'])),
+            'block': log['blockNumber'],
+            'log_index': log['logIndex'],
+            'tx_hash': convert(log['transactionHash']),
+            'status': receipt['status'],
+            # Swaps emit the token's own events first, `[0]` is what got in.
+            'log_addresses': [x['address'] for x in receipt['logs']],
+        }
 
-def log_loop(filter, chain: str, contract: Contract, poll: int, cb: CB):
-    while True:
-        for event in filter.get_new_entries():
-            # print(chain, event)
-            handle_event(event, chain, contract, cb)
+    def _get_logs(self, start: int, end: int) -> List[LogReceipt]:
+        res: List[LogReceipt] = []
+        step = min(get_max_blocks(self.chain) or MAX_LAG, MAX_LAG)
 
-        gevent.sleep(poll)
+        for x in range(start, end + 1, step):
+            params: FilterParams = {
+                'fromBlock': x,
+                'toBlock': min(x + step - 1, end),
+                'address': self.address,
+                'topics': [self.topics],  # type: ignore
+            }
+            res.extend(self.w3.eth.get_logs(params))
 
+        return sorted(res, key=lambda k: (k['blockNumber'], k['logIndex']))
 
-def start(cb: CB):
-    jobs: List[Greenlet] = []
+    def poll(self) -> int:
+        """
+        Publish every event since the last poll.
 
-    for chain, x in SYN_DATA.items():
-        _address = Web3.toChecksumAddress(x['bridge'])
+        Returns:
+            int: amount of events published.
+        """
+        head = self.w3.eth.block_number
+        ret = MESSAGE_QUEUE_REDIS.hget(CURSOR_KEY, self.chain)
 
-        filter = x['w3'].eth.filter({
-            'address': _address,
-            'fromBlock': 'latest',
-            'topics': [list(TOPICS)],
-        })
+        if ret is not None and head - int(ret) <= MAX_LAG:
+            start = int(ret) + 1
+        else:
+            start = head
 
-        jobs.append(
-            pool.spawn(log_loop,
-                       filter,
-                       chain,
-                       x['w3'].eth.contract(_address, abi=BRIDGE_ABI),
-                       poll=2,
-                       cb=cb))
+        if start > head:
+            self.head = head
+            return 0
 
-    # This will never sanely finish.
-    gevent.joinall(jobs)
+        logs = self._get_logs(start, head)
+
+        # Receipts are fetched concurrently, `imap` still yields in order.
+        for event in self.pool.imap(self.decode, logs):
+            for name, data in match(event):
+                MESSAGE_QUEUE_REDIS.publish(
+                    CHANNEL, json.dumps({
+                        'event': name,
+                        'data': data
+                    }))
+
+        MESSAGE_QUEUE_REDIS.hset(CURSOR_KEY, self.chain, head)
+        self.head = head
+        return len(logs)
+
+
+def pending_key(kappa: str) -> str:
+    # Hash of `OUT` and `IN` -> (json) side of the transfer seen so far.
+    return f'explorer:pending:{kappa}'
+
+
+def get_kappa(event: Dict[str, Any]) -> str:
+    """
+    The bridge request id, `IN` events carry it while for `OUT` ones it is
+    the hash of their transaction's hash.
+    """
+    if event['direction'] == 'IN':
+        return event['args']['kappa']
+
+    return Web3.keccak(text=event['tx_hash']).hex()
+
+
+def _sent(event: Dict[str, Any]) -> Dict[str, Any]:
+    chain, args, method = event['chain'], event['args'], event['method']
+    to_chain = CHAINS.get(args['chainId'])
+    pool = TOKENS_IN_POOL[to_chain]['nusd'] if to_chain else {}
+
+    if method in ['TokenRedeem', 'TokenDeposit']:
+        from_token = to_token = args['token']
+    elif method == 'TokenRedeemAndRemove':
+        from_token = args['token']
+        to_token = pool.get(args['swapTokenIndex'])
+    else:
+        # Swapped into the bridged token first, what got in is logged first.
+        from_token = event['log_addresses'][0]
+        to_token = pool.get(args['tokenIndexTo'])
+
+    return {
+        'address': args['to'],
+        'from_chain': chain,
+        'to_chain': to_chain,
+        'amount': float(convert_amount(chain, args['token'], args['amount'])),
+        'time': time.time(),
+        'txhash': event['tx_hash'],
+        'from_token': from_token,
+        'to_token': to_token,
+    }
+
+
+def _received(event: Dict[str, Any]) -> Dict[str, Any]:
+    chain, args, method = event['chain'], event['args'], event['method']
+    pool = TOKENS_IN_POOL[chain]['nusd']
+
+    if method == 'TokenMintAndSwap':
+        to_token = pool.get(args['tokenIndexTo'])
+    elif method == 'TokenWithdrawAndRemove':
+        to_token = pool.get(args['swapTokenIndex'])
+    else:
+        to_token = args['token']
+
+    res = {
+        'address': args['to'],
+        'to_chain': chain,
+        'fee': float(convert_amount(chain, args['token'], args['fee'])),
+        'amount': float(convert_amount(chain, args['token'], args['amount'])),
+        'time': time.time(),
+        'txhash': event['tx_hash'],
+        'to_token': to_token,
+    }
+
+    if 'swapSuccess' in args:
+        res['success'] = args['swapSuccess']
+
+    return res
+
+
+def _confirm(sent: Dict[str, Any],
+             received: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **received,
+        'from_chain': sent['from_chain'],
+        'from_token': sent['from_token'],
+        'time_taken': received['time'] - sent['time'],
+    }
+
+
+def match(event: Dict[str, Any]) -> List[Message]:
+    """
+    Match `event` with the other side of its transfer, which may have been
+    seen by another process (the chains are split between them) or before
+    a restart, as both sides are kept in redis by the transfer's kappa.
+
+    Returns:
+        List[Message]: `bridge` for an `OUT` and `confirm` once both sides
+        were seen, nothing for events which were seen before.
+    """
+    side = event['direction']
+    other = 'IN' if side == 'OUT' else 'OUT'
+    data = _sent(event) if side == 'OUT' else _received(event)
+    key = pending_key(get_kappa(event))
+
+    pipe = MESSAGE_QUEUE_REDIS.pipeline()
+    pipe.hsetnx(key, side, json.dumps(data))
+    pipe.hget(key, other)
+    pipe.expire(key, PENDING_TTL)
+    created, ret, _ = pipe.execute()
+
+    if not created:
+        # Replayed, e.g. the cursor was lost or we got restarted mid poll.
+        return []
+
+    res: List[Message] = [('bridge', data)] if side == 'OUT' else []
+
+    if ret is not None:
+        # Both sides stay till the key expires, so replays remain no-ops.
+        if side == 'OUT':
+            res.append(('confirm', _confirm(data, json.loads(ret))))
+        else:
+            res.append(('confirm', _confirm(json.loads(ret), data)))
+
+    return res
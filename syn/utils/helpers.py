@@ -9,7 +9,7 @@
 from __future__ import annotations
 
 from typing import Any, List, Dict, Literal, Optional, TypeVar, Union, cast, \
-    Callable, Generator, TYPE_CHECKING, DefaultDict
+    Callable, Generator, TYPE_CHECKING, DefaultDict, Tuple
 from datetime import datetime, timedelta, date
 from collections import defaultdict
 import contextlib
@@ -31,6 +31,7 @@ import bech32
 
 from syn.utils.data import (REDIS, TOKEN_DECIMALS, SYN_DATA, LOGS_REDIS_URL,
                             _cb, _tk_d, _sml_adr, TOKENS_INFO, new_tokens_file)
+from syn.utils.cache import bump_version, on_invalidate, publish_invalidation
 
 if TYPE_CHECKING:
     from syn.utils.contract import _TokenInfo
@@ -175,6 +176,105 @@ def get_gas_stats_for_tx(chain: str,
     }
 
 
+# Block each pool was deployed at, so indexing does not start at genesis.
+_POOL_START_BLOCKS = {
+    'ethereum': {
+        'nusd': 13033711,
+    },
+    'avalanche': {
+        'nusd': 6619002,
+        'neth': 7378400,
+    },
+    'bsc': {
+        'nusd': 12431591,
+    },
+    'polygon': {
+        'nusd': 21071348,
+    },
+    'arbitrum': {
+        'nusd': 2876718,
+        'neth': 762758,
+        '3pool': 5152261,
+    },
+    'fantom': {
+        'nusd': 21297076,
+        'neth': 28288390,
+        '3pool': 29236172,
+    },
+    'harmony': {
+        'nusd': 19163634,
+    },
+    'boba': {
+        'nusd': 16221,
+        'neth': 49329,
+    },
+    'optimism': {
+        'neth': 30819,
+        'nusd': 6045403,
+    },
+    'aurora': {
+        'nusd': 56441515,
+    },
+    'metis': {
+        'nusd': 1251758,
+        'neth': 1698938,
+    },
+    'cronos': {
+        'nusd': 2511054,
+    },
+    'klaytn': {
+        'nusd': 94136612,
+    },
+    'canto': {
+        'nusd': 1060258
+    }
+}
+
+# Amount of blocks per `eth_getLogs` call for chains whose rpc limits it.
+_MAX_BLOCKS = {
+    'harmony': 1024,
+    'bsc': 1024,
+    'ethereum': 1024,
+    'moonriver': 1024,
+    'aurora': 1024,
+    'moonbeam': 1024,
+    'dfk': 1024,
+    'cronos': 2000,
+    'boba': 512,
+    'polygon': 2048,
+    'avalanche': 2048,
+}
+
+
+def get_log_targets(
+        chain: str,
+        address_key: Union[str, Literal[-1]] = 'bridge'
+) -> List[Tuple[str, Optional[int]]]:
+    """
+    Every `(address, start_block)` of `chain` to index, `address_key` is
+    either a key of `SYN_DATA[chain]` or -1 for all of the chain's pools.
+    """
+    if address_key != -1:
+        return [(SYN_DATA[chain][cast(str, address_key)], None)]
+
+    res: List[Tuple[str, Optional[int]]] = []
+
+    for pool, key in [('nusd', 'pool'), ('neth', 'ethpool'),
+                      ('3pool', '3pool')]:
+        if f'{key}_contract' in SYN_DATA[chain]:
+            res.append((SYN_DATA[chain][key], _POOL_START_BLOCKS[chain][pool]))
+
+    return res
+
+
+def get_max_blocks(chain: str) -> Optional[int]:
+    """
+    Amount of blocks `chain`'s rpc allows per `eth_getLogs` call, None if
+    the default is fine.
+    """
+    return _MAX_BLOCKS.get(chain)
+
+
 def dispatch_get_logs(
     cb: Callable[[str, str, LogReceipt], None],
     topics: List[str] = None,
@@ -185,141 +285,23 @@ def dispatch_get_logs(
     from .wrappa.rpc import get_logs, TOPICS
 
     jobs: List[Greenlet] = []
+    topics = topics or list(TOPICS)
 
     for chain in SYN_DATA:
-        start_block = None
-        addresses = []
-
-        # Some logic to dispatch different addresses for bridge and swap events.
-        if address_key != -1:
-            addresses.append([SYN_DATA[chain][cast(str, address_key)], None])
-        else:
-            _start_blocks = {
-                'ethereum': {
-                    'nusd': 13033711,
-                },
-                'avalanche': {
-                    'nusd': 6619002,
-                    'neth': 7378400,
-                },
-                'bsc': {
-                    'nusd': 12431591,
-                },
-                'polygon': {
-                    'nusd': 21071348,
-                },
-                'arbitrum': {
-                    'nusd': 2876718,
-                    'neth': 762758,
-                    '3pool': 5152261,
-                },
-                'fantom': {
-                    'nusd': 21297076,
-                    'neth': 28288390,
-                    '3pool': 29236172,
-                },
-                'harmony': {
-                    'nusd': 19163634,
-                },
-                'boba': {
-                    'nusd': 16221,
-                    'neth': 49329,
-                },
-                'optimism': {
-                    'neth': 30819,
-                    'nusd': 6045403,
-                },
-                'aurora': {
-                    'nusd': 56441515,
-                },
-                'metis': {
-                    'nusd': 1251758,
-                    'neth': 1698938,
-                },
-                'cronos': {
-                    'nusd': 2511054,
-                },
-                'klaytn': {
-                    'nusd': 94136612,
-                },
-                'canto': {
-                    'nusd': 1060258
-                }
-            }
-
-            if 'pool_contract' in SYN_DATA[chain]:
-                _start_block = _start_blocks[chain]['nusd']
-                addresses.append([SYN_DATA[chain]['pool'], _start_block])
-
-            if 'ethpool_contract' in SYN_DATA[chain]:
-                _start_block = _start_blocks[chain]['neth']
-                addresses.append([SYN_DATA[chain]['ethpool'], _start_block])
-
-            if '3pool_contract' in SYN_DATA[chain]:
-                _start_block = _start_blocks[chain]['3pool']
-                addresses.append([SYN_DATA[chain]['3pool'], _start_block])
-
-        topics = topics or list(TOPICS)
-
-        for x in addresses:
-            address, start_block = x[0], x[1]
-            if chain in [
-                    'harmony',
-                    'bsc',
-                    'ethereum',
-                    'moonriver',
-                    'aurora',
-                    'moonbeam',
-                    'dfk',
-            ]:
-                jobs.append(
-                    gevent.spawn(get_logs,
-                                 chain,
-                                 cb,
-                                 address,
-                                 max_blocks=1024,
-                                 topics=topics,
-                                 start_block=start_block,
-                                 key_namespace=key_namespace))
-            elif chain == 'cronos':
-                jobs.append(
-                    gevent.spawn(get_logs,
-                                 chain,
-                                 cb,
-                                 address,
-                                 max_blocks=2000,
-                                 topics=topics,
-                                 start_block=start_block,
-                                 key_namespace=key_namespace))
-            elif chain == 'boba':
-                jobs.append(
-                    gevent.spawn(get_logs,
-                                 chain,
-                                 cb,
-                                 address,
-                                 max_blocks=512,
-                                 topics=topics,
-                                 start_block=start_block,
-                                 key_namespace=key_namespace))
-            elif chain in ['polygon', 'avalanche']:
-                jobs.append(
-                    gevent.spawn(get_logs,
-                                 chain,
-                                 cb,
-                                 address,
-                                 max_blocks=2048,
-                                 topics=topics,
-                                 start_block=start_block,
-                                 key_namespace=key_namespace))
-            else:
-                jobs.append(
-                    gevent.spawn(get_logs,
-                                 chain,
-                                 cb,
-                                 address,
-                                 topics=topics,
-                                 start_block=start_block,
-                                 key_namespace=key_namespace))
+        kwargs = {}
+        if (max_blocks := get_max_blocks(chain)) is not None:
+            kwargs['max_blocks'] = max_blocks
+
+        for address, start_block in get_log_targets(chain, address_key):
+            jobs.append(
+                gevent.spawn(get_logs,
+                             chain,
+                             cb,
+                             address,
+                             topics=topics,
+                             start_block=start_block,
+                             key_namespace=key_namespace,
+                             **kwargs))
 
     if join_all:
         gevent.joinall(jobs)
@@ -567,13 +549,16 @@ def retry(func: Callable[..., T], *args, **kwargs) -> T:
     for i in range(attempts):
         try:
             return func(*args, **kwargs)
-        except Exception:
+        except Exception as e:
             print(f'retry attempt {i}, args: {args}')
             traceback.print_exc()
-            gevent.sleep(3**i)
+            error = e
+
+            if i + 1 < attempts:
+                gevent.sleep(3**i)
 
     logging.critical(f'maximum retries ({attempts}) reached')
-    raise
+    raise error
 
 
 def calculate_volume_totals(volume: Dict[str, Any]) -> Dict[str, D]:
@@ -628,24 +613,42 @@ def date2block(chain: str, date: date) -> Optional[Dict[str, int]]:
     return ret
 
 
+def _add_token(chain: str, token: str) -> Dict[str, Any]:
+    w3: Web3 = SYN_DATA[chain]['w3']
+
+    _cb(w3, chain, token)
+    data = TOKENS_INFO[chain][token]
+
+    _tk_d(chain, token, data['decimals'])
+    _sml_adr(chain, data['symbol'], token)
+
+    return data
+
+
 def update_global_data(chain: str, token: str) -> None:
     """
-    Update all global data dicts with a new token
+    Update all global data dicts with a new token, every other worker is
+    told to do the same.
     NOTE: Used as a runtime addition of data
     """
-    w3: Web3 = SYN_DATA[chain]['w3']
     token = token.lower()
 
     assert token not in TOKENS_INFO[chain], f'{token=} {chain=} already exists'
 
-    _cb(w3, chain, token)
-    data = TOKENS_INFO[chain][token]
-
-    _tk_d(chain, token, data['decimals'])
-    _sml_adr(chain, data['symbol'], token)
+    data = _add_token(chain, token)
 
     text = f'new token {chain} {token} {data}'
     print(text)
 
     with open(new_tokens_file, 'w+') as f:
         f.write(text + '\n')
+
+    publish_invalidation('token', chain=chain, token=token)
+    bump_version(f'tokens:{chain}')
+
+
+@on_invalidate('token')
+def _on_new_token(data: Dict[str, Any]) -> None:
+    # Another worker (or node) came across a new token.
+    if data['token'] not in TOKENS_INFO[data['chain']]:
+        _add_token(data['chain'], data['token'])
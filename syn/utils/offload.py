@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Any, Callable, Dict, Optional
+from collections import defaultdict
+import subprocess
+import time
+import sys
+import os
+
+from gevent.queue import Queue, Empty
+from gevent.lock import Semaphore
+import gevent
+
+from syn.utils import compute
+
+#: Worker processes per (web) worker, 0 runs everything in the hub.
+WORKERS = int(os.getenv('OFFLOAD_WORKERS', 2))
+#: Seconds a call may take before its worker gets killed.
+TIMEOUT = float(os.getenv('OFFLOAD_TIMEOUT', 60))
+# Seconds between checks of how late the hub is running.
+HUB_INTERVAL = 0.1
+# The hub being late by more than this counts as blocked.
+HUB_THRESHOLD = 0.05
+
+_stats: Dict[str, Any] = defaultdict(float)
+
+
+class OffloadError(Exception):
+    pass
+
+
+class _FuncError(OffloadError):
+    # The function raised, rather than the worker failing to run it.
+    pass
+
+
+class _Worker:
+    def __init__(self) -> None:
+        # gevent's (patched) subprocess, pipes don't block the hub.
+        self.proc = subprocess.Popen([sys.executable, compute.__file__],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def call(self, func: str, args: tuple) -> Any:
+        compute.write_frame(self.proc.stdin, (func, args))
+
+        if (ret := compute.read_frame(self.proc.stdout)) is None:
+            raise OffloadError(f'worker({self.proc.pid}) died running {func}')
+
+        ok, value = ret
+        if not ok:
+            raise _FuncError(f'{func} failed in worker({self.proc.pid}):\n'
+                             f'{value}')
+
+        return value
+
+    def kill(self) -> None:
+        self.proc.kill()
+        self.proc.wait()
+
+
+class _Pool:
+    """
+    Worker processes are started on first use and replaced once they died
+    or got killed after a timeout.
+    """
+    def __init__(self, size: int = WORKERS) -> None:
+        self.size = size
+        self.idle: Queue = Queue()
+        self.slots = Semaphore(size)
+
+    def call(self, func: str, args: tuple, timeout: float) -> Any:
+        with self.slots:
+            try:
+                worker = self.idle.get_nowait()
+            except Empty:
+                worker = _Worker()
+
+            try:
+                with gevent.Timeout(timeout):
+                    res = worker.call(func, args)
+            except _FuncError:
+                # It answered, just with `func`'s error, so it's still fine.
+                self.idle.put(worker)
+                raise
+            except BaseException:
+                # Halfway through a message or stuck, either way unusable.
+                worker.kill()
+                raise
+
+            self.idle.put(worker)
+            return res
+
+
+_pool: Optional[_Pool] = None
+
+
+def offload(func: Callable[..., Any],
+            *args: Any,
+            timeout: float = TIMEOUT) -> Any:
+    """
+    Run `func` (from :mod:`syn.utils.compute`) with `args` in a worker
+    process and wait for it without blocking other greenlets.
+
+    Raises:
+        gevent.Timeout: `func` took longer than `timeout` seconds.
+        OffloadError: `func` raised or its worker died.
+    """
+    global _pool
+
+    assert getattr(compute, func.__name__, None) is func, \
+        f'{func.__name__} is not in syn.utils.compute'
+
+    start = time.time()
+    _stats[f'{func.__name__}:calls'] += 1
+
+    try:
+        if WORKERS <= 0:
+            res = func(*args)
+            _stats['inline_seconds'] += time.time() - start
+            return res
+
+        if _pool is None:
+            _pool = _Pool()
+
+        return _pool.call(func.__name__, args, timeout)
+    except gevent.Timeout:
+        _stats[f'{func.__name__}:timeouts'] += 1
+        raise
+    except OffloadError:
+        _stats[f'{func.__name__}:errors'] += 1
+        raise
+    finally:
+        _stats[f'{func.__name__}:seconds'] += time.time() - start
+
+
+def watch_hub(interval: float = HUB_INTERVAL,
+              threshold: float = HUB_THRESHOLD) -> None:
+    """
+    Measure how long the hub was blocked for, by how late a sleeping
+    greenlet gets to run again.
+    """
+    while True:
+        start = time.perf_counter()
+        gevent.sleep(interval)
+        late = time.perf_counter() - start - interval
+
+        if late > threshold:
+            _stats['hub_blocked'] += 1
+            _stats['hub_blocked_seconds'] += late
+            _stats['hub_blocked_max'] = max(_stats['hub_blocked_max'], late)
+
+
+def get_offload_stats() -> Dict[str, Any]:
+    """
+    Counters of this process, e.g.
+
+    >>> get_offload_stats()
+    {'workers': 2, 'outflows:calls': 12.0, 'outflows:seconds': 3.1,
+     'hub_blocked': 4.0, 'hub_blocked_seconds': 0.9, ...}
+    """
+    return {'workers': WORKERS, **_stats}
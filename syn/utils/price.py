@@ -8,14 +8,16 @@
 """
 
 from datetime import datetime, timedelta
+from typing import Optional
 from decimal import Decimal
 from enum import Enum
 import logging
 
 import dateutil.parser
 
-from syn.utils.data import REDIS, POPULATE_CACHE, MESSAGE_QUEUE_REDIS
-from syn.utils.cache import redis_cache, _serialize_args_to_str
+from syn.utils.data import REDIS, MESSAGE_QUEUE_REDIS
+from syn.utils.coingecko import price_key
+from syn.utils.cache import redis_cache
 from syn.utils.helpers import date_range
 
 logger = logging.Logger(__name__)
@@ -65,6 +67,30 @@ class CoingeckoIDS(Enum):
     NOTE = 'note'
 
 
+# Map the chain to their native token (what gas is paid in).
+CHAIN_TO_CGID = {
+    'ethereum': CoingeckoIDS.ETH,
+    'avalanche': CoingeckoIDS.AVAX,
+    'bsc': CoingeckoIDS.BNB,
+    'polygon': CoingeckoIDS.MATIC,
+    'arbitrum': CoingeckoIDS.ETH,
+    'fantom': CoingeckoIDS.FTM,
+    'harmony': CoingeckoIDS.ONE,
+    'boba': CoingeckoIDS.ETH,
+    'moonriver': CoingeckoIDS.MOVR,
+    'optimism': CoingeckoIDS.ETH,
+    'aurora': CoingeckoIDS.ETH,
+    'moonbeam': CoingeckoIDS.GLMR,
+    'cronos': CoingeckoIDS.CRO,
+    'metis': CoingeckoIDS.METIS,
+    'dfk': CoingeckoIDS.JEWEL,
+    'klaytn': CoingeckoIDS.KLAY,
+    'canto': CoingeckoIDS.CANTO,
+}
+
+# SYN was not listed on CoinGecko before this, but was pegged 1:2.5 to NRV.
+SYN_LISTED = '2021-08-30'
+
 CUSTOM = {
     'ethereum': {
         # nUSD
@@ -358,33 +384,49 @@ ADDRESS_TO_CGID = {
 }
 
 
+def _price_date(date: str) -> str:
+    # Callers pass either isoformat or CoinGecko's `dd-mm-yyyy` dates, this
+    # runs on every lookup so avoid parsing the common cases.
+    date = str(date)
+
+    if len(date) == 10 and date[4] == '-':
+        return date
+    elif len(date) == 10 and date[2] == '-':
+        day, month, year = date.split('-')
+        return f'{year}-{month}-{day}'
+
+    return dateutil.parser.parse(date).date().isoformat()
+
+
+def _price_key(_id: CoingeckoIDS, *args, **kwargs) -> str:
+    return price_key(_id.value if isinstance(_id, CoingeckoIDS) else _id)
+
+
+def _price_field(_id: CoingeckoIDS, date: str, currency: str = 'usd') -> str:
+    assert currency == 'usd', f'only usd prices are stored: {currency!r}'
+    return _price_date(date)
+
+
 # Fetch prices from cache but DO NOT actually cache responses.
-@redis_cache(filter=lambda _: False)
+@redis_cache(key=_price_key, field=_price_field, filter=lambda _: False)
 def get_historic_price(_id: CoingeckoIDS,
                        date: str,
                        currency: str = "usd") -> Decimal:
     # If this function is running here, price has not been indexed yet by
     # the worker. Data should be returned by `redis_cache()`
-    if POPULATE_CACHE:
-        return Decimal()
-
-    MESSAGE_QUEUE_REDIS.sadd(
-        'prices:missing', *[
-            _serialize_args_to_str(_id, date, currency),
-            _serialize_args_to_str(_id, date)
-        ])
-
-    _date = dateutil.parser.parse(date)
-    for date in date_range(_date, _date - timedelta(days=7)):
-        _key = _serialize_args_to_str(_id, date)
-        keys = [_key, f'{_key}:usd']
-
-        for key in keys:
-            if (data := REDIS.get(key)) is not None:
-                # NOTE: data could be 0.
-                return Decimal(data)
-            else:
-                MESSAGE_QUEUE_REDIS.sadd('prices:missing', key)
+    _date = _price_date(date)
+    cgid = _id.value if isinstance(_id, CoingeckoIDS) else _id
+    MESSAGE_QUEUE_REDIS.sadd('prices:missing', f'{cgid}:{_date}')
+
+    # Fall back to the closest price of the week before, only the requested
+    # date is missing as that's the one which will get filled.
+    day = datetime.fromisoformat(_date)
+    dates = list(date_range(day - timedelta(days=1), day - timedelta(days=8)))
+
+    for data in REDIS.hmget(price_key(cgid), dates):
+        if data is not None:
+            # NOTE: data could be 0.
+            return Decimal(data)
 
     # Did not converge, just fallback to 0.
     logging.warning(f'returned 0 for {_id} @ {date}')
@@ -392,10 +434,8 @@ def get_historic_price(_id: CoingeckoIDS,
 
 
 def get_historic_price_syn(date: str, currency: str = "usd") -> Decimal:
-    dt = dateutil.parser.parse(date)
-
     # SYN price didn't exist here on CG but was pegged 1:2.5 to NRV.
-    if dt < datetime(year=2021, month=8, day=30):
+    if _price_date(date) < SYN_LISTED:
         return get_historic_price(CoingeckoIDS.NRV, date,
                                   currency) / Decimal('2.5')
 
@@ -417,6 +457,41 @@ def get_historic_price_for_address(chain: str, address: str,
     return get_historic_price(ADDRESS_TO_CGID[chain][address], date)
 
 
+def lookup_historic_price(_id: CoingeckoIDS, date: str) -> Optional[Decimal]:
+    """
+    The stored price of `_id` on `date`, None if it is not known (yet).
+    Unlike :func:`get_historic_price` this never falls back to another day.
+    """
+    cgid = _id.value if isinstance(_id, CoingeckoIDS) else _id
+    data = REDIS.hget(price_key(cgid), _price_date(date))
+
+    if data is None or data == '0':
+        return None
+
+    return Decimal(data)
+
+
+def lookup_historic_price_for_address(chain: str, address: str,
+                                      date: str) -> Optional[Decimal]:
+    """
+    Like :func:`get_historic_price_for_address` but None if the price of
+    `date` is not known (yet), see :func:`lookup_historic_price`. Tokens
+    without a coingecko id are not known either.
+    """
+    if address in CUSTOM.get(chain, {}):
+        return Decimal(CUSTOM[chain][address])
+    elif address not in ADDRESS_TO_CGID.get(chain, {}):
+        return None
+    elif ADDRESS_TO_CGID[chain][address] == CoingeckoIDS.SYN \
+            and _price_date(date) < SYN_LISTED:
+        if (price := lookup_historic_price(CoingeckoIDS.NRV, date)) is None:
+            return None
+
+        return price / Decimal('2.5')
+
+    return lookup_historic_price(ADDRESS_TO_CGID[chain][address], date)
+
+
 def get_price_for_address(chain: str, address: str) -> Decimal:
     if address in CUSTOM[chain]:
         return Decimal(CUSTOM[chain][address])
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Any, Optional, Tuple
+import hashlib
+import pickle
+import struct
+import fcntl
+import mmap
+import os
+
+# Prefer a tmpfs, NOTE: docker limits /dev/shm to 64MiB by default.
+SHM_PATH = os.getenv(
+    'SHM_PATH', '/dev/shm/syn-views' if os.path.isdir('/dev/shm') else
+    os.path.join(os.getcwd(), 'runtime', 'views.shm'))
+SHM_SLOTS = int(os.getenv('SHM_SLOTS', 512))
+SHM_SLOT_SIZE = int(os.getenv('SHM_SLOT_SIZE', 64 * 1024))
+# How often a read is retried when it raced with a write.
+RETRIES = 3
+
+# Every slot starts with: sequence, md5 of the key, length of the value.
+_HEADER = struct.Struct('<Q16sI')
+_SEQ = struct.Struct('<Q')
+_EMPTY = bytes(16)
+
+
+class SharedCache:
+    """
+    Fixed size, direct mapped cache in a memory mapped file which every
+    worker on the node shares, a key can only live in the one slot its hash
+    points to and simply replaces whatever was there.
+
+    Reads are lock free using a seqlock, writers make the slot's sequence
+    odd while writing it and even again once done. Readers miss when the
+    sequence was odd or changed while they copied the value out. Writers
+    lock their slot so only one process writes it at a time, a write to a
+    busy slot is skipped as it's just a cache.
+    """
+    def __init__(self,
+                 path: str = SHM_PATH,
+                 slots: int = SHM_SLOTS,
+                 slot_size: int = SHM_SLOT_SIZE) -> None:
+        self.slots = slots
+        self.slot_size = slot_size
+
+        size = slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+
+        self._mm = mmap.mmap(self._fd, size)
+
+    def _locate(self, key: str) -> Tuple[bytes, int]:
+        digest = hashlib.md5(key.encode()).digest()
+        slot = int.from_bytes(digest[:8], 'little') % self.slots
+        return digest, slot * self.slot_size
+
+    def get(self, key: str) -> Optional[Any]:
+        digest, offset = self._locate(key)
+        start = offset + _HEADER.size
+
+        for _ in range(RETRIES):
+            seq, _digest, length = _HEADER.unpack_from(self._mm, offset)
+            if seq & 1:
+                # Being written.
+                continue
+
+            if _digest != digest or start + length > offset + self.slot_size:
+                return None
+
+            data = self._mm[start:start + length]
+            if _SEQ.unpack_from(self._mm, offset)[0] == seq:
+                return pickle.loads(data)
+
+        return None
+
+    def _write(self, digest: bytes, offset: int, data: bytes) -> bool:
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB,
+                        self.slot_size, offset)
+        except OSError:
+            # Someone else is writing this slot.
+            return False
+
+        try:
+            seq = _SEQ.unpack_from(self._mm, offset)[0]
+            # A writer died halfway, the slot is garbage either way.
+            seq += seq & 1
+
+            _SEQ.pack_into(self._mm, offset, seq + 1)
+            start = offset + _HEADER.size
+            self._mm[start:start + len(data)] = data
+            _HEADER.pack_into(self._mm, offset, seq + 1, digest, len(data))
+            _SEQ.pack_into(self._mm, offset, seq + 2)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+        return True
+
+    def set(self, key: str, value: Any) -> bool:
+        """
+        Store `value`, returns False if it does not fit in a slot or the
+        slot is being written by someone else.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size - _HEADER.size:
+            return False
+
+        return self._write(*self._locate(key), data)
+
+    def delete(self, key: str) -> None:
+        digest, offset = self._locate(key)
+
+        if _HEADER.unpack_from(self._mm, offset)[1] == digest:
+            self._write(_EMPTY, offset, b'')
+
+
+_shared: Optional[SharedCache] = None
+
+
+def get_shared_cache() -> SharedCache:
+    global _shared
+
+    if _shared is None:
+        _shared = SharedCache()
+
+    return _shared
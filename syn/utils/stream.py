@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+Decoded events of every chain go through a stream per chain, the indexer
+only fetches and decodes logs into it while consumer groups (one per kind of
+aggregate) build the rollups from it. A new group starts from the first
+event, so new aggregates never have to touch the rpc.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import traceback
+import hashlib
+import time
+import os
+
+from redis.exceptions import ResponseError
+from redis.client import Pipeline
+import simplejson as json
+
+from syn.utils.data import LOGS_REDIS_URL
+
+#: Entries (approximately) kept in every chain's stream, 0 keeps everything
+#: so aggregates can always be rebuilt from the very first event.
+MAXLEN = int(os.getenv('STREAM_MAXLEN', 0))
+#: Entries read (and acknowledged) at once.
+BATCH_SIZE = int(os.getenv('STREAM_BATCH', 500))
+#: The group building the `{chain}:bridge:*` and `{chain}:pool:*` rollups.
+ROLLUPS = 'rollups'
+
+#: Days after an event's day (or after applying it, if later) its id is still
+#: remembered as applied, replays of older events are only safe after their
+#: aggregates were dropped.
+APPLIED_DAYS = int(os.getenv('STREAM_APPLIED_DAYS', 45))
+
+#: Attempts after which a dead letter is parked, for someone to look at.
+DEAD_ATTEMPTS = int(os.getenv('STREAM_DEAD_ATTEMPTS', 10))
+# Upper bound of the seconds between attempts of a dead letter.
+DEAD_MAX_BACKOFF = 6 * 60 * 60
+
+# Entries trimmed away while pending come back without an event.
+Entry = Tuple[str, Optional[Dict[str, Any]]]
+
+
+def stream_key(chain: str) -> str:
+    return f'{chain}:events'
+
+
+def publish(chain: str,
+            event: Optional[Dict[str, Any]],
+            cursor: Optional[Tuple[str, str, int, int]] = None) -> None:
+    """
+    Append `event` to `chain`'s stream, along with moving the indexer's
+    `(namespace, address, block, tx_index)` cursor past it in the same
+    transaction so an event is never published twice or skipped. Logs which
+    decode to no event only move the cursor.
+    """
+    pipe = LOGS_REDIS_URL.pipeline()
+
+    if event is not None:
+        pipe.xadd(stream_key(chain), {'data': json.dumps(event)},
+                  maxlen=MAXLEN or None,
+                  approximate=True)
+
+    _set_cursor(pipe, chain, cursor)
+    pipe.execute()
+
+
+def _set_cursor(pipe: Pipeline, chain: str,
+                cursor: Optional[Tuple[str, str, int, int]]) -> None:
+    if cursor is not None:
+        namespace, address, block, tx_index = cursor
+        pipe.set(f'{chain}:{namespace}:{address}:MAX_BLOCK_STORED', block)
+        pipe.set(f'{chain}:{namespace}:{address}:TX_INDEX', tx_index)
+
+
+def create_group(chain: str, group: str, start: str = '0') -> bool:
+    """
+    Create `group` on `chain`'s stream, reading from `start` (the first
+    event by default). Returns False if it already existed.
+    """
+    try:
+        return LOGS_REDIS_URL.xgroup_create(stream_key(chain),
+                                            group,
+                                            id=start,
+                                            mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+        return False
+
+
+def replay(chain: str, group: str, start: str = '0') -> None:
+    """
+    Deliver every event from `start` onwards to `group` again, e.g. after
+    its aggregate was dropped to be rebuilt.
+    """
+    create_group(chain, group, start)
+    LOGS_REDIS_URL.xgroup_setid(stream_key(chain), group, start)
+
+
+def claim(chain: str, group: str, consumer: str) -> int:
+    """
+    Take over every entry delivered to, but never acknowledged by, other
+    consumers of `group`. Only the holder of the chain's lease consumes it,
+    so whoever held it before is gone.
+
+    Returns:
+        int: amount of entries claimed.
+    """
+    # Not `XAUTOCLAIM`, redis-py 4.1 drops the cursor it replies with.
+    start, res = '-', 0
+
+    while True:
+        ret = LOGS_REDIS_URL.xpending_range(stream_key(chain),
+                                            group,
+                                            min=start,
+                                            max='+',
+                                            count=BATCH_SIZE)
+        ids = [x['message_id'] for x in ret if x['consumer'] != consumer]
+
+        if ids:
+            res += len(
+                LOGS_REDIS_URL.xclaim(stream_key(chain),
+                                      group,
+                                      consumer,
+                                      0,
+                                      ids,
+                                      justid=True))
+
+        if len(ret) < BATCH_SIZE:
+            return res
+
+        # Claimed entries stay pending, so carry on after the last one.
+        start = f'({ret[-1]["message_id"]}'
+
+
+def read(chain: str,
+         group: str,
+         consumer: str,
+         pending: bool = False,
+         block: Optional[int] = None) -> List[Entry]:
+    """
+    Read the next batch for `consumer`, or with `pending` the entries it was
+    handed already but did not acknowledge yet.
+    """
+    streams = {stream_key(chain): '0' if pending else '>'}
+    ret = LOGS_REDIS_URL.xreadgroup(group,
+                                    consumer,
+                                    streams,
+                                    count=BATCH_SIZE,
+                                    block=None if pending else block)
+    res: List[Entry] = []
+
+    for _, entries in ret or []:
+        for _id, fields in entries:
+            res.append((_id, json.loads(fields['data'], use_decimal=True)
+                        if fields else None))
+
+    return res
+
+
+def ack(chain: str, group: str, ids: List[str]) -> None:
+    if ids:
+        LOGS_REDIS_URL.xack(stream_key(chain), group, *ids)
+
+
+def get_groups(chain: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Every group of `chain`'s stream along with how far it got.
+    """
+    try:
+        ret = LOGS_REDIS_URL.xinfo_groups(stream_key(chain))
+    except ResponseError:
+        # No stream yet.
+        return {}
+
+    return {x['name']: x for x in ret}
+
+
+def applied_key(chain: str, date: str) -> str:
+    # Set of every event (see `event_id`) of the day applied to the rollups.
+    return f'{chain}:applied:{date}'
+
+
+def event_id(event: Dict[str, Any]) -> str:
+    """
+    Identifies an event by `(txHash, logIndex)`, 64 bits of a hash of it to
+    keep the per day sets small.
+    """
+    return hashlib.sha1(f'{event["tx_hash"]}:{event["log_index"]}'.encode()
+                        ).hexdigest()[:16]
+
+
+def apply_once(
+    chain: str,
+    event: Dict[str, Any],
+    date: str,
+    key: str,
+    update: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]],
+    on_create: Optional[Callable[[Pipeline], None]] = None,
+    on_apply: Optional[Callable[[Pipeline], None]] = None,
+) -> bool:
+    """
+    Replace the (json) aggregate at `key` with `update(current)`, unless
+    `event` was applied before. The read, write and marking the event as
+    applied happen in one `WATCH`ed transaction, so events may be applied
+    concurrently, out of order or more than once.
+
+    Args:
+        date (str): the event's day, its id is remembered for
+            :data:`APPLIED_DAYS` after it (or after now if that's later).
+        update: called with the current aggregate (None if there is none
+            yet) and returns the new one, may be called again on conflicts.
+        on_create: queues extra commands for when `key` gets created.
+        on_apply: queues extra commands for whenever `event` gets applied.
+
+    Returns:
+        bool: whether the event got applied, False if it was already.
+    """
+    applied = applied_key(chain, date)
+    _id = event_id(event)
+    # Backfills and replays of old days re-apply them now, not back then.
+    expires = max(
+        datetime.fromisoformat(date).replace(tzinfo=timezone.utc),
+        datetime.now(timezone.utc)) + timedelta(days=APPLIED_DAYS + 1)
+
+    def _apply(pipe: Pipeline) -> bool:
+        if pipe.sismember(applied, _id):
+            return False
+
+        ret = pipe.get(key)
+        value = update(None if ret is None else json.loads(ret,
+                                                           use_decimal=True))
+
+        pipe.multi()
+        pipe.set(key, json.dumps(value))
+        pipe.sadd(applied, _id)
+        pipe.expireat(applied, expires)
+
+        if ret is None and on_create is not None:
+            on_create(pipe)
+
+        if on_apply is not None:
+            on_apply(pipe)
+
+        return True
+
+    return LOGS_REDIS_URL.transaction(_apply,
+                                      key,
+                                      applied,
+                                      value_from_callable=True)
+
+
+def dead_key(chain: str) -> str:
+    return f'{chain}:dead'
+
+
+def _schedule(entry: Dict[str, Any]) -> Dict[str, Any]:
+    attempts = entry.setdefault('attempts', 0)
+
+    if attempts >= DEAD_ATTEMPTS:
+        entry['retry_at'] = None
+    else:
+        entry['retry_at'] = time.time() + min(DEAD_MAX_BACKOFF,
+                                              60 * 2**attempts)
+
+    return entry
+
+
+def dead_letter(chain: str,
+                entry: Dict[str, Any],
+                cursor: Optional[Tuple[str, str, int, int]] = None) -> None:
+    """
+    Park a log (or event) which failed with its `error` in `chain`'s dead
+    letter stream, so whatever failed does not hold up the rest. Moves the
+    indexer's `cursor` past it like :func:`publish` does.
+
+    Entries have a `stage`, which is either `decode` along with the raw
+    `log`, its `namespace` and `address`, or `apply` with the `event` and
+    the `group` it failed in.
+    """
+    pipe = LOGS_REDIS_URL.pipeline()
+    pipe.xadd(dead_key(chain), {'data': json.dumps(_schedule(entry))})
+    _set_cursor(pipe, chain, cursor)
+    pipe.execute()
+
+
+def get_dead_letters(chain: str) -> List[Entry]:
+    return [(_id, json.loads(fields['data'], use_decimal=True))
+            for _id, fields in LOGS_REDIS_URL.xrange(dead_key(chain))]
+
+
+def retry_dead_letters(
+        chain: str, handler: Callable[[str, Dict[str, Any]],
+                                      None]) -> Tuple[int, int]:
+    """
+    Run `handler` for every dead letter of `chain` which is due, ones that
+    fail again are rescheduled with a longer backoff. Handlers should be
+    idempotent (see :func:`apply_once`), they may race the live pipeline.
+
+    Returns:
+        Tuple[int, int]: amount of entries which succeeded and failed.
+    """
+    now, done, failed = time.time(), 0, 0
+
+    for _id, entry in get_dead_letters(chain):
+        assert entry is not None
+
+        if entry['retry_at'] is None or entry['retry_at'] > now:
+            continue
+
+        try:
+            handler(chain, entry)
+        except Exception:
+            entry.update(error=traceback.format_exc(),
+                         attempts=entry['attempts'] + 1)
+            failed += 1
+
+            pipe = LOGS_REDIS_URL.pipeline()
+            pipe.xdel(dead_key(chain), _id)
+            pipe.xadd(dead_key(chain), {'data': json.dumps(_schedule(entry))})
+            pipe.execute()
+        else:
+            LOGS_REDIS_URL.xdel(dead_key(chain), _id)
+            done += 1
+
+    return done, failed
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Iterator, List, Tuple
+import time
+
+from gevent.pool import Pool
+from flask import Flask
+
+from syn.utils.data import (SYN_DATA, MESSAGE_QUEUE_REDIS, WARM_ENVIRON,
+                            symbol_to_address)
+from syn.utils.cache import get_versions
+
+# Amount of views we render at once.
+CONCURRENCY = 4
+#: Hash of path -> versions of the data it was last warmed with.
+WARMED_KEY = 'cache:warmed'
+
+
+def expensive_routes() -> Iterator[str]:
+    """
+    Every path of the expensive views, which are derived from indexed data
+    and prices.
+    """
+    yield '/api/v1/analytics/volume/total/in'
+    yield '/api/v1/analytics/volume/total/out'
+    yield '/api/v1/analytics/volume/total/tx_count/in'
+    yield '/api/v1/analytics/volume/total/tx_count/out'
+    yield '/api/v1/analytics/volume/total/detailed/out'
+    yield '/api/v1/analytics/pools/volume/total'
+
+    for chain in SYN_DATA:
+        tokens = symbol_to_address.get(chain, {})
+
+        for direction in ['in', 'out']:
+            yield f'/api/v1/analytics/volume/{chain}/{direction}'
+
+            for token in tokens:
+                yield (f'/api/v1/analytics/volume/{chain}/filter/{token}/'
+                       f'{direction}')
+
+        for token in tokens:
+            yield f'/api/v1/analytics/fees/bridge/{chain}/{token}'
+
+        yield f'/api/v1/analytics/fees/validator/{chain}'
+        yield f'/api/v1/analytics/fees/airdrop/{chain}/'
+        yield f'/api/v1/charts/bridge/{chain}'
+
+        if 'pool_contract' in SYN_DATA[chain]:
+            yield f'/api/v1/analytics/pools/volume/{chain}/nusd'
+        if 'ethpool_contract' in SYN_DATA[chain]:
+            yield f'/api/v1/analytics/pools/volume/{chain}/neth'
+
+
+def warm(app: Flask, force: bool = False) -> int:
+    """
+    Render every expensive view whose data changed since it was last warmed
+    (or every one of them if `force` is set), see `depends_on` of
+    :meth:`syn.patches.cache.PatchedCache.cached`.
+
+    Returns:
+        int: amount of views rendered.
+    """
+    adapter = app.url_map.bind('localhost')
+    warmed = MESSAGE_QUEUE_REDIS.hgetall(WARMED_KEY)
+    todo: List[Tuple[str, str]] = []
+
+    for path in expensive_routes():
+        endpoint, view_args = adapter.match(path)
+        depends_on = getattr(app.view_functions[endpoint], 'depends_on',
+                             None) or []
+        versions = str(
+            get_versions(*[x.format(**view_args) for x in depends_on]))
+
+        if force or warmed.get(path) != versions:
+            todo.append((path, versions))
+
+    def _warm(path: str, versions: str) -> None:
+        start = time.time()
+        ret = app.test_client().get(path,
+                                    environ_overrides={WARM_ENVIRON: True})
+
+        if ret.status_code != 200:
+            print(f'warming {path} failed with {ret.status_code}')
+            return
+
+        MESSAGE_QUEUE_REDIS.hset(WARMED_KEY, path, versions)
+        print(f'warmed {path} in {time.time() - start:.2f}s')
+
+    pool = Pool(CONCURRENCY)
+    for path, versions in todo:
+        pool.spawn(_warm, path, versions)
+
+    pool.join()
+    return len(todo)
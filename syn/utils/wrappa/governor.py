@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+"""
+
+from typing import Any, Callable, Dict, Optional
+from collections import defaultdict
+import time
+import os
+
+from web3.types import RPCEndpoint, RPCResponse
+from gevent.lock import BoundedSemaphore
+from web3 import Web3
+import requests
+
+#: Requests in flight per chain, `RPC_CONCURRENCY_{CHAIN}` (e.g.
+#: `RPC_CONCURRENCY_ETHEREUM=4`) overrides it per chain.
+CONCURRENCY = int(os.getenv('RPC_CONCURRENCY', 16))
+#: Seconds a request may wait for a free slot before being rejected.
+QUEUE_TIMEOUT = float(os.getenv('RPC_QUEUE_TIMEOUT', 10))
+#: Consecutive failures after which the breaker opens.
+FAILURES = int(os.getenv('RPC_BREAKER_FAILURES', 5))
+#: Seconds an open breaker rejects requests for before letting one through.
+COOLDOWN = float(os.getenv('RPC_BREAKER_COOLDOWN', 30))
+# JSON-RPC error codes providers use for rate limiting.
+RATE_LIMITED = {-32005, -32029, 429}
+
+
+class RPCRejected(Exception):
+    pass
+
+
+#: Errors which say nothing about the request itself, retrying it later on
+#: will (eventually) work. Callers should back off rather than give up on it.
+TRANSIENT_ERRORS = (RPCRejected, requests.ConnectionError, requests.Timeout,
+                    requests.HTTPError)
+
+
+class Governor:
+    """
+    Bounds the requests in flight to a chain's rpc and stops sending any
+    for a while once it keeps failing (or rate limits us), so callers fail
+    fast instead of piling up retries against it.
+
+    The breaker is closed normally, opens after :data:`FAILURES` failures in
+    a row or a 429 and lets a single request through after the cooldown. It
+    closes again if that one succeeds.
+    """
+    def __init__(self, chain: str) -> None:
+        self.chain = chain
+        self.size = int(
+            os.getenv(f'RPC_CONCURRENCY_{chain.upper()}', CONCURRENCY))
+        self.slots = BoundedSemaphore(self.size)
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.stats: Dict[str, float] = defaultdict(float)
+
+    @property
+    def state(self) -> str:
+        if self.open_until == 0:
+            return 'closed'
+
+        return 'open' if time.time() < self.open_until else 'half-open'
+
+    def _admit(self) -> None:
+        state = self.state
+
+        if state == 'open' or (state == 'half-open' and self.probing):
+            self.stats['rejected'] += 1
+            raise RPCRejected(f'{self.chain} rpc breaker is open')
+
+        # Only the first request after the cooldown probes the rpc.
+        self.probing = state == 'half-open'
+
+    def _trip(self, cooldown: float = COOLDOWN) -> None:
+        if self.state == 'closed':
+            self.stats['trips'] += 1
+            print(f'{self.chain} rpc breaker opened for {cooldown:.0f}s')
+
+        self.open_until = time.time() + cooldown
+
+    def _failed(self, cooldown: Optional[float] = None) -> None:
+        self.stats['failures'] += 1
+        self.failures += 1
+
+        if cooldown is not None or self.probing or self.failures >= FAILURES:
+            self._trip(cooldown or COOLDOWN)
+
+    def _succeeded(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+
+    def call(self, make_request: Callable[[RPCEndpoint, Any], RPCResponse],
+             method: RPCEndpoint, params: Any) -> RPCResponse:
+        self._admit()
+
+        start = time.time()
+        if not self.slots.acquire(timeout=QUEUE_TIMEOUT):
+            self.probing = False
+            self.stats['queue_timeouts'] += 1
+            raise RPCRejected(f'{self.chain} rpc queue is full')
+
+        waited = time.time() - start
+        self.stats['queue_wait_seconds'] += waited
+        self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'],
+                                           waited)
+        self.stats['calls'] += 1
+
+        try:
+            res = make_request(method, params)
+        except requests.HTTPError as e:
+            retry_after = None
+
+            if e.response is not None and e.response.status_code == 429:
+                self.stats['rate_limited'] += 1
+                ret = e.response.headers.get('Retry-After', '')
+                # It may also be a date, just use our cooldown then.
+                retry_after = float(ret) if ret.isdigit() else COOLDOWN
+
+            self._failed(retry_after)
+            raise
+        except (requests.ConnectionError, requests.Timeout):
+            self._failed()
+            raise
+        finally:
+            self.probing = False
+            self.slots.release()
+
+        error = res.get('error') if isinstance(res, dict) else None
+        if isinstance(error, dict) and error.get('code') in RATE_LIMITED:
+            self.stats['rate_limited'] += 1
+            self._failed(COOLDOWN)
+        else:
+            self._succeeded()
+
+        return res
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'size': self.size,
+            'in_flight': self.size - self.slots.counter,
+            **self.stats,
+        }
+
+
+_governors: Dict[str, Governor] = {}
+
+
+def governor_middleware(chain: str) -> Callable[..., Any]:
+    """
+    Web3 middleware running every request of `chain` through its
+    :class:`Governor`, inject it as the innermost layer so every request
+    that actually hits the rpc is counted.
+    """
+    governor = _governors.setdefault(chain, Governor(chain))
+
+    def middleware(make_request: Callable[[RPCEndpoint, Any], RPCResponse],
+                   w3: Web3) -> Callable[[RPCEndpoint, Any], RPCResponse]:
+        def _middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+            return governor.call(make_request, method, params)
+
+        return _middleware
+
+    return middleware
+
+
+def get_rpc_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Breaker state and counters of every chain's rpc in this process.
+    """
+    return {k: v.info() for k, v in _governors.items()}
@@ -7,12 +7,17 @@
           https://www.boost.org/LICENSE_1_0.txt)
 """
 
-from typing import Callable, Dict, cast, List, TypeVar, Union
+from typing import Any, Callable, Dict, cast, List, Optional, TypeVar, Union
 from datetime import datetime
 from pprint import pformat
+import traceback
 import time
 
 from web3.types import FilterParams, LogReceipt, TxData
+from web3.datastructures import AttributeDict
+from hexbytes import HexBytes
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.client import Pipeline
 from gevent.pool import Pool
 import simplejson as json
 from web3 import Web3
@@ -23,7 +28,11 @@ from syn.utils.helpers import (get_gas_stats_for_tx, handle_decimals,
                                convert, parse_tx_in, update_global_data, retry)
 from syn.utils.data import SYN_DATA, LOGS_REDIS_URL, TOKEN_DECIMALS
 from syn.utils.explorer.data import TOPICS, Direction
+from syn.utils.analytics.usd import price_entry
+from syn.utils.analytics.sums import add_sums
+from syn.utils.stream import apply_once, dead_letter, publish
 from syn.utils.contract import get_bridge_token_info
+from syn.utils.wrappa.governor import TRANSIENT_ERRORS
 
 _start_blocks = {
     # 'ethereum': 13136427,  # 2021-09-01
@@ -126,11 +135,17 @@ airdrop_ranges = {
 
 pool = Pool(size=64)
 MAX_BLOCKS = 5000
+# Attempts of a callback before its log is dead lettered.
+CALLBACK_ATTEMPTS = 3
 T = TypeVar('T')
 
 
-def bridge_callback(chain: str, address: str, log: LogReceipt,
-                    first_run: bool) -> None:
+def decode_bridge(chain: str, address: str,
+                  log: LogReceipt) -> Optional[Dict[str, Any]]:
+    """
+    Fetch everything a bridge log's aggregate needs from the rpc, returns
+    None for logs which should not be aggregated (unsupported tokens).
+    """
     w3: Web3 = SYN_DATA[chain]['w3']
     tx_hash = log['transactionHash']
 
@@ -184,7 +199,7 @@ def bridge_callback(chain: str, address: str, log: LogReceipt,
                     asset,
                 )
 
-            return
+            return None
         else:
             # New token added.
             update_global_data(chain, asset)
@@ -213,19 +228,40 @@ def bridge_callback(chain: str, address: str, log: LogReceipt,
     # Just in case we ever need that later for debugging
     # value['txs'] = f'[{convert(tx_hash)}]'
 
-    key = f'{chain}:bridge:{date}:{asset}:{direction}{_chain}'
+    return {
+        'kind': 'bridge',
+        'address': address,
+        'block': block_n,
+        'timestamp': timestamp,
+        'tx_hash': convert(tx_hash),
+        'log_index': log['logIndex'],
+        'key': f'{chain}:bridge:{date}:{asset}:{direction}{_chain}',
+        'value': value,
+    }
+
+
+def apply_bridge(chain: str, event: Dict[str, Any]) -> bool:
+    """
+    Add a decoded bridge event (see :func:`decode_bridge`) to its daily
+    aggregate, events which were applied before are skipped.
+    """
+    key, value = event['key'], event['value']
+    # {chain}:bridge:{date}:{token}:{direction}[:{to_chain}]
+    _, _, date, asset, direction = key.split(':')[:5]
 
-    if (ret := LOGS_REDIS_URL.get(key)) is not None:
-        ret = json.loads(ret, use_decimal=True)
+    def _update(ret: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if ret is None:
+            # Readers only sum usd values, so price it right away.
+            return price_entry(chain, asset, date, dict(value))
 
-        if direction == Direction.IN:
+        if direction == 'IN':
             if 'validator' not in ret:
                 raise RuntimeError(
                     f'No validator for key = {key}, ret = {pformat(ret, indent=2)}'
                 )
             if 'validator' not in value:
                 raise RuntimeError(
-                    f'No validator: chain = {chain}, tx_hash = {convert(tx_hash)}'
+                    f'No validator: chain = {chain}, tx_hash = {event["tx_hash"]}'
                 )
 
             if chain in airdrop_ranges:
@@ -240,27 +276,55 @@ def bridge_callback(chain: str, address: str, log: LogReceipt,
         # Just in case we ever need that later for debugging
         # ret['txs'] += ' ' + value['txs']
 
-        LOGS_REDIS_URL.set(key, json.dumps(ret))
-    else:
+        return price_entry(chain, asset, date, ret)
+
+    def _first_of_day(pipe: Pipeline) -> None:
         # NOTE: we push this into the bridge callback rather than it's own
         # callback to save some rpc calls, why can't they be free? *sigh*.
         # First bridge tx of the day; store this block so we can later map
         # date to block, which is a limitation of eth rpc. However this should
         # not get confused with the FIRST block of the day, rather it is the
         # first block of the day which contains a bridge event.
-        _key = f'{chain}:date2block:{date}'
-        LOGS_REDIS_URL.setnx(
-            _key, json.dumps({
-                'block': block_n,
-                'timestamp': timestamp,
+        pipe.setnx(
+            f'{chain}:date2block:{date}',
+            json.dumps({
+                'block': event['block'],
+                'timestamp': event['timestamp'],
             }))
 
-        LOGS_REDIS_URL.set(key, json.dumps(value))
+    def _add_sums(pipe: Pipeline) -> None:
+        # In the same transaction, so sums never miss or repeat an event.
+        add_sums(pipe, chain, direction, asset, date, value)
+
+    return apply_once(chain, event, date, key, _update, _first_of_day,
+                      _add_sums)
+
+
+def bridge_callback(chain: str, address: str, log: LogReceipt,
+                    first_run: bool) -> None:
+    # Aggregating happens on the other side of the stream, see `syn.indexer`.
+    publish(chain, decode_bridge(chain, address, log),
+            ('logs', address, log['blockNumber'], log['transactionIndex']))
+
+
+def restore_log(raw: Dict[str, Any]) -> LogReceipt:
+    """
+    Turn a log stored as json (e.g. a dead letter's) back into what
+    `eth.get_logs` returns.
+    """
+    return cast(
+        LogReceipt,
+        AttributeDict({
+            **raw,
+            'topics': [HexBytes(x) for x in raw['topics']],
+            'blockHash': HexBytes(raw['blockHash']),
+            'transactionHash': HexBytes(raw['transactionHash']),
+        }))
 
-    LOGS_REDIS_URL.set(f'{chain}:logs:{address}:MAX_BLOCK_STORED',
-                       log['blockNumber'])
-    LOGS_REDIS_URL.set(f'{chain}:logs:{address}:TX_INDEX',
-                       log['transactionIndex'])
+
+def scanned_key(chain: str, namespace: str, address: str) -> str:
+    # Every block till (and including) this one has been scanned for logs.
+    return f'{chain}:{namespace}:{address}:SCANNED'
 
 
 def get_logs(
@@ -274,11 +338,17 @@ def get_logs(
     key_namespace: str = 'logs',
     start_blocks: Dict[str, int] = _start_blocks,
     prefer_db_values: bool = True,
-) -> None:
+    verbose: bool = True,
+) -> int:
+    """
+    Index every log of `address` from `start_block` till `till_block` (the
+    head by default) and return the amount of logs found.
+    """
     w3: Web3 = SYN_DATA[chain]['w3']
     _chain = f'[{chain}]'
     chain_len = max(len(c) for c in SYN_DATA) + 2
     tx_index = -1
+    _key_scanned = scanned_key(chain, key_namespace, address)
 
     if start_block is None or prefer_db_values:
         _key_block = f'{chain}:{key_namespace}:{address}:MAX_BLOCK_STORED'
@@ -292,6 +362,11 @@ def get_logs(
         else:
             _start_block = start_blocks[chain]
 
+        # Blocks after the last log may have been scanned already as well.
+        if (ret := LOGS_REDIS_URL.get(_key_scanned)) is not None \
+                and int(ret) >= _start_block:
+            _start_block, tx_index = int(ret) + 1, -1
+
         if start_block is not None and prefer_db_values:
             # We don't want to go back in blocks we already checked.
             start_block = max(_start_block, start_block)
@@ -301,9 +376,9 @@ def get_logs(
     if till_block is None:
         till_block = w3.eth.block_number
 
-    print(
-        f'{key_namespace} | {_chain:{chain_len}} starting from {start_block} '
-        f'with block height of {till_block}')
+    if verbose:
+        print(f'{key_namespace} | {_chain:{chain_len}} starting from '
+              f'{start_block} with block height of {till_block}')
 
     jobs: List[gevent.Greenlet] = []
     _start = time.time()
@@ -341,14 +416,36 @@ def get_logs(
                 continue
 
             try:
-                retry(callback, chain, address, log, first_run)
-            except Exception as e:
-                print(chain, log)
-                raise e
+                retry(callback,
+                      chain,
+                      address,
+                      log,
+                      first_run,
+                      attempts=CALLBACK_ATTEMPTS)
+            except (*TRANSIENT_ERRORS, RedisConnectionError):
+                # Nothing wrong with the log, stop so the worker backs off
+                # and picks up from it again. Parking it would apply it out
+                # of order (e.g. after a pool's later fee changes).
+                raise
+            except Exception:
+                # Park it rather than stalling the whole chain, it's retried
+                # later on by `retry_dead_letters`.
+                print(f'{key_namespace} | {_chain} dead lettering', log)
+                dead_letter(
+                    chain, {
+                        'stage': 'decode',
+                        'namespace': key_namespace,
+                        'address': address,
+                        'log': json.loads(Web3.toJSON(log)),
+                        'error': traceback.format_exc(),
+                    }, (key_namespace, address, log['blockNumber'],
+                        log['transactionIndex']))
 
             if first_run:
                 first_run = False
 
+        LOGS_REDIS_URL.set(_key_scanned, to_block)
+
         start_block += max_blocks + 1
 
         y = time.time() - _start
@@ -357,10 +454,32 @@ def get_logs(
         percent = 100 * (to_block - initial_block) \
             / (till_block - initial_block)
 
-        print(f'{key_namespace} | {_chain:{chain_len}} elapsed {y:5.1f}s'
-              f' ({y - x:5.1f}s), found {total_events:5} events,'
-              f' {percent:4.1f}% done: so far at block {start_block}')
+        if verbose:
+            print(f'{key_namespace} | {_chain:{chain_len}} elapsed {y:5.1f}s'
+                  f' ({y - x:5.1f}s), found {total_events:5} events,'
+                  f' {percent:4.1f}% done: so far at block {start_block}')
         x = y
 
     gevent.joinall(jobs)
-    print(f'{_chain:{chain_len}} it took {time.time() - _start:.1f}s!')
+
+    # Every day before `till_block`'s day has now been fully indexed, so
+    # results derived from those days can be sealed. Only once everything
+    # before it got aggregated though, so it goes through the stream too.
+    timestamp = w3.eth.get_block(till_block)['timestamp']  # type: ignore
+    watermark = str(datetime.utcfromtimestamp(timestamp).date())
+
+    if LOGS_REDIS_URL.hget(f'{chain}:{key_namespace}:WATERMARK',
+                           address) != watermark:
+        publish(
+            chain, {
+                'kind': 'watermark',
+                'namespace': key_namespace,
+                'address': address,
+                'date': watermark,
+            })
+
+    if verbose or total_events:
+        print(f'{key_namespace} | {_chain:{chain_len}} found {total_events} '
+              f'events, it took {time.time() - _start:.1f}s!')
+
+    return total_events
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+Runs against `fakeredis`, importing `syn` would connect to every chain's rpc
+so `syn.utils.stream` is loaded on its own with just its redis client.
+"""
+
+from types import ModuleType
+import importlib.util
+import os
+import sys
+
+import pytest
+
+fakeredis = pytest.importorskip(
+    'fakeredis', reason='needs fakeredis, see requirements-dev.txt')
+
+_PATH = os.path.join(os.path.dirname(__file__), '..', 'syn', 'utils',
+                     'stream.py')
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    data = ModuleType('syn.utils.data')
+    data.LOGS_REDIS_URL = fakeredis.FakeRedis(  # type: ignore
+        decode_responses=True)
+    monkeypatch.setitem(sys.modules, 'syn.utils.data', data)
+
+    spec = importlib.util.spec_from_file_location('_stream', _PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # type: ignore
+    # Make sure we page through the pending entries.
+    module.BATCH_SIZE = 2
+    return module
+
+
+def _pending(stream, consumer):
+    ret = stream.LOGS_REDIS_URL.xpending(stream.stream_key('bsc'), 'g')
+    return {x['name']: x['pending'] for x in ret['consumers']}.get(consumer, 0)
+
+
+def test_claim_empty(stream):
+    stream.create_group('bsc', 'g')
+    assert stream.claim('bsc', 'g', 'b') == 0
+
+
+def test_claim_pending(stream):
+    stream.create_group('bsc', 'g')
+
+    for i in range(5):
+        stream.publish('bsc', {'i': i})
+
+    while stream.read('bsc', 'g', 'a'):
+        pass
+
+    assert _pending(stream, 'a') == 5
+    assert stream.claim('bsc', 'g', 'b') == 5
+    assert _pending(stream, 'a') == 0
+    assert _pending(stream, 'b') == 5
+
+    # Already ours, nothing left to take over.
+    assert stream.claim('bsc', 'g', 'b') == 0
+
+
+def test_apply_once_backfill(stream):
+    # Far older than `APPLIED_DAYS`, like a fresh deployment backfilling.
+    event = {'tx_hash': '0xdead', 'log_index': 3}
+    update = lambda x: {'count': (x or {'count': 0})['count'] + 1}
+
+    assert stream.apply_once('bsc', event, '2021-10-01', 'k', update)
+    assert not stream.apply_once('bsc', event, '2021-10-01', 'k', update)
+    assert stream.LOGS_REDIS_URL.get('k') == '{"count": 1}'
+    assert stream.LOGS_REDIS_URL.ttl(stream.applied_key('bsc', '2021-10-01')
+                                     ) > stream.APPLIED_DAYS * 24 * 60 * 60
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+          Copyright Blaze 2021.
+ Distributed under the Boost Software License, Version 1.0.
+    (See accompanying file LICENSE_1_0.txt or copy at
+          https://www.boost.org/LICENSE_1_0.txt)
+
+Runs against `fakeredis`, like `test_stream` it loads the module on its own
+with just its redis client.
+"""
+
+from decimal import Decimal
+from types import ModuleType
+import importlib.util
+import os
+import sys
+
+import pytest
+
+fakeredis = pytest.importorskip(
+    'fakeredis', reason='needs fakeredis, see requirements-dev.txt')
+
+_PATH = os.path.join(os.path.dirname(__file__), '..', 'syn', 'utils',
+                     'analytics', 'sums.py')
+
+
+@pytest.fixture
+def sums(monkeypatch):
+    data = ModuleType('syn.utils.data')
+    data.LOGS_REDIS_URL = fakeredis.FakeRedis(  # type: ignore
+        decode_responses=True)
+    monkeypatch.setitem(sys.modules, 'syn.utils.data', data)
+
+    loader = ModuleType('syn.utils.analytics.loader')
+    loader.BATCH_SIZE = 2  # type: ignore
+    monkeypatch.setitem(sys.modules, 'syn.utils.analytics.loader', loader)
+
+    spec = importlib.util.spec_from_file_location('_sums', _PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+def _add(sums, token, date, fees):
+    pipe = sums.LOGS_REDIS_URL.pipeline()
+    sums.add_sums(pipe, 'bsc', 'IN', token, date, {
+        'txCount': 1,
+        'fees': Decimal(fees)
+    })
+    pipe.execute()
+
+
+def test_get_sums(sums):
+    _add(sums, '0xa', '2022-01-01', '0.5')
+    _add(sums, '0xa', '2022-01-01', '0.25')
+    _add(sums, '0xb', '2022-01-02', '1')
+    _add(sums, '0xa', '2022-01-03', '2')
+
+    assert sums.get_sums(['bsc'], token='0xa') == {
+        'bsc': {
+            '2022-01-01': {
+                'txCount': 2,
+                'fees': Decimal('0.75')
+            },
+            '2022-01-03': {
+                'txCount': 1,
+                'fees': 2
+            },
+        }
+    }
+
+    # Bounded ranges are read with `HMGET`, dates without events are left out.
+    ret = sums.get_sums(['bsc', 'eth'],
+                        from_date='2022-01-02',
+                        to_date='2022-01-05',
+                        fields=['txCount'])
+    assert ret == {
+        'bsc': {
+            '2022-01-02': {
+                'txCount': 1
+            },
+            '2022-01-03': {
+                'txCount': 1
+            }
+        },
+        'eth': {},
+    }
+
+
+def test_build_sums(sums):
+    client = sums.LOGS_REDIS_URL
+    client.set('bsc:bridge:2022-01-01:0xa:IN', '{"txCount": 3, "fees": 1.5}')
+    client.set('bsc:bridge:2022-01-01:0xb:OUT:1', '{"txCount": 2}')
+    client.set('bsc:bridge:2022-01-02:0xa:IN', '{"txCount": 1, "fees": 1}')
+    # Left over from before, gets replaced.
+    client.hset(sums.sums_key('bsc', 'IN'), '2021-12-31:txCount', 7)
+
+    assert sums.build_sums('bsc')
+    assert not sums.build_sums('bsc')
+
+    assert sums.get_sums(['bsc'], 'OUT') == {
+        'bsc': {
+            '2022-01-01': {
+                'txCount': 2,
+                'fees': 0
+            }
+        }
+    }
+    assert sums.get_sums(['bsc'], fields=['txCount']) == {
+        'bsc': {
+            '2022-01-01': {
+                'txCount': 3
+            },
+            '2022-01-02': {
+                'txCount': 1
+            }
+        }
+    }